@@ -1,10 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Form
-from datetime import timedelta
 import uuid
 from app import schemas
 from app.services.firestore_services import user_service
-from app.core.security import create_access_token
-from app.core.config import settings
+from app.core import security
+from app.core.security import create_token_response
+from app.api.v1.firestore_deps import oauth2_scheme, get_current_active_user_firestore
 
 router = APIRouter()
 
@@ -31,19 +31,45 @@ def login_for_access_token(identifier: str = Form(..., alias="username")):
             detail="User not found with the provided identifier (anonymous_id).",
         )
 
-    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user['username'], "anonymous_id": user['anonymous_id']},
-        expires_delta=access_token_expires,
+    return create_token_response(user)
+
+@router.post("/refresh", response_model=schemas.Token)
+def refresh_access_token(refresh_token: str = Form(...)):
+    """
+    Exchanges a refresh token for a new access token with up-to-date profile claims.
+    This is the only place stateless clients hit the users collection.
+    """
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
     )
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "username": user['username'],
-        "anonymous_id": user['anonymous_id']
-    }
+    payload = security.decode_access_token(token_data=refresh_token)
+    if not payload or payload.get("type") != security.REFRESH_TOKEN_TYPE:
+        raise credentials_exception
+    if security.token_denylist.is_revoked(payload):
+        raise credentials_exception
 
-    
+    # Read the user document directly: token_version must be authoritative across instances.
+    user_service.invalidate_cached_user(payload.get("anonymous_id"))
+    user = user_service.get_user_by_anonymous_id(anonymous_id=payload.get("anonymous_id"))
+    if not user or payload.get("tv", 0) != user.get('token_version', 0):
+        raise credentials_exception
+    if not user.get("is_active"):
+        raise HTTPException(status_code=400, detail="Inactive user")
 
-        
-        
\ No newline at end of file
+    return create_token_response(user)
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+def logout(
+    token: str = Depends(oauth2_scheme),
+    current_user: dict = Depends(get_current_active_user_firestore),
+):
+    """
+    Revokes the presented access token and every refresh token of the current user.
+    """
+    payload = security.decode_access_token(token_data=token)
+    if payload and payload.get("jti"):
+        security.token_denylist.revoke_token(payload["jti"], payload.get("exp", 0))
+    user_service.revoke_refresh_tokens(current_user['anonymous_id'])
+    return
@@ -1,12 +1,15 @@
 import uuid
-from typing import List, Union, Any
-from fastapi import APIRouter, Depends, HTTPException, status, Query, WebSocket, WebSocketDisconnect
+from typing import List, Optional, Union, Any
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response, WebSocket, WebSocketDisconnect
 from app import schemas
 from app.services.firestore_services import chat_service, chat_request_service, user_service, user_relationship_service
-from app.api.v1.firestore_deps import get_current_active_user_firestore
-from app.schemas.enums import ChatAvailabilityEnum, ChatRequestStatusEnum, RelationshipTypeEnum
-from app.core.chat_manager import manager # This manager might need refactoring for a stateless environment
-from app.core import security
+from app.services.firestore_async_services import chat_service as async_chat_service
+from app.services.firestore_async_services import user_relationship_service as async_user_relationship_service
+from app.api.v1.firestore_deps import get_current_active_user_firestore, get_user_from_token
+from app.schemas.enums import ChatAvailabilityEnum, ChatRequestStatusEnum
+from app.core import concurrency
+from app.core.pagination import set_pagination_headers
+from app.core.chat_manager import manager
 
 router = APIRouter()
 
@@ -23,13 +26,17 @@ def initiate_direct_chat_or_request(
     if current_user['anonymous_id'] == str(chat_initiate_in.target_user_anonymous_id):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cannot initiate a chat with yourself.")
 
-    target_user = user_service.get_user_by_anonymous_id(str(chat_initiate_in.target_user_anonymous_id))
+    target_user_id = str(chat_initiate_in.target_user_anonymous_id)
+    # The block check reads the block documents, not the relationship cache: a block made
+    # on another instance must stop a new chat right away.
+    target_user, blocked = concurrency.fan_out(
+        lambda: user_service.get_user_by_anonymous_id(target_user_id),
+        lambda: user_relationship_service.has_block_between(current_user['anonymous_id'], target_user_id),
+    )
     if not target_user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Target user not found.")
 
-    actor_blocks_target = user_relationship_service.get_relationship(current_user['anonymous_id'], target_user['anonymous_id'], RelationshipTypeEnum.BLOCK)
-    target_blocks_actor = user_relationship_service.get_relationship(target_user['anonymous_id'], current_user['anonymous_id'], RelationshipTypeEnum.BLOCK)
-    if actor_blocks_target or target_blocks_actor:
+    if blocked:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Cannot initiate chat due to an existing block.")
 
     if target_user['chat_availability'] == ChatAvailabilityEnum.DO_NOT_DISTURB:
@@ -41,14 +48,14 @@ def initiate_direct_chat_or_request(
             initial_message=chat_initiate_in.initial_message
         )
         chat_request = chat_request_service.create_chat_request(request_in=chat_request_in, requester_id=current_user['anonymous_id'])
-        return chat_request
+        return chat_request_service.format_chat_requests([chat_request])[0]
     
     room_create_schema = schemas.ChatRoomCreate(
         participant_anonymous_ids=[target_user['anonymous_id']],
         is_group=False
     )
     chat_room = chat_service.create_chat_room(room_in=room_create_schema, initiator_id=current_user['anonymous_id'])
-    return chat_room
+    return chat_service.format_chat_rooms([chat_room])[0]
 
 @router.get("/", response_model=List[schemas.ChatRoomRead], summary="List chat rooms for the current user")
 def list_user_chat_rooms(
@@ -56,7 +63,7 @@ def list_user_chat_rooms(
     current_user: dict = Depends(get_current_active_user_firestore),
 ):
     chat_rooms = chat_service.get_chat_rooms_for_user(user_id=current_user['anonymous_id'], limit=limit)
-    return chat_rooms
+    return chat_service.format_chat_rooms(chat_rooms)
 
 @router.get("/requests/pending", response_model=List[schemas.ChatRequestRead], summary="List pending chat requests")
 def list_pending_chat_requests(
@@ -64,7 +71,7 @@ def list_pending_chat_requests(
     current_user: dict = Depends(get_current_active_user_firestore),
 ):
     pending_requests = chat_request_service.get_pending_requests_for_user(user_id=current_user['anonymous_id'], limit=limit)
-    return pending_requests
+    return chat_request_service.format_chat_requests(pending_requests)
 
 @router.post("/requests/{request_id}/accept", response_model=schemas.ChatRoomRead, summary="Accept a chat request")
 def accept_chat_request(
@@ -79,14 +86,14 @@ def accept_chat_request(
     if chat_request['status'] != ChatRequestStatusEnum.PENDING.value:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Chat request is no longer pending.")
 
-    chat_request_service.update_request_status(request_id, status=ChatRequestStatusEnum.ACCEPTED)
+    chat_request_service.update_request_status(request_id, status=ChatRequestStatusEnum.ACCEPTED, current_request=chat_request)
     
     room_create_schema = schemas.ChatRoomCreate(
         participant_anonymous_ids=[chat_request['requester_id']],
         is_group=False
     )
     new_chat_room = chat_service.create_chat_room(room_in=room_create_schema, initiator_id=current_user['anonymous_id'])
-    return new_chat_room
+    return chat_service.format_chat_rooms([new_chat_room])[0]
 
 @router.post("/requests/{request_id}/decline", response_model=schemas.ChatRequestRead, summary="Decline a chat request")
 def decline_chat_request(
@@ -101,21 +108,33 @@ def decline_chat_request(
     if chat_request['status'] != ChatRequestStatusEnum.PENDING.value:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Chat request is no longer pending.")
 
-    updated_request = chat_request_service.update_request_status(request_id, status=ChatRequestStatusEnum.DECLINED)
-    return updated_request
+    updated_request = chat_request_service.update_request_status(request_id, status=ChatRequestStatusEnum.DECLINED, current_request=chat_request)
+    if not updated_request:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat request not found.")
+    return chat_request_service.format_chat_requests([updated_request])[0]
 
 @router.get("/{room_id}/messages", response_model=List[schemas.ChatMessageRead], summary="Get message history")
-def get_chat_room_messages(
+async def get_chat_room_messages(
     room_id: str,
+    response: Response,
     limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = None,
     current_user: dict = Depends(get_current_active_user_firestore),
 ):
-    chat_room = chat_service.get_chat_room(room_id)
+    """
+    Returns a page of messages, newest first. Pass the X-Next-Cursor response header
+    back as `cursor` to load older messages.
+    """
+    chat_room = await async_chat_service.get_chat_room(room_id)
     if not chat_room or current_user['anonymous_id'] not in chat_room['participants']:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not a participant of this chat room.")
 
-    messages = chat_service.get_messages_for_chat_room(room_id=room_id, limit=limit)
-    return messages
+    try:
+        messages, next_cursor = await async_chat_service.get_messages_for_chat_room(room_id=room_id, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    set_pagination_headers(response, next_cursor)
+    return [chat_service.format_message(message) for message in messages]
 
 @router.websocket("/ws/{room_id}")
 async def websocket_endpoint(
@@ -125,12 +144,7 @@ async def websocket_endpoint(
 ):
     # Authenticate user from token
     try:
-        payload = security.decode_access_token(token_data=token)
-        user_id = payload.get("anonymous_id")
-        if not user_id:
-            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid authentication credentials")
-            return
-        current_user = user_service.get_user_by_anonymous_id(user_id)
+        current_user = await get_user_from_token(token)
         if not current_user or not current_user.get("is_active"):
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="User not found or inactive")
             return
@@ -138,13 +152,23 @@ async def websocket_endpoint(
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid authentication credentials")
         return
 
-    # Authorize user for the chat room
-    chat_room = chat_service.get_chat_room(room_id)
+    # Authorize user for the chat room. The user's block/mute sets don't depend on the room,
+    # so they are loaded alongside it.
+    chat_room, relationship_sets = await concurrency.fan_out_async(
+        async_chat_service.get_chat_room(room_id),
+        async_user_relationship_service.get_relationship_sets(current_user['anonymous_id']),
+    )
     if not chat_room or current_user['anonymous_id'] not in chat_room['participants']:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Chat room not found or you are not a participant")
         return
 
-    # TODO: Add block check for 1-on-1 chats
+    # Blocks are checked against the cached relationship sets, so they cost no reads
+    # per message. A block made while connected stops 1-on-1 messages in both directions,
+    # and in group chats the two users stop receiving each other's messages.
+    other_participant_ids = [user_id for user_id in chat_room['participants'] if user_id != current_user['anonymous_id']]
+    if not chat_room.get('is_group') and (relationship_sets.blocking | relationship_sets.blocked_by).intersection(other_participant_ids):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Cannot chat due to an existing block")
+        return
 
     await manager.connect(websocket, room_id, current_user['anonymous_id'])
     try:
@@ -152,20 +176,30 @@ async def websocket_endpoint(
             data = await websocket.receive_text()
             try:
                 message_data = schemas.WebSocketChatMessage.model_validate_json(data)
-                
-                # Save message to Firestore
-                db_message = chat_service.add_message_to_chat_room(
+
+                relationship_sets = await async_user_relationship_service.get_relationship_sets(current_user['anonymous_id'])
+                blocked_ids = relationship_sets.blocking | relationship_sets.blocked_by
+                if not chat_room.get('is_group') and blocked_ids.intersection(other_participant_ids):
+                    await manager.send_personal_message(websocket, "Error: Cannot send messages due to an existing block.")
+                    continue
+
+                # Save message to Firestore without blocking the event loop
+                db_message = await async_chat_service.add_message_to_chat_room(
                     room_id=room_id,
                     message_in=schemas.ChatMessageCreate(content=message_data.content),
                     sender_id=current_user['anonymous_id']
                 )
                 
-                # TODO: The manager needs to be refactored to not require a db session
-                # and to handle dictionary objects.
-                # For now, we'll just broadcast the dictionary.
-                await manager.broadcast_to_room_dict(room_id, db_message, current_user['anonymous_id'])
+                # Reaches the room's sockets on every instance (see app/core/chat_manager.py).
+                # Sent as ChatMessageRead, without the moderation flags stored on the message.
+                await manager.broadcast_to_room_dict(
+                    room_id, chat_service.format_message(db_message), current_user['anonymous_id'],
+                    excluded_recipient_ids=blocked_ids, message_id=db_message['message_id'],
+                )
 
             except Exception as e:
                 await manager.send_personal_message(websocket, f"Error: {str(e)}")
     except WebSocketDisconnect:
-        manager.disconnect(websocket, room_id, current_user['anonymous_id'])
\ No newline at end of file
+        pass
+    finally:
+        await manager.disconnect(websocket, room_id, current_user['anonymous_id'])
\ No newline at end of file
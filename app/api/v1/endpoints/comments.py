@@ -1,6 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
 from typing import List, Optional
 from app import schemas
+from app.core import concurrency
+from app.core.exceptions import ContentRejectedError
+from app.core.pagination import set_pagination_headers
 from app.services.firestore_services import comment_service, post_service
 from app.api.v1.firestore_deps import get_current_active_user_firestore, get_optional_current_user_firestore
 
@@ -28,6 +31,8 @@ def create_comment_for_post(
             author_id=current_user['anonymous_id']
         )
         return comment
+    except ContentRejectedError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
 
@@ -39,17 +44,41 @@ def create_comment_for_post(
 )
 def read_comments_for_post(
     post_id: str,
-    skip: int = 0,
-    limit: int = 20,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    skip: int = Query(0, ge=0, deprecated=True),
     current_user: Optional[dict] = Depends(get_optional_current_user_firestore),
 ):
     """
-    Retrieve comments for a specific post from Firestore.
+    Retrieve a page of comments for a specific post from Firestore, newest first.
+    Pass the X-Next-Cursor response header back as `cursor` to get the next page.
+    For signed-in users, comments by muted or blocked authors are left out and `my_vote` is set.
     """
-    if not post_service.get_post(post_id=post_id):
+    def load_viewer_page():
+        return comment_service.get_comments_for_viewer(
+            post_id=post_id, viewer_id=current_user['anonymous_id'], limit=limit, cursor=cursor, skip=skip
+        )
+
+    def load_public_page():
+        return comment_service.get_comments_for_post(post_id=post_id, limit=limit, cursor=cursor, skip=skip)
+
+    # The post check and the page don't depend on each other, so they are read concurrently.
+    post_exists, page = concurrency.fan_out(
+        lambda: post_service.post_exists(post_id),
+        load_viewer_page if current_user else load_public_page,
+        return_exceptions=True,
+    )
+    if isinstance(post_exists, Exception):
+        raise post_exists
+    if not post_exists:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
-    
-    comments = comment_service.get_comments_for_post(post_id=post_id, skip=skip, limit=limit)
+    if isinstance(page, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(page))
+    if isinstance(page, Exception):
+        raise page
+    comments, next_cursor = page
+    set_pagination_headers(response, next_cursor, skip=0 if cursor else skip)
     return comments
 
 @router.put(
@@ -72,7 +101,12 @@ def update_comment(
     if comment['author']['anonymous_id'] != current_user['anonymous_id']:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions to update this comment")
     
-    updated_comment = comment_service.update_comment(comment_id=comment_id, comment_in=comment_in)
+    try:
+        updated_comment = comment_service.update_comment(comment_id=comment_id, comment_in=comment_in, current_comment=comment)
+    except ContentRejectedError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
+    if not updated_comment:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comment not found")
     return updated_comment
 
 @router.delete(
@@ -94,7 +128,7 @@ def delete_comment(
     if comment['author']['anonymous_id'] != current_user['anonymous_id']:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions to delete this comment")
     
-    comment_service.delete_comment(comment_id=comment_id)
+    comment_service.delete_comment(comment_id=comment_id, current_comment=comment)
     return
 
 @router.post(
@@ -0,0 +1,20 @@
+from fastapi import APIRouter, HTTPException, status
+from app import schemas
+from app.services.firestore_services import job_service
+
+router = APIRouter()
+
+PRIVATE_JOB_FIELDS = ('params', 'cursor', 'lease_expires_at')
+
+@router.get("/{job_id}", response_model=schemas.JobRead, summary="Get the status of a background job")
+def read_job(job_id: str):
+    """
+    Returns the status and progress of a background job, e.g. an account deletion.
+    Job IDs are unguessable and only handed to whoever started the job; the deleted
+    account's token no longer works, so this endpoint doesn't require authentication.
+    It therefore never returns the job's params (e.g. the user ID being deleted) or cursor.
+    """
+    job = job_service.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return {key: value for key, value in job.items() if key not in PRIVATE_JOB_FIELDS}
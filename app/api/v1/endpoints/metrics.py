@@ -0,0 +1,30 @@
+import secrets
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, status
+from app.core.config import settings
+from app.core.chat_manager import manager
+from app.services.firestore_services import (
+    moderation_service, post_service, related_service, search_service, user_relationship_service, user_service,
+)
+
+router = APIRouter()
+
+@router.get("/", summary="Per-instance cache, index and websocket metrics")
+async def read_metrics(x_metrics_token: Optional[str] = Header(None)):
+    """
+    Returns this instance's cache hit rates, index sizes and chat delivery metrics (queue
+    depths, send latencies). Needs the METRICS_TOKEN in the X-Metrics-Token header; without
+    a configured token the endpoint doesn't exist.
+    """
+    if not settings.METRICS_TOKEN or not secrets.compare_digest(x_metrics_token or "", settings.METRICS_TOKEN):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return {
+        "chat": manager.stats(),
+        "feed_cache": post_service.get_feed_cache_stats(),
+        "user_cache": user_service.get_user_cache_stats(),
+        "user_search_cache": user_service.get_user_search_cache_stats(),
+        "relationship_cache": user_relationship_service.get_relationship_cache_stats(),
+        "search": search_service.get_search_stats(),
+        "related": related_service.get_related_stats(),
+        "moderation": moderation_service.get_moderation_stats(),
+    }
@@ -1,8 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from typing import List, Optional
 from app import schemas
+from app.core.exceptions import ContentRejectedError
+from app.core.pagination import set_pagination_headers
+from app.schemas.enums import PostSortEnum
 from app.services.firestore_services import post_service
-from app.api.v1.firestore_deps import get_current_active_user_firestore
+from app.api.v1.firestore_deps import get_current_active_user_firestore, get_optional_current_user_firestore
 
 router = APIRouter()
 
@@ -17,6 +20,8 @@ def create_post(
     try:
         post = post_service.create_post(post_in=post_in, author_id=current_user['anonymous_id'])
         return post
+    except ContentRejectedError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -42,11 +47,30 @@ def vote_on_post(
         raise HTTPException(status_code=404, detail=str(e))
 
 @router.get("/", response_model=List[schemas.PostRead])
-def read_posts(skip: int = 0, limit: int = 100):
+def read_posts(
+    response: Response,
+    limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = None,
+    skip: int = Query(0, ge=0, deprecated=True),
+    sort: PostSortEnum = PostSortEnum.NEW,
+    current_user: Optional[dict] = Depends(get_optional_current_user_firestore),
+):
     """
-    Retrieve a list of posts from Firestore.
+    Retrieve a page of posts from Firestore: newest first (`new`), trending (`hot`) or
+    best-rated (`top`).
+    Pass the X-Next-Cursor response header back as `cursor` (with the same `sort`) to get the next page.
+    For signed-in users, posts by muted or blocked authors are left out and `my_vote` is set.
     """
-    posts = post_service.get_posts(skip=skip, limit=limit)
+    try:
+        if current_user:
+            posts, next_cursor = post_service.get_posts_for_viewer(
+                viewer_id=current_user['anonymous_id'], limit=limit, cursor=cursor, skip=skip, sort=sort
+            )
+        else:
+            posts, next_cursor = post_service.get_posts(limit=limit, cursor=cursor, skip=skip, sort=sort)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    set_pagination_headers(response, next_cursor, skip=0 if cursor else skip)
     return posts
 
 @router.get("/{post_id}", response_model=schemas.PostRead)
@@ -59,6 +83,23 @@ def read_post_by_id(post_id: str):
         raise HTTPException(status_code=404, detail="Post not found")
     return post
 
+@router.get("/{post_id}/related", response_model=List[schemas.PostRead])
+def read_related_posts(
+    post_id: str,
+    limit: int = Query(5, ge=1, le=20),
+    current_user: Optional[dict] = Depends(get_optional_current_user_firestore),
+):
+    """
+    Posts similar to this one (by wording and topics), most similar first, so people find
+    others with shared experiences.
+    """
+    posts = post_service.get_related_posts(
+        post_id=post_id, limit=limit, viewer_id=current_user['anonymous_id'] if current_user else None
+    )
+    if posts is None:
+        raise HTTPException(status_code=404, detail="Post not found")
+    return posts
+
 @router.put("/{post_id}", response_model=schemas.PostRead)
 def update_post(
     post_id: str,
@@ -71,10 +112,15 @@ def update_post(
     post = post_service.get_post(post_id=post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
-    if post['author_id'] != current_user['anonymous_id']:
+    if post['author']['anonymous_id'] != current_user['anonymous_id']:
         raise HTTPException(status_code=403, detail="Not authorized to update this post")
 
-    updated_post = post_service.update_post(post_id=post_id, post_in=post_in)
+    try:
+        updated_post = post_service.update_post(post_id=post_id, post_in=post_in, current_post=post)
+    except ContentRejectedError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
+    if not updated_post:
+        raise HTTPException(status_code=404, detail="Post not found")
     return updated_post
 
 @router.delete("/{post_id}", response_model=schemas.PostRead)
@@ -88,9 +134,9 @@ def delete_post(
     post = post_service.get_post(post_id=post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
-    if post['author_id'] != current_user['anonymous_id']:
+    if post['author']['anonymous_id'] != current_user['anonymous_id']:
         raise HTTPException(status_code=403, detail="Not authorized to delete this post")
 
     # The service returns a boolean, but we return the post data before deletion
-    post_service.delete_post(post_id=post_id)
+    post_service.delete_post(post_id=post_id, current_post=post)
     return post
\ No newline at end of file
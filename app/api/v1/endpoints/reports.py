@@ -87,5 +87,7 @@ def update_report_admin(
     if not report:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Report not found")
 
-    updated_report = report_service.update_report(report_id=report_id, report_in=report_update_in)
+    updated_report = report_service.update_report(report_id=report_id, report_in=report_update_in, current_report=report)
+    if not updated_report:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Report not found")
     return updated_report
\ No newline at end of file
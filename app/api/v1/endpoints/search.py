@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends, Query
+from typing import List, Optional
+from app import schemas
+from app.api.v1.firestore_deps import get_optional_current_user_firestore
+from app.schemas.enums import SearchTypeEnum
+from app.services.firestore_services import search_service
+
+router = APIRouter()
+
+@router.get("/", response_model=List[schemas.SearchResult], summary="Search posts and comments")
+def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    type: Optional[SearchTypeEnum] = None,
+    limit: int = Query(20, ge=1, le=50),
+    current_user: Optional[dict] = Depends(get_optional_current_user_firestore),
+):
+    """
+    Full-text search over posts and comments, best matches first. Restrict it with `type`.
+    The last word of `q` also matches the start of longer words, so it works while typing.
+    For signed-in users, posts and comments by muted or blocked authors are left out.
+    """
+    return search_service.search(
+        q, doc_type=type, limit=limit, viewer_id=current_user['anonymous_id'] if current_user else None
+    )
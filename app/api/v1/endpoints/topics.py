@@ -0,0 +1,59 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from typing import List, Optional
+from app import schemas
+from app.core.pagination import set_pagination_headers
+from app.schemas.enums import PostSortEnum, TopicSortEnum
+from app.schemas.topic import normalize_topics
+from app.services.firestore_services import post_service, topic_service
+from app.api.v1.firestore_deps import get_optional_current_user_firestore
+
+router = APIRouter()
+
+def _topic_slug(topic: str) -> str:
+    try:
+        return normalize_topics([topic])[0]
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.get("/", response_model=List[schemas.TopicRead], summary="List topics")
+def read_topics(
+    sort: TopicSortEnum = TopicSortEnum.ACTIVE,
+    limit: int = Query(50, ge=1, le=100),
+):
+    """
+    The topic directory: most recently active (`active`) or largest (`popular`) topics first.
+    """
+    return topic_service.get_topics(sort=sort, limit=limit)
+
+@router.get("/{topic}", response_model=schemas.TopicRead, summary="Get a topic")
+def read_topic(topic: str):
+    topic_data = topic_service.get_topic(_topic_slug(topic))
+    if not topic_data:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Topic not found")
+    return topic_data
+
+@router.get("/{topic}/posts", response_model=List[schemas.PostRead], summary="List a topic's posts")
+def read_topic_posts(
+    topic: str,
+    response: Response,
+    limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = None,
+    sort: PostSortEnum = PostSortEnum.NEW,
+    current_user: Optional[dict] = Depends(get_optional_current_user_firestore),
+):
+    """
+    Retrieve a page of a topic's posts: newest first (`new`), trending (`hot`) or best-rated (`top`).
+    Pass the X-Next-Cursor response header back as `cursor` (with the same `sort`) to get the next page.
+    """
+    slug = _topic_slug(topic)
+    try:
+        if current_user:
+            posts, next_cursor = post_service.get_posts_for_viewer(
+                viewer_id=current_user['anonymous_id'], limit=limit, cursor=cursor, sort=sort, topic=slug
+            )
+        else:
+            posts, next_cursor = post_service.get_posts(limit=limit, cursor=cursor, sort=sort, topic=slug)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    set_pagination_headers(response, next_cursor)
+    return posts
@@ -99,12 +99,7 @@ def list_muted_users(
         relationship_type=RelationshipTypeEnum.MUTE,
         limit=limit
     )
-    muted_users = []
-    for rel in relationships:
-        target_user = user_service.get_user_by_anonymous_id(rel['target_id'])
-        if target_user:
-             muted_users.append(target_user)
-    return muted_users
+    return user_service.get_user_profiles([rel['target_id'] for rel in relationships])
 
 @router.get(
     "/me/blocked",
@@ -120,9 +115,4 @@ def list_blocked_users(
         relationship_type=RelationshipTypeEnum.BLOCK,
         limit=limit
     )
-    blocked_users = []
-    for rel in relationships:
-        target_user = user_service.get_user_by_anonymous_id(rel['target_id'])
-        if target_user:
-            blocked_users.append(target_user)
-    return blocked_users
\ No newline at end of file
+    return user_service.get_user_profiles([rel['target_id'] for rel in relationships])
\ No newline at end of file
@@ -1,13 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from typing import List, Optional
 from app.schemas.token import Token
 from app import schemas
 from app.services.firestore_services import user_service, post_service, comment_service, chat_service
-from app.core.security import create_access_token
-from app.core.config import settings
-from datetime import timedelta
+from app.services.firestore_async_services import user_service as async_user_service
+from app.core.exceptions import ContentRejectedError
+from app.core.pagination import set_pagination_headers
+from app.core.security import create_token_response
 import uuid
-from app.api.v1.firestore_deps import get_current_active_user_firestore
+from app.api.v1.firestore_deps import get_current_active_user_firestore, get_current_active_user_profile_firestore, get_optional_current_user_firestore
 
 router = APIRouter()
 
@@ -20,45 +21,75 @@ def create_user_anonymous(user_in: schemas.UserCreate):
     """
     try:
         user_data = user_service.create_user(user_in=user_in)
+    except ContentRejectedError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
     if not user_data:
         raise HTTPException(status_code=500, detail="User creation failed unexpectedly.")
 
-    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user_data['username'], "anonymous_id": user_data['anonymous_id']},
-        expires_delta=access_token_expires,
-    )
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "username": user_data['username'],
-        "anonymous_id": user_data['anonymous_id']
-    }
+    return create_token_response(user_data)
 
 @router.get("/me", response_model=schemas.UserRead)
-def read_user_me(current_user: dict = Depends(get_current_active_user_firestore)):
+async def read_user_me(current_user: dict = Depends(get_current_active_user_profile_firestore)):
     """
     Get current authenticated user's details from Firestore.
     """
     return current_user
 
 @router.get("/", response_model=List[schemas.UserRead])
-def read_users_endpoint(skip: int = 0, limit: int = 100):
+def read_users_endpoint(
+    response: Response,
+    limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = None,
+    skip: int = Query(0, ge=0, deprecated=True),
+):
     """
-    Retrieve users from Firestore.
+    Retrieve a page of users from Firestore.
+    Pass the X-Next-Cursor response header back as `cursor` to get the next page.
     """
-    users = user_service.get_users(skip=skip, limit=limit)
+    try:
+        users, next_cursor = user_service.get_users(limit=limit, cursor=cursor, skip=skip)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    set_pagination_headers(response, next_cursor, skip=0 if cursor else skip)
     return users
 
+@router.get("/search", response_model=List[schemas.UserRead])
+def search_users_endpoint(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=50, description="Username prefix (case-insensitive)"),
+    limit: int = Query(20, ge=1, le=50),
+    cursor: Optional[str] = None,
+    current_user: Optional[dict] = Depends(get_optional_current_user_firestore),
+):
+    """
+    Find users whose username starts with `q`, in username order.
+    Pass the X-Next-Cursor response header back as `cursor` to get the next page.
+    """
+    viewer_id = current_user['anonymous_id'] if current_user else None
+    try:
+        users, next_cursor = user_service.search_users(q, limit=limit, cursor=cursor, viewer_id=viewer_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    set_pagination_headers(response, next_cursor)
+    return users
+
+@router.post("/batch", response_model=List[schemas.UserRead])
+def read_users_batch(batch_in: schemas.UserBatchRequest):
+    """
+    Get the public profiles of up to 100 users at once, in the order of the given IDs.
+    Unknown IDs are left out; duplicates are returned once.
+    """
+    return user_service.get_user_profiles([str(anonymous_id) for anonymous_id in batch_in.anonymous_ids])
+
 @router.get("/anonymous/{user_anonymous_id}", response_model=schemas.UserRead)
-def read_user_by_anonymous_id_endpoint(user_anonymous_id: str):
+async def read_user_by_anonymous_id_endpoint(user_anonymous_id: str):
     """
     Get a specific user by their public anonymous ID from Firestore.
     """
-    user = user_service.get_user_by_anonymous_id(anonymous_id=user_anonymous_id)
+    user = await async_user_service.get_user_by_anonymous_id(anonymous_id=user_anonymous_id)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return user
@@ -69,7 +100,11 @@ def update_user_me(user_in: schemas.UserUpdate, current_user: dict = Depends(get
     Update current authenticated user's profile in Firestore.
     """
     try:
-        updated_user = user_service.update_user(anonymous_id=current_user['anonymous_id'], user_in=user_in)
+        updated_user = user_service.update_user(
+            anonymous_id=current_user['anonymous_id'], user_in=user_in, current_user=current_user
+        )
+    except ContentRejectedError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     
@@ -77,17 +112,17 @@ def update_user_me(user_in: schemas.UserUpdate, current_user: dict = Depends(get
         raise HTTPException(status_code=404, detail="User not found")
     return updated_user
 
-@router.delete("/me", status_code=status.HTTP_204_NO_CONTENT)
+@router.delete("/me", response_model=schemas.JobRead, status_code=status.HTTP_202_ACCEPTED)
 def delete_user_me(current_user: dict = Depends(get_current_active_user_firestore)):
     """
     Delete the current authenticated user's profile from Firestore.
+    The account is gone immediately; its posts, comments, chats and relationships are
+    deleted by a background job whose progress is available at /jobs/{job_id}.
     """
-    # TODO: In a real application, this should trigger a process to delete all user's content.
-    # For now, it just deletes the user document.
-    success = user_service.delete_user(anonymous_id=current_user['anonymous_id'])
-    if not success:
+    job = user_service.delete_user(anonymous_id=current_user['anonymous_id'])
+    if not job:
         raise HTTPException(status_code=404, detail="User not found")
-    return
+    return job
 
 # TODO: Refactor the data erasure endpoints to use the new firestore services.
 # @router.delete("/me/posts", response_model=schemas.DeletionSummary, status_code=status.HTTP_200_OK)
@@ -1,33 +1,51 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
+from app.core import security
 from app.core.config import settings
-from app.services.firestore_services import user_service
+from app.services.firestore_async_services import user_service
 from typing import Optional
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/v1/auth/token", auto_error=False)
 
-def get_current_user_firestore(token: str = Depends(oauth2_scheme)) -> Optional[dict]:
+async def get_user_from_token(token: Optional[str]) -> Optional[dict]:
     """
-    Decodes the JWT token and retrieves the user from Firestore.
-    If the token is invalid or not provided, returns None.
+    Resolves an access token to a user dict.
+    In stateless auth mode the verified token claims are trusted as-is (no Firestore read);
+    otherwise the user is loaded from Firestore (served from the per-instance user cache when enabled).
+    Returns None if the token is invalid, revoked or the user does not exist.
     """
     if token is None:
         return None
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        anonymous_id: str = payload.get("anonymous_id")
-        if anonymous_id is None:
-            return None
-    except JWTError:
+    payload = security.decode_access_token(token_data=token)
+    if payload is None:
+        return None
+    if payload.get("type", security.ACCESS_TOKEN_TYPE) != security.ACCESS_TOKEN_TYPE:
+        return None # Refresh tokens can't be used to authenticate requests
+    anonymous_id: str = payload.get("anonymous_id")
+    if anonymous_id is None:
+        return None
+    if security.token_denylist.is_revoked(payload):
         return None
 
-    user = user_service.get_user_by_anonymous_id(anonymous_id=anonymous_id)
+    if settings.STATELESS_AUTH_ENABLED:
+        claims_user = security.user_from_token_claims(payload)
+        if claims_user is not None:
+            return claims_user
+
+    user = await user_service.get_user_by_anonymous_id(anonymous_id=anonymous_id)
     if user is None:
         return None
     return user
 
-def get_current_active_user_firestore(current_user: dict = Depends(get_current_user_firestore)) -> dict:
+async def get_current_user_firestore(token: str = Depends(oauth2_scheme)) -> Optional[dict]:
+    """
+    Decodes the JWT token and retrieves the current user.
+    If the token is invalid or not provided, returns None.
+    Runs on the event loop, so it uses the async user service.
+    """
+    return await get_user_from_token(token)
+
+async def get_current_active_user_firestore(current_user: dict = Depends(get_current_user_firestore)) -> dict:
     """
     Checks if the current user is active.
     """
@@ -41,7 +59,23 @@ def get_current_active_user_firestore(current_user: dict = Depends(get_current_u
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
-def get_optional_current_user_firestore(current_user: dict = Depends(get_current_user_firestore)) -> Optional[dict]:
+async def get_current_active_user_profile_firestore(current_user: dict = Depends(get_current_active_user_firestore)) -> dict:
+    """
+    Like get_current_active_user_firestore, but always returns the full user document.
+    Use it for endpoints that need more than the token claims (e.g. returning the profile).
+    """
+    if not current_user.get("claims_only"):
+        return current_user
+    user = await user_service.get_user_by_anonymous_id(anonymous_id=current_user['anonymous_id'])
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
+async def get_optional_current_user_firestore(current_user: dict = Depends(get_current_user_firestore)) -> Optional[dict]:
     """
     Returns the current user if they are authenticated, otherwise returns None.
     """
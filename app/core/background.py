@@ -0,0 +1,40 @@
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+from app.core.config import settings
+
+# Shared worker pool for background jobs (fan-outs, cascade deletes, ...).
+# NOTE: Cloud Run may throttle CPU outside of requests, so long jobs must persist their
+# progress (see job_service) and be resumable rather than rely on finishing here.
+
+_executor = ThreadPoolExecutor(max_workers=settings.BACKGROUND_WORKERS, thread_name_prefix="background")
+
+
+def _log_failure(future: Future, name: str) -> None:
+    exc = future.exception()
+    if exc is not None:
+        print(f"Background task {name} failed: {exc}")
+        traceback.print_exception(type(exc), exc, exc.__traceback__)
+
+
+def run_in_background(fn: Callable, *args, **kwargs) -> Future:
+    """
+    Runs `fn(*args, **kwargs)` on the background worker pool. Failures are logged.
+    """
+    future = _executor.submit(fn, *args, **kwargs)
+    future.add_done_callback(lambda f: _log_failure(f, getattr(fn, "__name__", repr(fn))))
+    return future
+
+
+def run_later(delay_seconds: float, fn: Callable, *args, **kwargs) -> None:
+    """
+    Runs `fn(*args, **kwargs)` on the background worker pool after `delay_seconds`.
+    """
+    if delay_seconds <= 0:
+        run_in_background(fn, *args, **kwargs)
+        return
+    timer = threading.Timer(delay_seconds, run_in_background, args=(fn, *args), kwargs=kwargs)
+    timer.daemon = True
+    timer.start()
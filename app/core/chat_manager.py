@@ -1,56 +1,265 @@
-from typing import Dict, List, Tuple
-from fastapi import WebSocket
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+from typing import Collection, Deque, Dict, List, Optional, Set, Tuple
+from fastapi import WebSocket, status
 from app import schemas
+from app.core import pubsub
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+# Sockets are held by the process they connected to, so room messages go through a
+# pub/sub broker (app/core/pubsub.py): each process subscribes to the channel of every
+# room it has sockets in, and a broadcast is published there for the other instances and
+# worker processes. The sender's process delivers to its own sockets right away instead
+# of waiting for its copy to come back; that copy, and any duplicate from a retried
+# publish, is dropped by message_id.
+#
+# Broadcasts are serialized once, by the sender's process, into an envelope:
+#   {"room_id", "message_id", "excluded_recipient_ids", "message": <WebSocketMessage JSON>}
+#
+# Delivering never waits for a socket: frames go into a bounded queue per socket, and each
+# socket's writer task sends them in order, so a slow client only delays itself. What
+# happens when a queue is full is CHAT_SLOW_CONSUMER_POLICY (see config). A socket whose
+# send fails or times out is closed and removed.
+
+SLOW_CONSUMER_POLICIES = ("drop", "coalesce", "disconnect")
+LATENCY_SAMPLES = 1000
+
+_RESYNC = object() # Queue marker: frames were coalesced away, send a "resync" frame
+
+
+class OutboundConnection:
+    """
+    A connected socket with its queue of (enqueued at, frame) and its writer task.
+    """
+
+    def __init__(self, websocket: WebSocket, room_id: str, user_id: str):
+        self.websocket = websocket
+        self.room_id = room_id
+        self.user_id = user_id
+        self.pending: Deque[Tuple[float, object]] = deque()
+        self.wakeup = asyncio.Event()
+        self.writer: Optional[asyncio.Task] = None
+        self.missed = 0 # Frames coalesced away since the last resync frame
+        self.closing = False
 
-# NOTE: In a truly serverless environment with multiple scaled instances of Cloud Run,
-# this in-memory ConnectionManager will not work as expected, because each instance
-# would have its own separate list of connections.
-# A production-ready solution would require a separate messaging service like
-# Redis Pub/Sub or Google Cloud Pub/Sub to broadcast messages across all instances.
-# For the purpose of this migration and for single-instance deployments, this manager will suffice.
 
 class ConnectionManager:
-    def __init__(self):
-        # Stores active connections: Dict[room_id, List[Tuple[user_id, WebSocket]]]
-        self.active_connections: Dict[str, List[Tuple[str, WebSocket]]] = {}
+    def __init__(self, broker: Optional[pubsub.Broker] = None, slow_consumer_policy: Optional[str] = None):
+        # Stores active connections: Dict[room_id, List[OutboundConnection]]
+        self.active_connections: Dict[str, List[OutboundConnection]] = {}
+        self._by_socket: Dict[int, OutboundConnection] = {}
+        self.broker = broker if broker is not None else pubsub.create_broker()
+        self.delivered_ids = TTLCache(maxsize=settings.PUBSUB_DEDUPE_MAX_IDS, ttl=settings.PUBSUB_DEDUPE_TTL_SECONDS)
+        self.queue_size = settings.CHAT_OUTBOUND_QUEUE_SIZE
+        self.slow_consumer_policy = slow_consumer_policy or settings.CHAT_SLOW_CONSUMER_POLICY
+        if self.slow_consumer_policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy '{self.slow_consumer_policy}'")
+        self._closing_tasks: Set[asyncio.Task] = set()
+
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.frames_coalesced = 0
+        self.slow_disconnects = 0
+        self.dead_sockets = 0
+        self._send_latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self._delivery_latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    @staticmethod
+    def channel_for(room_id: str) -> str:
+        return f"{settings.PUBSUB_CHANNEL_PREFIX}{room_id}"
+
+    async def start(self):
+        await self.broker.start()
+
+    async def stop(self):
+        for connection in list(self._by_socket.values()):
+            await self._remove(connection)
+        await self.broker.stop()
 
     async def connect(self, websocket: WebSocket, room_id: str, user_id: str):
         await websocket.accept()
+        connection = OutboundConnection(websocket, room_id, user_id)
+        connection.writer = asyncio.create_task(self._write(connection))
+        self._by_socket[id(websocket)] = connection
         if room_id not in self.active_connections:
             self.active_connections[room_id] = []
-        self.active_connections[room_id].append((user_id, websocket))
+            await self.broker.subscribe(self.channel_for(room_id), self._on_broker_message)
+        self.active_connections[room_id].append(connection)
 
-    def disconnect(self, websocket: WebSocket, room_id: str, user_id: str):
-        if room_id in self.active_connections:
-            connection_to_remove = (user_id, websocket)
-            if connection_to_remove in self.active_connections[room_id]:
-                self.active_connections[room_id].remove(connection_to_remove)
-                if not self.active_connections[room_id]:
-                    del self.active_connections[room_id]
+    async def disconnect(self, websocket: WebSocket, room_id: str, user_id: str):
+        connection = self._by_socket.get(id(websocket))
+        if connection is not None and connection.websocket is websocket:
+            await self._remove(connection)
+
+    async def _remove(self, connection: OutboundConnection):
+        if self._by_socket.get(id(connection.websocket)) is not connection:
+            return
+        del self._by_socket[id(connection.websocket)]
+        if connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+        room_connections = self.active_connections.get(connection.room_id)
+        if room_connections is not None:
+            room_connections.remove(connection)
+            if not room_connections:
+                del self.active_connections[connection.room_id]
+                await self.broker.unsubscribe(self.channel_for(connection.room_id), self._on_broker_message)
+
+    async def _close(self, connection: OutboundConnection, code: int, reason: str):
+        """
+        Removes a connection and closes its socket, which ends the endpoint's receive loop.
+        """
+        await self._remove(connection)
+        try:
+            await asyncio.wait_for(connection.websocket.close(code=code, reason=reason), settings.CHAT_SEND_TIMEOUT_SECONDS)
+        except Exception:
+            pass # Already closed or unresponsive; the server drops it.
+
+    # --- Outbound queues ---
+
+    def _enqueue(self, connection: OutboundConnection, frame: str):
+        if connection.closing:
+            return
+        if len(connection.pending) >= self.queue_size:
+            if self.slow_consumer_policy == "disconnect":
+                connection.closing = True
+                self.slow_disconnects += 1
+                task = asyncio.create_task(
+                    self._close(connection, status.WS_1013_TRY_AGAIN_LATER, "Too many unread messages")
+                )
+                self._closing_tasks.add(task)
+                task.add_done_callback(self._closing_tasks.discard)
+                return
+            if self.slow_consumer_policy == "drop":
+                connection.pending.popleft()
+                self.frames_dropped += 1
+            else:
+                missed = sum(1 for _, item in connection.pending if item is not _RESYNC)
+                connection.missed += missed
+                self.frames_coalesced += missed
+                connection.pending.clear()
+                connection.pending.append((time.monotonic(), _RESYNC))
+        connection.pending.append((time.monotonic(), frame))
+        connection.wakeup.set()
+
+    def _resync_frame(self, connection: OutboundConnection) -> str:
+        missed, connection.missed = connection.missed, 0
+        return schemas.WebSocketMessage(
+            type="resync",
+            payload={"room_id": connection.room_id, "missed_messages": missed},
+        ).model_dump_json()
+
+    async def _write(self, connection: OutboundConnection):
+        try:
+            while True:
+                while not connection.pending:
+                    connection.wakeup.clear()
+                    await connection.wakeup.wait()
+                enqueued_at, item = connection.pending.popleft()
+                frame = self._resync_frame(connection) if item is _RESYNC else item
+                started = time.monotonic()
+                await asyncio.wait_for(connection.websocket.send_text(frame), settings.CHAT_SEND_TIMEOUT_SECONDS)
+                finished = time.monotonic()
+                self.frames_sent += 1
+                self._send_latencies.append(finished - started)
+                self._delivery_latencies.append(finished - enqueued_at)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Failed or timed-out send: the socket is gone or not reading.
+            print(f"Removing dead chat socket of {connection.user_id} in room {connection.room_id}: {e!r}")
+            self.dead_sockets += 1
+            connection.closing = True
+            await self._close(connection, status.WS_1011_INTERNAL_ERROR, "Send failed")
+
+    # --- Broadcasting ---
 
     async def broadcast_to_room_dict(
         self,
         room_id: str,
         message_payload: dict,
-        sender_id: str
+        sender_id: str,
+        excluded_recipient_ids: Collection[str] = (),
+        message_id: Optional[str] = None,
     ):
         """
-        Broadcasts a message dictionary to all users in a room.
-        Block checks should be handled before calling this method.
+        Broadcasts a message dictionary to all users in a room, on every instance, except
+        `excluded_recipient_ids` (e.g. users blocked with the sender). Block checks are done
+        by the caller. `message_id` identifies copies of the same message.
         """
-        if room_id in self.active_connections:
-            ws_message = schemas.WebSocketMessage(
-                type="new_message",
-                payload=message_payload
-            )
-            message_str = ws_message.model_dump_json()
-
-            for recipient_id, connection in self.active_connections[room_id]:
-                # The block check is removed from here. It should be handled in the
-                # service or endpoint layer before broadcasting.
-                await connection.send_text(message_str)
+        ws_message = schemas.WebSocketMessage(
+            type="new_message",
+            payload=message_payload
+        )
+        envelope = {
+            "room_id": room_id,
+            "message_id": message_id or str(uuid.uuid4()),
+            "excluded_recipient_ids": sorted(excluded_recipient_ids),
+            "message": ws_message.model_dump_json(),
+        }
+        self._deliver(envelope)
+        try:
+            await self.broker.publish(self.channel_for(room_id), json.dumps(envelope).encode())
+        except ConnectionError as e:
+            # Sockets on this process already have it; other instances miss this message.
+            print(f"Could not publish chat message {envelope['message_id']} to other instances: {e}")
+
+    async def _on_broker_message(self, channel: str, data: bytes):
+        self._deliver(json.loads(data))
+
+    def _deliver(self, envelope: dict):
+        message_id = envelope["message_id"]
+        if self.delivered_ids.get(message_id):
+            return
+        self.delivered_ids.set(message_id, True)
+
+        excluded_recipient_ids = set(envelope.get("excluded_recipient_ids", ()))
+        for connection in list(self.active_connections.get(envelope["room_id"], ())):
+            if connection.user_id not in excluded_recipient_ids:
+                self._enqueue(connection, envelope["message"])
 
     async def send_personal_message(self, websocket: WebSocket, message: str):
-        await websocket.send_text(message)
+        # Queued behind the socket's other frames, so two sends never interleave.
+        # Sockets that were removed (dead or too slow) are skipped.
+        connection = self._by_socket.get(id(websocket))
+        if connection is not None and connection.websocket is websocket:
+            self._enqueue(connection, message)
+
+    # --- Metrics ---
+
+    @staticmethod
+    def _latency_stats(samples: Deque[float]) -> dict:
+        if not samples:
+            return {"samples": 0}
+        ordered = sorted(samples)
+        return {
+            "samples": len(ordered),
+            "p50_ms": round(ordered[len(ordered) // 2] * 1000, 2),
+            "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 2),
+            "max_ms": round(ordered[-1] * 1000, 2),
+        }
+
+    def stats(self) -> dict:
+        depths = [len(connection.pending) for connection in self._by_socket.values()]
+        return {
+            "rooms": len(self.active_connections),
+            "connections": len(depths),
+            "slow_consumer_policy": self.slow_consumer_policy,
+            "queue_size": self.queue_size,
+            "queued_frames": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "full_queues": sum(1 for depth in depths if depth >= self.queue_size),
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "frames_coalesced": self.frames_coalesced,
+            "slow_disconnects": self.slow_disconnects,
+            "dead_sockets": self.dead_sockets,
+            "send_latency": self._latency_stats(self._send_latencies),
+            "delivery_latency": self._latency_stats(self._delivery_latencies),
+            "broker": self.broker.stats(),
+        }
 
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager()
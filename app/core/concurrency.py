@@ -0,0 +1,80 @@
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, List, Optional
+
+from app.core.config import settings
+from app.core.exceptions import DeadlineExceededError
+
+# Structured fan-out of independent reads inside a request.
+#
+# Firestore calls made one after another cost the sum of their round trips; fanned out,
+# they cost the slowest one. fan_out runs blocking calls (the sync Firestore client) on a
+# pool reserved for request reads, separate from the background job pool so long jobs
+# can't starve requests. The first call runs on the calling thread. fan_out_async is the
+# same for coroutines on the event loop.
+#
+# Both wait for every call, under one deadline for the whole group (FAN_OUT_TIMEOUT_SECONDS
+# by default), and raise the exception of the first failed call in argument order, with
+# the other failures attached as notes. Pass return_exceptions=True to get exceptions
+# back in place of results instead.
+# Don't fan out from inside a fanned-out call: nested waits can exhaust the pool.
+
+_executor = ThreadPoolExecutor(max_workers=settings.FAN_OUT_WORKERS, thread_name_prefix="fan-out")
+
+
+def _outcome(run: Callable[[], Any]):
+    try:
+        return run(), None
+    except Exception as e:
+        return None, e
+
+
+def _collect(outcomes: List[tuple], return_exceptions: bool) -> List[Any]:
+    errors = [error for _, error in outcomes if error is not None]
+    if errors and not return_exceptions:
+        first = errors[0]
+        for other in errors[1:]:
+            first.add_note(f"Also failed in the same fan-out: {other!r}")
+        raise first
+    return [error if error is not None else result for result, error in outcomes]
+
+
+def fan_out(*calls: Callable[[], Any], timeout: Optional[float] = None, return_exceptions: bool = False) -> List[Any]:
+    """
+    Runs zero-argument callables concurrently and returns their results in order.
+    Raises DeadlineExceededError if they haven't all finished within `timeout` seconds.
+    """
+    if not calls:
+        return []
+    timeout = settings.FAN_OUT_TIMEOUT_SECONDS if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    futures = [_executor.submit(contextvars.copy_context().run, _outcome, call) for call in calls[1:]]
+    first_outcome = _outcome(calls[0])
+
+    _, pending = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+    if pending:
+        for future in pending:
+            future.cancel() # Calls already running finish on their own; their results are dropped.
+        raise DeadlineExceededError(f"{len(pending)} of {len(calls)} reads didn't finish within {timeout}s")
+    return _collect([first_outcome] + [future.result() for future in futures], return_exceptions)
+
+
+async def fan_out_async(*awaitables: Awaitable, timeout: Optional[float] = None, return_exceptions: bool = False) -> List[Any]:
+    """
+    Awaits coroutines concurrently and returns their results in order.
+    Raises DeadlineExceededError if they haven't all finished within `timeout` seconds.
+    """
+    timeout = settings.FAN_OUT_TIMEOUT_SECONDS if timeout is None else timeout
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    if not tasks:
+        return []
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    if pending:
+        for task in pending:
+            task.cancel()
+        raise DeadlineExceededError(f"{len(pending)} of {len(tasks)} reads didn't finish within {timeout}s")
+
+    outcomes = [(None, task.exception()) if task.exception() is not None else (task.result(), None) for task in tasks]
+    return _collect(outcomes, return_exceptions)
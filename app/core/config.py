@@ -42,6 +42,145 @@ class Settings(BaseSettings):
     SECRET_KEY: str = os.getenv("SECRET_KEY", "secret_key")
     ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 *24 * 7 # 7 days
+    REFRESH_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 30 # 30 days
+
+    # Opt-in stateless auth: access tokens carry the profile claims (is_active, username,
+    # avatar_url, claims version) and are trusted without a Firestore lookup. Access tokens
+    # are short-lived in this mode; clients renew them through /auth/refresh.
+    STATELESS_AUTH_ENABLED: bool = False
+    STATELESS_ACCESS_TOKEN_EXPIRE_MINUTES: int = 15
+
+    # GET /metrics (per-instance cache, index and chat metrics) answers only requests that
+    # carry this token in the X-Metrics-Token header; unset, the endpoint is disabled.
+    METRICS_TOKEN: Optional[str] = os.getenv("METRICS_TOKEN")
+
+    # Per-instance cache of user documents keyed by anonymous_id.
+    # Saves a Firestore read on every authenticated request.
+    USER_CACHE_ENABLED: bool = True
+    USER_CACHE_MAX_SIZE: int = 10000
+    USER_CACHE_TTL_SECONDS: int = 60
+
+    # Per-instance cache of each user's block/mute relationships, in both directions.
+    RELATIONSHIP_CACHE_ENABLED: bool = True
+    RELATIONSHIP_CACHE_MAX_SIZE: int = 10000
+    RELATIONSHIP_CACHE_TTL_SECONDS: int = 60
+
+    # Per-instance cache of username prefix searches (GET /users/search). Each entry holds
+    # the first USER_SEARCH_CACHE_DEPTH users of a prefix; when that is all of them, longer
+    # prefixes are answered from the entry too. Renames on this instance drop the entries.
+    USER_SEARCH_CACHE_ENABLED: bool = True
+    USER_SEARCH_CACHE_MAX_PREFIXES: int = 2000
+    USER_SEARCH_CACHE_DEPTH: int = 50
+    USER_SEARCH_CACHE_TTL_SECONDS: int = 60
+
+    # Per-instance cache of the first pages of each post feed (GET /posts).
+    # Writes on this instance patch or drop it; other instances' writes show up after the TTL.
+    FEED_CACHE_ENABLED: bool = True
+    FEED_CACHE_PAGES: int = 3
+    FEED_CACHE_TTL_SECONDS: int = 15
+    TOPIC_DIRECTORY_CACHE_TTL_SECONDS: int = 60
+
+    # Sharded vote/comment counters
+    COUNTER_SHARD_COUNT: int = 10
+    COUNTER_MATERIALIZE_INTERVAL_SECONDS: int = 30
+
+    # Feed ranking (see app/core/ranking.py)
+    # Seconds of post age that are worth a 10x difference in net votes in the hot feed.
+    HOT_SCORE_TIME_DECAY_SECONDS: int = 45000
+    # z for the Wilson score lower bound used by the top feed (1.96 = 95% confidence).
+    TOP_SCORE_CONFIDENCE_Z: float = 1.96
+
+    # Full-text search over posts and comments (app/core/search_index.py). Each instance
+    # keeps the index in memory, saves it to SEARCH_INDEX_PATH and loads it at start;
+    # app/scripts/rebuild_search_index.py rebuilds it from Firestore.
+    SEARCH_ENABLED: bool = True
+    SEARCH_INDEX_PATH: str = os.getenv("SEARCH_INDEX_PATH", "search_index.bin")
+    SEARCH_INDEX_SAVE_INTERVAL_SECONDS: int = 300
+    # Build the index from Firestore at start when there is no file. Off by default: on Cloud
+    # Run the disk is ephemeral, so every cold start would stream every post and comment.
+    # Run app/scripts/rebuild_search_index.py instead. Keep SEARCH_INDEX_PATH on local disk:
+    # every instance saves its own index there, so on a shared volume the instance that
+    # saved last would overwrite the others' writes.
+    SEARCH_REBUILD_IF_MISSING: bool = False
+
+    # Related posts (app/core/related_index.py): the newest posts in an in-process TF-IDF
+    # index. Additions are folded into its base matrix once RELATED_COMPACT_MAX_DELTA of
+    # them piled up, checked every RELATED_COMPACT_INTERVAL_SECONDS.
+    RELATED_POSTS_ENABLED: bool = True
+    RELATED_INDEX_MAX_POSTS: int = 50000
+    # Posts read into the index at start. Every cold start (and every instance) streams
+    # this many posts, so it is kept small; the index grows to RELATED_INDEX_MAX_POSTS as
+    # posts are written. Older posts only show up as related once they are edited, or if
+    # this is raised (up to RELATED_INDEX_MAX_POSTS) at the cost of slower, costlier starts.
+    # 0 skips the fill.
+    RELATED_INDEX_WARM_POSTS: int = 2000
+    RELATED_COMPACT_INTERVAL_SECONDS: int = 60
+    RELATED_COMPACT_MAX_DELTA: int = 1000
+
+    # Phrase filter applied to posts, comments, chat messages and profiles
+    # (app/core/content_filter.py). The JSON phrase list is reloaded when it changes.
+    CONTENT_FILTER_ENABLED: bool = True
+    CONTENT_FILTER_PATH: str = os.getenv(
+        "CONTENT_FILTER_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "content_filter.json")
+    )
+    CONTENT_FILTER_RELOAD_INTERVAL_SECONDS: int = 30 # How often to check the file for changes
+
+    # Near-duplicate/spam screening of new posts and comments (app/core/duplicate_detector.py).
+    # Similarities are estimated Jaccard similarities of the normalized texts, compared
+    # against the content created on this instance in the last DUPLICATE_WINDOW_SECONDS.
+    DUPLICATE_DETECTION_ENABLED: bool = True
+    DUPLICATE_MIN_TEXT_LENGTH: int = 40 # Shorter texts ("thank you!") are never screened
+    DUPLICATE_MAX_TEXT_LENGTH: int = 8000 # Only the start of longer texts is screened
+    DUPLICATE_FLAG_SIMILARITY: float = 0.5 # Accepted but stored with a moderation flag
+    DUPLICATE_REJECT_SIMILARITY: float = 0.85 # A copy of the author's own content: 409
+    DUPLICATE_THROTTLE_MATCHES: int = 3 # This many flagged matches of the author's own: 429
+    # This many copies from distinct other authors in the cluster window: 429
+    DUPLICATE_CLUSTER_MATCHES: int = 5
+    DUPLICATE_CLUSTER_WINDOW_SECONDS: int = 600
+    DUPLICATE_WINDOW_SECONDS: int = 6 * 3600
+    DUPLICATE_INDEX_MAX_ENTRIES: int = 50000
+
+    # Concurrent reads within a request (app/core/concurrency.py): threads shared by all
+    # requests, and the deadline of one fan-out.
+    FAN_OUT_WORKERS: int = 32
+    FAN_OUT_TIMEOUT_SECONDS: float = 10.0
+
+    # Chat fan-out across instances and worker processes (app/core/pubsub.py). "memory" only
+    # reaches sockets connected to this process; "redis" goes through a Redis-protocol server.
+    PUBSUB_BACKEND: str = os.getenv("PUBSUB_BACKEND", "memory") # "memory" or "redis"
+    PUBSUB_REDIS_URL: str = os.getenv("PUBSUB_REDIS_URL", "redis://localhost:6379")
+    PUBSUB_CHANNEL_PREFIX: str = os.getenv("PUBSUB_CHANNEL_PREFIX", "empathy-hub:chat:")
+    PUBSUB_TIMEOUT_SECONDS: float = 2.0
+    PUBSUB_RECONNECT_MAX_SECONDS: float = 30.0
+    # Message ids already delivered to this process's sockets, so copies aren't sent twice.
+    PUBSUB_DEDUPE_MAX_IDS: int = 50000
+    PUBSUB_DEDUPE_TTL_SECONDS: int = 300
+
+    # Outbound websocket traffic (app/core/chat_manager.py). Each socket has a bounded queue
+    # written by its own task. When a queue is full, CHAT_SLOW_CONSUMER_POLICY decides:
+    # "drop" the oldest frame, "coalesce" the backlog into one "resync" frame (the client
+    # reloads the history), or "disconnect" the socket. Sends slower than
+    # CHAT_SEND_TIMEOUT_SECONDS count as a dead socket.
+    CHAT_OUTBOUND_QUEUE_SIZE: int = 100
+    CHAT_SLOW_CONSUMER_POLICY: str = os.getenv("CHAT_SLOW_CONSUMER_POLICY", "coalesce")
+    CHAT_SEND_TIMEOUT_SECONDS: float = 10.0
+
+    # Background jobs
+    BACKGROUND_WORKERS: int = 4
+    # A failed job run is retried after JOB_RETRY_BASE_SECONDS, doubling per failure up to
+    # JOB_RETRY_MAX_SECONDS; the job is marked failed after JOB_MAX_ATTEMPTS failed runs.
+    JOB_MAX_ATTEMPTS: int = 5
+    JOB_RETRY_BASE_SECONDS: float = 30.0
+    JOB_RETRY_MAX_SECONDS: float = 1800.0
+    # Rewrites denormalized author fields on posts/comments after a profile change.
+    AUTHOR_FANOUT_BATCH_SIZE: int = 200 # Firestore batches are capped at 500 writes
+    AUTHOR_FANOUT_MAX_WRITES_PER_SECOND: int = 100
+    # Cascade deletes (deletion_service): documents per page, parallel subtree listings,
+    # and the BulkWriter's write rate. A page's deletes and counter updates commit in one
+    # batch (capped at 500 writes), so keep DELETION_BATCH_SIZE at 150 or below.
+    DELETION_BATCH_SIZE: int = 100
+    DELETION_READ_CONCURRENCY: int = 8
+    DELETION_MAX_OPS_PER_SECOND: int = 1000
 
     class Config:
         case_sensitive = True
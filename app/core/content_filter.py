@@ -0,0 +1,153 @@
+import functools
+import json
+import re
+import unicodedata
+from collections import deque
+from typing import Dict, List, Tuple
+
+# Multi-phrase content filter built on an Aho-Corasick automaton.
+#
+# Phrases are matched on whole words, so "class" never matches "ass". The automaton's
+# alphabet is normalized words instead of characters: a message is split into words once
+# (by the regex engine), and each word costs one transition, whatever the number of
+# phrases. Words are normalized so that common evasions match their plain form:
+# case, accents, leetspeak ("k1ll", "$ucks") and elongation ("diiiie").
+#
+# Most text matches nothing, so ASCII text is first checked with C-level string ops:
+# one translate() folds case, leetspeak and punctuation, split() yields the words, and a
+# set test against the phrases' first words rules the text out. Only texts that pass
+# are scanned by the automaton, which also records match offsets for masking.
+#
+# The phrase list is JSON, grouped into categories that each carry an action:
+#   {"categories": {"crisis": {"action": "flag", "phrases": ["want to die", ...]}, ...}}
+
+ACTIONS = ("flag", "mask", "reject") # In increasing severity
+
+_TOKEN_PATTERN = re.compile(r"[\w@$]+")
+_LEET_TABLE = str.maketrans({"0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "@": "a", "$": "s"})
+_REPEAT_PATTERN = re.compile(r"(.)\1+")
+# ASCII fast path: same words as _TOKEN_PATTERN, lowercased and leetspeak-folded.
+_ASCII_TABLE = {
+    code: (chr(code).lower() if chr(code).isalnum() or chr(code) in "_@$" else " ")
+    for code in range(128)
+}
+_ASCII_TABLE.update(_LEET_TABLE)
+_ASCII_WORD_CACHE_SIZE = 100000
+_ascii_words: Dict[str, str] = {} # Elongation-collapsed forms of words seen on the fast path
+
+# (category, phrase, start, end), with start/end offsets into the scanned text
+Match = Tuple[str, str, int, int]
+
+
+@functools.lru_cache(maxsize=65536)
+def normalize_word(word: str) -> str:
+    folded = unicodedata.normalize("NFKD", word.casefold())
+    if not folded.isascii():
+        folded = "".join(ch for ch in folded if not unicodedata.combining(ch))
+    return _REPEAT_PATTERN.sub(r"\1", folded.translate(_LEET_TABLE))
+
+
+class ContentFilter:
+    """
+    An immutable compiled phrase list. Build a new one to change the phrases.
+    """
+
+    def __init__(self, categories: Dict[str, dict]):
+        self.actions: Dict[str, str] = {}
+        self._patterns: List[Tuple[str, str, int]] = [] # (category, phrase, number of words)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._outputs: List[Tuple[int, ...]] = [()]
+
+        for category, spec in categories.items():
+            action = spec.get("action", "flag")
+            if action not in ACTIONS:
+                raise ValueError(f"Unknown action '{action}' for category '{category}'")
+            self.actions[category] = action
+            for phrase in spec.get("phrases", []):
+                words = [normalize_word(word) for word in _TOKEN_PATTERN.findall(phrase)]
+                if words:
+                    self._add_pattern(category, phrase, words)
+        self._fail = self._build_failure_links()
+        self._first_words = frozenset(self._goto[0])
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def _add_pattern(self, category: str, phrase: str, words: List[str]) -> None:
+        state = 0
+        for word in words:
+            next_state = self._goto[state].get(word)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][word] = next_state
+                self._goto.append({})
+                self._outputs.append(())
+            state = next_state
+        self._outputs[state] += (len(self._patterns),)
+        self._patterns.append((category, phrase, len(words)))
+
+    def _build_failure_links(self) -> List[int]:
+        # Breadth-first, so a state's failure target is final before its children need it.
+        fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, next_state in self._goto[state].items():
+                target = fail[state]
+                while target and word not in self._goto[target]:
+                    target = fail[target]
+                fail[next_state] = self._goto[target].get(word, 0)
+                self._outputs[next_state] += self._outputs[fail[next_state]]
+                queue.append(next_state)
+        return fail
+
+    def _may_match(self, text: str) -> bool:
+        if not text.isascii():
+            return True
+        words = text.translate(_ASCII_TABLE).split()
+        if len(_ascii_words) > _ASCII_WORD_CACHE_SIZE:
+            _ascii_words.clear()
+        normalized = list(map(_ascii_words.get, words))
+        if None in normalized:
+            for i, word in enumerate(words):
+                if normalized[i] is None:
+                    normalized[i] = _ascii_words[word] = _REPEAT_PATTERN.sub(r"\1", word)
+        return not self._first_words.isdisjoint(normalized)
+
+    def scan(self, text: str) -> List[Match]:
+        """
+        Returns every phrase occurrence in `text`, in order of where it ends.
+        """
+        if not self._may_match(text):
+            return []
+        goto, fail, outputs, patterns = self._goto, self._fail, self._outputs, self._patterns
+        matches = []
+        starts = []
+        state = 0
+        for token in _TOKEN_PATTERN.finditer(text):
+            word = normalize_word(token.group())
+            starts.append(token.start())
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            for pattern_id in outputs[state]:
+                category, phrase, length = patterns[pattern_id]
+                matches.append((category, phrase, starts[-length], token.end()))
+        return matches
+
+    @classmethod
+    def from_file(cls, path: str) -> "ContentFilter":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f).get("categories", {}))
+
+
+def mask(text: str, matches: List[Match]) -> str:
+    """
+    Replaces the matched spans of `text` with asterisks (spaces are kept).
+    """
+    chars = list(text)
+    for _, _, start, end in matches:
+        for i in range(start, end):
+            if not chars[i].isspace():
+                chars[i] = "*"
+    return "".join(chars)
@@ -0,0 +1,162 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+# Near-duplicate detection with MinHash and locality-sensitive hashing.
+#
+# A text is normalized and cut into overlapping character shingles. Its MinHash signature
+# is the minimum of NUM_PERMUTATIONS independent hashes over those shingles. The share of
+# positions where two signatures agree estimates the Jaccard similarity of the shingle
+# sets. For LSH, each signature is split into BANDS bands of ROWS values, and every
+# band is a bucket key: texts that share any bucket are candidates, and only those are
+# compared. With 32 bands of 4 rows, pairs above ~0.5 similarity are found with >85%
+# probability (>99% above 0.6), and a lookup costs 32 dict probes whatever the index size.
+#
+# Shingle hashing and the permutations are vectorized with NumPy, so checking a post
+# takes well under a millisecond. Permutations are applied in chunks, so memory stays
+# bounded for long texts (callers should still cap what they screen). The index only
+# remembers recent content: entries expire after `max_age` seconds and the oldest are
+# evicted beyond `max_entries`.
+
+SHINGLE_SIZE = 5
+NUM_PERMUTATIONS = 128
+BANDS = 32
+ROWS = NUM_PERMUTATIONS // BANDS
+
+# Upper bound on the (permutations x shingles) hash matrix built at once.
+MAX_HASH_MATRIX_SIZE = 1 << 20
+
+_NON_WORD_PATTERN = re.compile(r"[\W_]+")
+_MASK_32 = np.uint64(0xFFFFFFFF)
+
+# Fixed seeds so signatures are comparable across instances and restarts.
+_rng = np.random.default_rng(0x5EED)
+# Multiply-shift hashing: odd 64-bit multipliers, keep the high 32 bits of a*x + b.
+_PERM_A = _rng.integers(1, 2**63, size=NUM_PERMUTATIONS, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_PERM_B = _rng.integers(0, 2**63, size=NUM_PERMUTATIONS, dtype=np.uint64)
+# Polynomial hash of each shingle's bytes.
+_SHINGLE_POWERS = np.uint64(1099511628211) ** np.arange(SHINGLE_SIZE - 1, -1, -1, dtype=np.uint64)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Casefolds, strips accents and punctuation, and collapses whitespace, so cosmetic
+    variations of the same text normalize alike.
+    """
+    folded = unicodedata.normalize("NFKD", text.casefold())
+    folded = "".join(ch for ch in folded if not unicodedata.combining(ch))
+    return _NON_WORD_PATTERN.sub(" ", folded).strip()
+
+
+def signature(text: str) -> Optional[np.ndarray]:
+    """
+    Returns the MinHash signature (NUM_PERMUTATIONS uint32 values) of an already
+    normalized text, or None if it is shorter than one shingle.
+    """
+    data = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+    if len(data) < SHINGLE_SIZE:
+        return None
+    windows = np.lib.stride_tricks.sliding_window_view(data, SHINGLE_SIZE).astype(np.uint64)
+    shingles = np.unique((windows * _SHINGLE_POWERS).sum(axis=1))
+    chunk = max(1, min(NUM_PERMUTATIONS, MAX_HASH_MATRIX_SIZE // len(shingles)))
+    minimums = np.empty(NUM_PERMUTATIONS, dtype=np.uint64)
+    for start in range(0, NUM_PERMUTATIONS, chunk):
+        a, b = _PERM_A[start:start + chunk], _PERM_B[start:start + chunk]
+        # (chunk, n_shingles) hashes, wrapping mod 2**64 by design
+        hashes = (np.outer(a, shingles) + b[:, None]) >> np.uint64(32)
+        minimums[start:start + chunk] = hashes.min(axis=1)
+    return (minimums & _MASK_32).astype(np.uint32)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    Estimated Jaccard similarity of the texts behind two signatures.
+    """
+    return float(np.count_nonzero(a == b)) / NUM_PERMUTATIONS
+
+
+def _band_keys(sig: np.ndarray) -> List[bytes]:
+    raw = sig.tobytes()
+    band_size = ROWS * sig.itemsize
+    return [bytes([band]) + raw[band * band_size:(band + 1) * band_size] for band in range(BANDS)]
+
+
+class DuplicateIndex:
+    """
+    Thread-safe, bounded LSH index of recent signatures.
+    """
+
+    def __init__(self, max_entries: int, max_age: float):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        # key -> (signature, author_id, added_at), oldest first
+        self._entries: "OrderedDict[str, Tuple[np.ndarray, Optional[str], float]]" = OrderedDict()
+        self._buckets: Dict[bytes, set] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, key: str, sig: np.ndarray, author_id: Optional[str] = None, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (sig, author_id, now)
+            for band_key in _band_keys(sig):
+                self._buckets.setdefault(band_key, set()).add(key)
+            self._evict(now)
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            self._discard(key)
+
+    def remove_prefix(self, prefix: str) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                self._discard(key)
+
+    def query(self, sig: np.ndarray, min_similarity: float, now: Optional[float] = None) -> List[Tuple[str, float, Optional[str], float]]:
+        """
+        Returns (key, similarity, author_id, age in seconds) for every recent entry at
+        least `min_similarity` similar to `sig`, most similar first.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._evict(now)
+            candidates = set()
+            for band_key in _band_keys(sig):
+                candidates.update(self._buckets.get(band_key, ()))
+            matches = []
+            for key in candidates:
+                entry_sig, author_id, added_at = self._entries[key]
+                score = similarity(sig, entry_sig)
+                if score >= min_similarity:
+                    matches.append((key, score, author_id, now - added_at))
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches
+
+    def _discard(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for band_key in _band_keys(entry[0]):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def _evict(self, now: float) -> None:
+        while self._entries:
+            oldest_key, (_, _, added_at) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and now - added_at <= self.max_age:
+                break
+            self._discard(oldest_key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "buckets": len(self._buckets)}
@@ -0,0 +1,30 @@
+from typing import Optional
+
+class ContentRejectedError(ValueError):
+    """
+    Raised by the services when new content is refused by moderation (e.g. a near-duplicate
+    of recent posts). Carries the HTTP status the endpoints should answer with, and for
+    throttling, how many seconds to wait before retrying.
+    """
+
+    def __init__(self, detail: str, status_code: int = 422, retry_after: Optional[int] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> Optional[dict]:
+        return {"Retry-After": str(self.retry_after)} if self.retry_after else None
+
+
+class DeadlineExceededError(TimeoutError):
+    """
+    Raised when reads fanned out by app/core/concurrency.py miss their deadline.
+    The API answers it with 504.
+    """
+
+
+class BrokerError(ConnectionError):
+    """
+    Raised by app/core/pubsub.py when the pub/sub server can't be reached or refuses a command.
+    """
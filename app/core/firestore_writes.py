@@ -0,0 +1,30 @@
+from firebase_admin import firestore
+from google.cloud.firestore_v1.transforms import ArrayUnion
+
+# Helpers for building API responses from write results instead of re-reading the
+# document after a write. Firestore resolves SERVER_TIMESTAMP to the commit time, which
+# every WriteResult reports as update_time; other sentinels are applied locally.
+
+
+def resolve_server_timestamps(data: dict, update_time) -> dict:
+    """
+    Returns a copy of `data` with every top-level SERVER_TIMESTAMP sentinel replaced by
+    the write's `update_time`.
+    """
+    return {
+        key: update_time if value is firestore.SERVER_TIMESTAMP else value
+        for key, value in data.items()
+    }
+
+
+def merge_update(current: dict, update_data: dict, update_time) -> dict:
+    """
+    Applies a successful update to the already-known document `current` and returns the
+    result, i.e. what a read right after the write would have returned.
+    """
+    merged = {**current, **resolve_server_timestamps(update_data, update_time)}
+    for key, value in update_data.items():
+        if isinstance(value, ArrayUnion):
+            existing = list(current.get(key) or [])
+            merged[key] = existing + [item for item in value.values if item not in existing]
+    return merged
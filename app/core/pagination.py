@@ -0,0 +1,119 @@
+import base64
+import json
+from datetime import datetime
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from fastapi import Response
+
+# Opaque cursor tokens for list endpoints.
+# A cursor holds the sort-key values of the last document of a page (plus its document ID
+# as a tie-breaker) and is fed to Firestore's start_after, so a deep page costs the same
+# reads as the first one. Offsets are still accepted for old clients, but Firestore bills
+# every skipped document, so they are deprecated.
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# A page of formatted documents and the cursor for the next page (None on the last page).
+Page = Tuple[List[dict], Optional[str]]
+
+# How many underlying pages fill_page reads at most to make up for filtered-out items.
+MAX_FILL_FETCHES = 5
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"$ts": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and "$ts" in value:
+        return datetime.fromisoformat(value["$ts"])
+    return value
+
+
+def encode_cursor(values: dict) -> str:
+    payload = json.dumps({key: _encode_value(value) for key, value in values.items()}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """
+    Decodes a cursor token. Raises ValueError if it is malformed.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, dict) or "__name__" not in values:
+        raise ValueError("Invalid cursor")
+    return {key: _decode_value(value) for key, value in values.items()}
+
+
+def apply_cursor(query, cursor: Optional[str] = None, skip: int = 0):
+    """
+    Positions an ordered query after `cursor`, falling back to the deprecated offset.
+    The query must be ordered by the cursor's fields followed by '__name__'.
+    """
+    if cursor:
+        return query.start_after(decode_cursor(cursor))
+    if skip:
+        return query.offset(skip)
+    return query
+
+
+def next_cursor(docs: Sequence, limit: int, order_fields: Sequence[str] = ()) -> Optional[str]:
+    """
+    Builds the cursor for the page after `docs` (DocumentSnapshots), or None if the page
+    wasn't full and there is nothing left to read.
+    """
+    if not docs or len(docs) < limit:
+        return None
+    last_doc = docs[-1]
+    values = {field: last_doc.get(field) for field in order_fields}
+    values["__name__"] = last_doc.id
+    return encode_cursor(values)
+
+
+def set_pagination_headers(response: Response, next_page_cursor: Optional[str], skip: int = 0) -> None:
+    """
+    Exposes the next-page cursor to the client and flags deprecated offset paging.
+    """
+    if next_page_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_page_cursor
+    if skip:
+        response.headers["Deprecation"] = "true"
+        response.headers["Warning"] = '299 - "skip is deprecated; page with the cursor from the X-Next-Cursor header"'
+
+
+def fill_page(
+    fetch_page: Callable[[Optional[str], int], Page],
+    keep: Callable[[dict], bool],
+    limit: int,
+    cursor_for: Callable[[dict], str],
+    cursor: Optional[str] = None,
+    skip: int = 0,
+) -> Page:
+    """
+    Returns a page of `limit` items that pass `keep`, reading further pages through
+    `fetch_page(cursor, skip)` to replace the ones filtered out (at most MAX_FILL_FETCHES reads).
+    When the page ends mid-way through a fetched page, the next cursor is built from the last
+    returned item with `cursor_for`, so nothing is skipped or repeated.
+    """
+    kept: List[dict] = []
+    page_cursor, page_skip = cursor, skip
+    for _ in range(MAX_FILL_FETCHES):
+        items, next_page_cursor = fetch_page(page_cursor, page_skip)
+        page_skip = 0
+        for item in items:
+            if not keep(item):
+                continue
+            kept.append(item)
+            if len(kept) == limit:
+                return kept, cursor_for(item)
+        if next_page_cursor is None:
+            return kept, None
+        page_cursor = next_page_cursor
+    # Out of reads: return a short page; the cursor continues after everything scanned.
+    return kept, page_cursor
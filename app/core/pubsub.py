@@ -0,0 +1,285 @@
+import asyncio
+import ssl
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, List, Optional
+from urllib.parse import unquote, urlsplit
+
+from app.core.config import settings
+from app.core.exceptions import BrokerError
+
+# Publish/subscribe brokers used to fan chat messages out across instances.
+#
+# A broker carries opaque payloads (bytes) on named channels. Handlers subscribe per
+# channel, and a broker only asks its server for channels that have at least one local
+# handler, so an instance receives the traffic of the rooms it has sockets for.
+# Delivery is at most once per subscriber connection but publishes are retried once after
+# a connection error, so a message may arrive twice: consumers deduplicate.
+#
+# - InMemoryBroker delivers to handlers in the same process. Several consumers sharing one
+#   instance behave like separate servers on a shared broker.
+# - RedisBroker speaks RESP (the Redis protocol) over asyncio streams: one connection for
+#   PUBLISH and one in subscribe mode, reconnected with exponential backoff. Messages
+#   published while the subscriber is reconnecting are lost; clients catch up through the
+#   message history endpoint. Any server that implements PUBLISH/SUBSCRIBE/UNSUBSCRIBE
+#   (and AUTH if the URL has a password) will do.
+
+Handler = Callable[[str, bytes], Awaitable[None]]
+
+
+class Broker(ABC):
+    """
+    Keeps the local handlers of each channel. Subclasses publish and tell their server
+    when a channel gains its first handler or loses its last one.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Handler]] = {}
+
+    @abstractmethod
+    async def publish(self, channel: str, data: bytes) -> None:
+        ...
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        handlers = self._handlers.setdefault(channel, [])
+        handlers.append(handler)
+        if len(handlers) == 1:
+            await self._subscribe(channel)
+
+    async def unsubscribe(self, channel: str, handler: Handler) -> None:
+        handlers = self._handlers.get(channel)
+        if not handlers or handler not in handlers:
+            return
+        handlers.remove(handler)
+        if not handlers:
+            del self._handlers[channel]
+            await self._unsubscribe(channel)
+
+    async def _subscribe(self, channel: str) -> None:
+        pass
+
+    async def _unsubscribe(self, channel: str) -> None:
+        pass
+
+    async def _dispatch(self, channel: str, data: bytes) -> None:
+        for handler in list(self._handlers.get(channel, ())):
+            try:
+                await handler(channel, data)
+            except Exception as e:
+                # One failing consumer mustn't stop delivery to the others.
+                print(f"Pub/sub handler failed on channel {channel}: {e!r}")
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__, "channels": len(self._handlers)}
+
+
+class InMemoryBroker(Broker):
+    async def publish(self, channel: str, data: bytes) -> None:
+        await self._dispatch(channel, data)
+
+
+# --- RESP client ---
+
+def _encode_command(*args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        elif isinstance(arg, int):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+async def _read_reply(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise BrokerError("Connection closed by the pub/sub server")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest
+    if kind == b"-":
+        raise BrokerError(f"Pub/sub server error: {rest.decode(errors='replace')}")
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if kind == b"*":
+        length = int(rest)
+        if length < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(length)]
+    raise BrokerError(f"Unexpected reply from the pub/sub server: {line[:50]!r}")
+
+
+class _RespConnection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    async def send(self, *args) -> None:
+        self.writer.write(_encode_command(*args))
+        await self.writer.drain()
+
+    async def read(self):
+        return await _read_reply(self.reader)
+
+    async def command(self, *args):
+        await self.send(*args)
+        return await self.read()
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+# Errors after which a connection is dropped and opened again.
+_CONNECTION_ERRORS = (OSError, EOFError, asyncio.TimeoutError, BrokerError)
+
+
+class RedisBroker(Broker):
+    """
+    Broker backed by a Redis-protocol server, e.g. redis://:password@host:6379
+    (rediss:// for TLS).
+    """
+
+    def __init__(self, url: str, timeout: float = 2.0, reconnect_max_seconds: float = 30.0):
+        super().__init__()
+        parsed = urlsplit(url)
+        if parsed.scheme not in ("redis", "rediss"):
+            raise ValueError(f"Unsupported pub/sub URL scheme '{parsed.scheme}'")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.ssl = ssl.create_default_context() if parsed.scheme == "rediss" else None
+        self.timeout = timeout
+        self.reconnect_max_seconds = reconnect_max_seconds
+
+        self._publisher: Optional[_RespConnection] = None
+        self._publish_lock = asyncio.Lock()
+        self._subscriber: Optional[_RespConnection] = None
+        self._subscriber_task: Optional[asyncio.Task] = None
+        self.published = 0
+        self.received = 0
+        self.reconnects = 0
+
+    async def _connect(self) -> _RespConnection:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl), self.timeout
+        )
+        connection = _RespConnection(reader, writer)
+        if self.password:
+            try:
+                auth = ("AUTH", self.username, self.password) if self.username else ("AUTH", self.password)
+                await asyncio.wait_for(connection.command(*auth), self.timeout)
+            except BaseException:
+                connection.close()
+                raise
+        return connection
+
+    async def publish(self, channel: str, data: bytes) -> None:
+        async with self._publish_lock:
+            for attempt in range(2):
+                try:
+                    if self._publisher is None:
+                        self._publisher = await self._connect()
+                    await asyncio.wait_for(self._publisher.command("PUBLISH", channel, data), self.timeout)
+                    self.published += 1
+                    return
+                except _CONNECTION_ERRORS as e:
+                    if self._publisher is not None:
+                        self._publisher.close()
+                        self._publisher = None
+                    if attempt:
+                        raise BrokerError(f"Could not publish to {self.host}:{self.port}: {e!r}") from e
+
+    async def _subscribe(self, channel: str) -> None:
+        await self.start()
+        if self._subscriber is not None:
+            try:
+                await self._subscriber.send("SUBSCRIBE", channel)
+            except _CONNECTION_ERRORS:
+                pass # The subscriber loop reconnects and subscribes to every channel again.
+
+    async def _unsubscribe(self, channel: str) -> None:
+        if self._subscriber is not None:
+            try:
+                await self._subscriber.send("UNSUBSCRIBE", channel)
+            except _CONNECTION_ERRORS:
+                pass
+
+    async def _run_subscriber(self) -> None:
+        delay = 0.5
+        while True:
+            connection = None
+            try:
+                connection = await self._connect()
+                self._subscriber = connection
+                # Channels subscribed from now on are sent by _subscribe; repeats are harmless.
+                channels = list(self._handlers)
+                if channels:
+                    await connection.send("SUBSCRIBE", *channels)
+                delay = 0.5
+                while True:
+                    reply = await connection.read()
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                        self.received += 1
+                        await self._dispatch(reply[1].decode(), reply[2])
+            except _CONNECTION_ERRORS as e:
+                print(f"Pub/sub subscriber lost {self.host}:{self.port} ({e!r}), reconnecting in {delay}s")
+            finally:
+                self._subscriber = None
+                if connection is not None:
+                    connection.close()
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.reconnect_max_seconds)
+
+    async def start(self) -> None:
+        if self._subscriber_task is None or self._subscriber_task.done():
+            self._subscriber_task = asyncio.create_task(self._run_subscriber())
+
+    async def stop(self) -> None:
+        if self._subscriber_task is not None:
+            self._subscriber_task.cancel()
+            try:
+                await self._subscriber_task
+            except asyncio.CancelledError:
+                pass
+            self._subscriber_task = None
+        async with self._publish_lock:
+            if self._publisher is not None:
+                self._publisher.close()
+                self._publisher = None
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "connected": self._subscriber is not None,
+            "published": self.published,
+            "received": self.received,
+            "reconnects": self.reconnects,
+        }
+
+
+def create_broker() -> Broker:
+    """
+    Returns the broker selected by PUBSUB_BACKEND.
+    """
+    if settings.PUBSUB_BACKEND == "redis":
+        return RedisBroker(
+            settings.PUBSUB_REDIS_URL,
+            timeout=settings.PUBSUB_TIMEOUT_SECONDS,
+            reconnect_max_seconds=settings.PUBSUB_RECONNECT_MAX_SECONDS,
+        )
+    if settings.PUBSUB_BACKEND != "memory":
+        raise ValueError(f"Unknown PUBSUB_BACKEND '{settings.PUBSUB_BACKEND}'")
+    return InMemoryBroker()
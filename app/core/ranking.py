@@ -0,0 +1,59 @@
+import math
+from datetime import datetime, timezone
+from typing import Optional
+
+from app.core.config import settings
+
+# Precomputed ranking scores for the hot and top feeds.
+# Both are stored on the post document so each feed is a single indexed range read
+# ordered by the score. They only change when the post's counters change, so the counter
+# materializer rewrites them together with the materialized totals.
+
+HOT_SCORE_FIELD = "hot_score"
+TOP_SCORE_FIELD = "top_score"
+
+# Posts are ranked relative to this instant; only differences between scores matter.
+_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def hot_score(upvotes: int, downvotes: int, created_at: Optional[datetime] = None) -> float:
+    """
+    Time-decayed popularity: log10 of the net votes plus the post's age bonus.
+    Newer posts get a linearly growing head start, which is equivalent to decaying every
+    older post over time, but the score never has to be recomputed as time passes:
+    a post that is HOT_SCORE_TIME_DECAY_SECONDS younger needs 10x fewer net votes.
+    """
+    net = (upvotes or 0) - (downvotes or 0)
+    order = math.log10(max(abs(net), 1))
+    sign = 1 if net > 0 else -1 if net < 0 else 0
+    if created_at is None:
+        created_at = datetime.now(timezone.utc)
+    elif created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    seconds = (created_at - _EPOCH).total_seconds()
+    return round(sign * order + seconds / settings.HOT_SCORE_TIME_DECAY_SECONDS, 7)
+
+
+def top_score(upvotes: int, downvotes: int) -> float:
+    """
+    Lower bound of the Wilson score interval for the share of upvotes.
+    Ranks by how confidently a post is liked, so 40 up / 2 down beats 2 up / 0 down.
+    """
+    upvotes = max(upvotes or 0, 0)
+    total = upvotes + max(downvotes or 0, 0)
+    if total == 0:
+        return 0.0
+    z = settings.TOP_SCORE_CONFIDENCE_Z
+    phat = upvotes / total
+    bound = (phat + z * z / (2 * total) - z * math.sqrt((phat * (1 - phat) + z * z / (4 * total)) / total)) / (1 + z * z / total)
+    return round(bound, 7)
+
+
+def post_scores(upvotes: int, downvotes: int, created_at: Optional[datetime] = None) -> dict:
+    """
+    Returns the ranking fields to store on a post.
+    """
+    return {
+        HOT_SCORE_FIELD: hot_score(upvotes, downvotes, created_at),
+        TOP_SCORE_FIELD: top_score(upvotes, downvotes),
+    }
@@ -0,0 +1,250 @@
+import threading
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+# In-process TF-IDF vector index for "related posts" (cosine top-k).
+#
+# Documents are bags of hashed features: every token is hashed into one of N_FEATURES
+# buckets (the hashing trick), so there's no vocabulary to maintain and a vector is two
+# small arrays (feature ids, log-scaled term frequencies). Document frequencies are kept
+# per feature as documents come and go, so IDF weights are always current.
+#
+# Like the search index, storage has two parts:
+# - a base matrix in compressed sparse column form (feature -> rows and weights), built by
+#   compact(). Rows are TF-IDF weighted and L2-normalized at that time, and a query only
+#   touches the columns of its own features.
+# - a delta of rows added since, weighted with the IDF current when they were added and
+#   scored with one vectorized pass.
+# Removed rows are masked until the next compaction. compact() runs outside the lock and
+# replays changes made while it ran.
+
+FEATURE_BITS = 18
+N_FEATURES = 1 << FEATURE_BITS
+# Queries use only their highest-weighted features: rare words decide similarity, and the
+# long posting lists of common words would dominate query time.
+MAX_QUERY_FEATURES = 32
+
+SparseVector = Tuple[np.ndarray, np.ndarray] # (sorted feature ids int32, values float32)
+
+
+def hash_features(tokens: Iterable[str]) -> SparseVector:
+    """
+    Hashes tokens into a sparse term-frequency vector with 1 + log(tf) values.
+    """
+    counts = Counter(zlib.crc32(token.encode()) & (N_FEATURES - 1) for token in tokens)
+    feature_ids = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+    tfs = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    order = np.argsort(feature_ids)
+    return feature_ids[order], (1 + np.log(tfs[order])).astype(np.float32)
+
+
+class RelatedIndex:
+    """
+    Thread-safe cosine-similarity index over hashed TF-IDF vectors.
+    Holds at most `max_rows` documents; the oldest additions are evicted first.
+    """
+
+    def __init__(self, max_rows: int):
+        self.max_rows = max_rows
+        self._lock = threading.RLock()
+        self._rows: Dict[str, SparseVector] = {} # Raw tf vectors of every live row, oldest first
+        self._df = np.zeros(N_FEATURES, dtype=np.int32)
+
+        self._base_keys: List[str] = []
+        self._base_index: Dict[str, int] = {}
+        self._base_alive = np.zeros(0, dtype=bool)
+        self._base_ptr = np.zeros(N_FEATURES + 1, dtype=np.int64)
+        self._base_rows = np.zeros(0, dtype=np.int32)
+        self._base_weights = np.zeros(0, dtype=np.float32)
+        self._base_dead = 0
+
+        self._delta: Dict[str, SparseVector] = {} # Weighted, normalized
+        self._delta_arrays = None # Concatenated delta, rebuilt lazily
+        self._touched_during_compaction: Optional[set] = None
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def _weigh(self, vector: SparseVector, n_docs: int) -> np.ndarray:
+        feature_ids, tfs = vector
+        idf = np.log((n_docs + 1) / (self._df[feature_ids] + 1)) + 1
+        weights = (tfs * idf).astype(np.float32)
+        norm = np.linalg.norm(weights)
+        return weights / norm if norm else weights
+
+    # --- Updates ---
+
+    def add(self, key: str, tokens: Iterable[str]) -> None:
+        vector = hash_features(tokens)
+        with self._lock:
+            self._remove(key)
+            if not len(vector[0]):
+                return
+            self._rows[key] = vector
+            self._df[vector[0]] += 1
+            self._delta[key] = (vector[0], self._weigh(vector, len(self._rows)))
+            self._delta_arrays = None
+            self._touch(key)
+            while len(self._rows) > self.max_rows:
+                oldest_key = next(iter(self._rows))
+                self._remove(oldest_key)
+                self._touch(oldest_key)
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            self._remove(key)
+            self._touch(key)
+
+    def _touch(self, key: str) -> None:
+        if self._touched_during_compaction is not None:
+            self._touched_during_compaction.add(key)
+
+    def _remove(self, key: str) -> None:
+        vector = self._rows.pop(key, None)
+        if vector is None:
+            return
+        self._df[vector[0]] -= 1
+        if self._delta.pop(key, None) is not None:
+            self._delta_arrays = None
+        else:
+            row = self._base_index.get(key)
+            if row is not None and self._base_alive[row]:
+                self._base_alive[row] = False
+                self._base_dead += 1
+
+    # --- Queries ---
+
+    def vector_for(self, key: str) -> Optional[SparseVector]:
+        with self._lock:
+            return self._rows.get(key)
+
+    def _delta_scores(self, query_dense: np.ndarray):
+        if self._delta_arrays is None:
+            keys = list(self._delta)
+            vectors = [self._delta[key] for key in keys]
+            row_ids = np.repeat(np.arange(len(keys), dtype=np.int32), [len(v[0]) for v in vectors]) if keys else np.zeros(0, dtype=np.int32)
+            feature_ids = np.concatenate([v[0] for v in vectors]) if keys else np.zeros(0, dtype=np.int32)
+            weights = np.concatenate([v[1] for v in vectors]) if keys else np.zeros(0, dtype=np.float32)
+            self._delta_arrays = (keys, row_ids, feature_ids, weights)
+        keys, row_ids, feature_ids, weights = self._delta_arrays
+        scores = np.bincount(row_ids, weights=weights * query_dense[feature_ids], minlength=len(keys))
+        return keys, scores
+
+    def query(self, vector: SparseVector, k: int = 10, exclude: Iterable[str] = ()) -> List[Tuple[str, float]]:
+        """
+        Returns up to `k` (key, cosine similarity) pairs most similar to a raw tf vector
+        (see hash_features / vector_for), best first, leaving out `exclude`.
+        """
+        feature_ids, _ = vector
+        if not len(feature_ids):
+            return []
+        with self._lock:
+            query_weights = self._weigh(vector, max(len(self._rows), 1))
+            if len(feature_ids) > MAX_QUERY_FEATURES:
+                strongest = np.sort(np.argpartition(query_weights, -MAX_QUERY_FEATURES)[-MAX_QUERY_FEATURES:])
+                feature_ids, query_weights = feature_ids[strongest], query_weights[strongest]
+            exclude = set(exclude)
+
+            candidates: List[Tuple[float, str]] = []
+            if self._base_keys:
+                starts = self._base_ptr[feature_ids]
+                ends = self._base_ptr[feature_ids + 1]
+                lengths = ends - starts
+                if lengths.sum():
+                    positions = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends) if e > s])
+                    contributions = self._base_weights[positions] * np.repeat(query_weights, lengths)
+                    scores = np.bincount(self._base_rows[positions], weights=contributions, minlength=len(self._base_keys))
+                    scores[~self._base_alive] = 0
+                    candidates.extend(self._top(scores, self._base_keys, k + len(exclude)))
+
+            if self._delta:
+                query_dense = np.zeros(N_FEATURES, dtype=np.float32)
+                query_dense[feature_ids] = query_weights
+                keys, scores = self._delta_scores(query_dense)
+                candidates.extend(self._top(scores, keys, k + len(exclude)))
+
+        candidates.sort(reverse=True)
+        return [(key, round(score, 4)) for score, key in candidates if key not in exclude][:k]
+
+    @staticmethod
+    def _top(scores: np.ndarray, keys: List[str], k: int) -> List[Tuple[float, str]]:
+        if len(scores) > k:
+            top = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(len(scores))
+        return [(float(scores[i]), keys[i]) for i in top if scores[i] > 0]
+
+    # --- Compaction ---
+
+    def needs_compaction(self, max_delta: int, max_dead_fraction: float = 0.2) -> bool:
+        with self._lock:
+            return len(self._delta) >= max_delta or self._base_dead > max_dead_fraction * max(len(self._base_keys), 1)
+
+    def compact(self) -> None:
+        """
+        Rebuilds the base matrix from every live row with current IDF weights.
+        """
+        with self._lock:
+            if self._touched_during_compaction is not None:
+                return
+            rows = dict(self._rows)
+            df = self._df.copy()
+            self._touched_during_compaction = set()
+
+        try:
+            keys = list(rows)
+            n_docs = max(len(keys), 1)
+            idf = (np.log((n_docs + 1) / (df + 1)) + 1).astype(np.float32)
+            if keys:
+                lengths = [len(rows[key][0]) for key in keys]
+                feature_ids = np.concatenate([rows[key][0] for key in keys])
+                weights = np.concatenate([rows[key][1] for key in keys]) * idf[feature_ids]
+                row_ids = np.repeat(np.arange(len(keys), dtype=np.int32), lengths)
+                norms = np.sqrt(np.bincount(row_ids, weights=weights * weights, minlength=len(keys)))
+                weights = (weights / norms[row_ids]).astype(np.float32)
+                order = np.argsort(feature_ids, kind="stable")
+                feature_ids, row_ids, weights = feature_ids[order], row_ids[order], weights[order]
+            else:
+                feature_ids = np.zeros(0, dtype=np.int32)
+                row_ids = np.zeros(0, dtype=np.int32)
+                weights = np.zeros(0, dtype=np.float32)
+            ptr = np.zeros(N_FEATURES + 1, dtype=np.int64)
+            np.cumsum(np.bincount(feature_ids, minlength=N_FEATURES), out=ptr[1:])
+        except BaseException:
+            with self._lock:
+                self._touched_during_compaction = None
+            raise
+
+        with self._lock:
+            touched = self._touched_during_compaction
+            self._touched_during_compaction = None
+            self._base_keys = keys
+            self._base_index = {key: i for i, key in enumerate(keys)}
+            self._base_alive = np.ones(len(keys), dtype=bool)
+            self._base_ptr, self._base_rows, self._base_weights = ptr, row_ids, weights
+            self._base_dead = 0
+            self._delta = {}
+            self._delta_arrays = None
+            # Rows changed while compacting: the base copy is stale, the live one goes to the delta.
+            for key in touched:
+                row = self._base_index.get(key)
+                if row is not None:
+                    self._base_alive[row] = False
+                    self._base_dead += 1
+                vector = self._rows.get(key)
+                if vector is not None:
+                    self._delta[key] = (vector[0], self._weigh(vector, len(self._rows)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "documents": len(self._rows),
+                "base_rows": len(self._base_keys),
+                "base_dead": self._base_dead,
+                "delta_rows": len(self._delta),
+            }
@@ -0,0 +1,473 @@
+import bisect
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# In-process full-text index with BM25 ranking and prefix matching.
+#
+# The index is log-structured:
+# - A base segment is an immutable file (see _write_segment for the layout) that is
+#   mmap'ed. Posting lists are zero-copy memoryviews into the mapping, so loading a large
+#   index only decodes the term and key tables.
+# - A memory segment holds documents added or changed since the base was written.
+#   Base copies of changed or removed documents are masked by a deleted set.
+# save() merges both into a new base file (written atomically) and swaps it in. Updates
+# that arrive while the merge runs are replayed on top of the new base.
+#
+# Documents are identified by string keys; keys sort so that related documents can be
+# removed by prefix (e.g. every comment of a post). Each document carries a small JSON
+# payload returned with its hits, so a search never needs the database.
+
+_MAGIC = b"EHSI"
+_VERSION = 1
+# magic, version, n_docs, n_terms, total_len, then the offsets of the 10 sections
+_HEADER = struct.Struct("<4sIIIQ10Q")
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+_MAX_TOKEN_LENGTH = 40
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i if in into is it its me my no not of on or so "
+    "that the their then there these they this to was we were will with you your".split()
+)
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# The last query word also matches terms it is a prefix of ("anx" -> "anxiety"), at a
+# slightly lower weight, expanded to at most this many of the most common such terms.
+PREFIX_WEIGHT = 0.8
+MAX_PREFIX_EXPANSIONS = 32
+MIN_PREFIX_LENGTH = 2
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits text into lowercase, accent-folded word tokens without stopwords.
+    """
+    if not text:
+        return []
+    folded = unicodedata.normalize("NFKD", text.casefold())
+    folded = "".join(ch for ch in folded if not unicodedata.combining(ch))
+    return [
+        token for token in _TOKEN_PATTERN.findall(folded)
+        if token not in STOPWORDS and len(token) <= _MAX_TOKEN_LENGTH
+    ]
+
+
+def _u32_view(mv: memoryview, offset: int, count: int):
+    view = mv[offset:offset + 4 * count].cast("I")
+    if sys.byteorder != "little":
+        view = array("I", view)
+        view.byteswap()
+    return view
+
+
+def _u64_view(mv: memoryview, offset: int, count: int):
+    view = mv[offset:offset + 8 * count].cast("Q")
+    if sys.byteorder != "little":
+        view = array("Q", view)
+        view.byteswap()
+    return view
+
+
+def _pad(buffer: bytearray) -> None:
+    buffer.extend(b"\0" * (-len(buffer) % 8))
+
+
+def _le_bytes(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _write_segment(path: str, docs: List[Tuple[str, int, bytes]], postings: Dict[str, List[Tuple[int, int]]]) -> None:
+    """
+    Writes a base segment. `docs` are (key, length, payload) sorted by key, and `postings`
+    maps each term to (doc index, term frequency) pairs sorted by doc index.
+
+    Layout (little-endian, every section 8-byte aligned):
+      header | doc lengths u32[n] | key offsets u64[n+1] | key bytes
+             | payload offsets u64[n+1] | payload bytes
+             | term offsets u64[t+1] | term bytes (sorted) | document frequencies u32[t]
+             | posting offsets u64[t] | postings: per term, doc indexes u32[df] then frequencies u32[df]
+    """
+    terms = sorted(postings)
+    body = bytearray()
+    offsets = []
+
+    def section(data: bytes) -> None:
+        offsets.append(_HEADER.size + len(body))
+        body.extend(data)
+        _pad(body)
+
+    def blob_with_offsets(items: Iterable[bytes]) -> Tuple[bytes, bytes]:
+        item_offsets = array("Q", [0])
+        blob = bytearray()
+        for item in items:
+            blob.extend(item)
+            item_offsets.append(len(blob))
+        return _le_bytes(item_offsets), bytes(blob)
+
+    section(_le_bytes(array("I", (length for _, length, _ in docs))))
+    key_offsets, key_blob = blob_with_offsets(key.encode() for key, _, _ in docs)
+    section(key_offsets)
+    section(key_blob)
+    payload_offsets, payload_blob = blob_with_offsets(payload for _, _, payload in docs)
+    section(payload_offsets)
+    section(payload_blob)
+    term_offsets, term_blob = blob_with_offsets(term.encode() for term in terms)
+    section(term_offsets)
+    section(term_blob)
+    section(_le_bytes(array("I", (len(postings[term]) for term in terms))))
+
+    # Postings come last; their offsets are relative to the start of the postings section.
+    postings_blob = bytearray()
+    posting_offsets = array("Q")
+    for term in terms:
+        posting_offsets.append(len(postings_blob))
+        entries = postings[term]
+        postings_blob.extend(_le_bytes(array("I", (doc_index for doc_index, _ in entries))))
+        postings_blob.extend(_le_bytes(array("I", (tf for _, tf in entries))))
+    section(_le_bytes(posting_offsets))
+    section(bytes(postings_blob))
+
+    total_len = sum(length for _, length, _ in docs)
+    header = _HEADER.pack(_MAGIC, _VERSION, len(docs), len(terms), total_len, *offsets)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class _DiskSegment:
+    """
+    A read-only, mmap'ed base segment.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mv = memoryview(self._mmap)
+        (magic, version, n_docs, n_terms, total_len, *offsets) = _HEADER.unpack_from(mv, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{path} is not a search index (version {_VERSION})")
+        (lengths_at, key_offsets_at, keys_at, payload_offsets_at, payloads_at,
+         term_offsets_at, terms_at, dfs_at, posting_offsets_at, postings_at) = offsets
+
+        self.n_docs = n_docs
+        self.total_len = total_len
+        self.doc_lengths = _u32_view(mv, lengths_at, n_docs)
+        key_offsets = _u64_view(mv, key_offsets_at, n_docs + 1)
+        self.keys = [bytes(mv[keys_at + key_offsets[i]:keys_at + key_offsets[i + 1]]).decode() for i in range(n_docs)]
+        self.key_index = {key: i for i, key in enumerate(self.keys)}
+        self._payload_offsets = _u64_view(mv, payload_offsets_at, n_docs + 1)
+        self._payloads_at = payloads_at
+
+        term_offsets = _u64_view(mv, term_offsets_at, n_terms + 1)
+        self.terms = [bytes(mv[terms_at + term_offsets[i]:terms_at + term_offsets[i + 1]]).decode() for i in range(n_terms)]
+        dfs = _u32_view(mv, dfs_at, n_terms)
+        posting_offsets = _u64_view(mv, posting_offsets_at, n_terms)
+        self._term_postings = {
+            term: (postings_at + posting_offsets[i], dfs[i]) for i, term in enumerate(self.terms)
+        }
+        self._mv = mv
+
+    def df(self, term: str) -> int:
+        entry = self._term_postings.get(term)
+        return entry[1] if entry else 0
+
+    def postings(self, term: str):
+        """
+        Returns (doc indexes, term frequencies) views for a term, or None.
+        """
+        entry = self._term_postings.get(term)
+        if entry is None:
+            return None
+        offset, df = entry
+        return _u32_view(self._mv, offset, df), _u32_view(self._mv, offset + 4 * df, df)
+
+    def payload(self, doc_index: int) -> bytes:
+        start = self._payloads_at + self._payload_offsets[doc_index]
+        end = self._payloads_at + self._payload_offsets[doc_index + 1]
+        return bytes(self._mv[start:end])
+
+    def keys_with_prefix(self, prefix: str) -> List[str]:
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + "\U0010ffff")
+        return self.keys[start:end]
+
+
+class SearchIndex:
+    """
+    Thread-safe full-text index. See the module comment for the design.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._base: Optional[_DiskSegment] = None
+        self._base_deleted = set() # Base doc indexes masked by a removal or a newer version
+        # key -> (length, term frequencies, payload bytes); entries are replaced, never mutated
+        self._mem_docs: Dict[str, Tuple[int, Counter, bytes]] = {}
+        self._mem_postings: Dict[str, Dict[str, int]] = {}
+        self._mem_terms_sorted: Optional[List[str]] = None
+        self._total_len = 0
+        self._touched_during_save: Optional[set] = None
+        self.dirty = False
+
+    # --- Updates ---
+
+    def add(self, key: str, text: str, payload: Optional[dict] = None) -> None:
+        """
+        Indexes (or re-indexes) a document.
+        """
+        tokens = tokenize(text)
+        payload_bytes = json.dumps(payload or {}, separators=(",", ":"), default=str).encode()
+        with self._lock:
+            self._remove(key)
+            terms = Counter(tokens)
+            self._mem_docs[key] = (len(tokens), terms, payload_bytes)
+            for term, tf in terms.items():
+                if term not in self._mem_postings:
+                    self._mem_postings[term] = {}
+                    self._mem_terms_sorted = None
+                self._mem_postings[term][key] = tf
+            self._total_len += len(tokens)
+            self._touch(key)
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            self._remove(key)
+            self._touch(key)
+
+    def remove_prefix(self, prefix: str) -> None:
+        """
+        Removes every document whose key starts with `prefix`.
+        """
+        with self._lock:
+            keys = [key for key in self._mem_docs if key.startswith(prefix)]
+            if self._base is not None:
+                keys.extend(self._base.keys_with_prefix(prefix))
+            for key in keys:
+                self._remove(key)
+                self._touch(key)
+
+    def _touch(self, key: str) -> None:
+        self.dirty = True
+        if self._touched_during_save is not None:
+            self._touched_during_save.add(key)
+
+    def _remove(self, key: str) -> None:
+        doc = self._mem_docs.pop(key, None)
+        if doc is not None:
+            length, terms, _ = doc
+            self._total_len -= length
+            for term in terms:
+                term_postings = self._mem_postings.get(term)
+                if term_postings is not None:
+                    term_postings.pop(key, None)
+                    if not term_postings:
+                        del self._mem_postings[term]
+                        self._mem_terms_sorted = None
+        if self._base is not None:
+            doc_index = self._base.key_index.get(key)
+            if doc_index is not None and doc_index not in self._base_deleted:
+                self._base_deleted.add(doc_index)
+                self._total_len -= self._base.doc_lengths[doc_index]
+
+    # --- Queries ---
+
+    def __len__(self) -> int:
+        with self._lock:
+            base_docs = self._base.n_docs - len(self._base_deleted) if self._base else 0
+            return base_docs + len(self._mem_docs)
+
+    def _df(self, term: str) -> int:
+        base_df = self._base.df(term) if self._base else 0
+        return base_df + len(self._mem_postings.get(term, ()))
+
+    def _prefix_expansions(self, prefix: str) -> List[str]:
+        if self._mem_terms_sorted is None:
+            self._mem_terms_sorted = sorted(self._mem_postings)
+        candidates = set()
+        for terms in ([self._base.terms] if self._base else []) + [self._mem_terms_sorted]:
+            start = bisect.bisect_left(terms, prefix)
+            for term in terms[start:start + 4 * MAX_PREFIX_EXPANSIONS]:
+                if not term.startswith(prefix):
+                    break
+                candidates.add(term)
+        candidates.discard(prefix)
+        return heapq.nlargest(MAX_PREFIX_EXPANSIONS, candidates, key=self._df)
+
+    def search(self, query: str, limit: int = 20, key_prefix: str = "", prefix: bool = True) -> List[Tuple[str, float, dict]]:
+        """
+        Returns up to `limit` (key, score, payload) hits for `query`, best first, ranked
+        with BM25. Only keys starting with `key_prefix` are returned. With `prefix`, the
+        last query word also matches longer terms (search-as-you-type).
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        with self._lock:
+            n_docs = len(self)
+            if n_docs == 0:
+                return []
+            avg_len = max(self._total_len / n_docs, 1.0)
+
+            weighted_terms = [(token, 1.0) for token in tokens]
+            last = tokens[-1]
+            if prefix and len(last) >= MIN_PREFIX_LENGTH and query == query.rstrip():
+                weighted_terms.extend((term, PREFIX_WEIGHT) for term in self._prefix_expansions(last))
+
+            base_scores: Dict[int, float] = {}
+            mem_scores: Dict[str, float] = {}
+            base = self._base
+            deleted = self._base_deleted
+            norm = K1 * (1 - B)
+            for term, weight in weighted_terms:
+                df = self._df(term)
+                if df == 0:
+                    continue
+                idf = weight * math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                if base is not None:
+                    postings = base.postings(term)
+                    if postings is not None:
+                        doc_indexes, tfs = postings
+                        lengths = base.doc_lengths
+                        for doc_index, tf in zip(doc_indexes, tfs):
+                            if doc_index in deleted:
+                                continue
+                            length_norm = norm + K1 * B * lengths[doc_index] / avg_len
+                            base_scores[doc_index] = base_scores.get(doc_index, 0.0) + idf * tf * (K1 + 1) / (tf + length_norm)
+                for key, tf in self._mem_postings.get(term, {}).items():
+                    length_norm = norm + K1 * B * self._mem_docs[key][0] / avg_len
+                    mem_scores[key] = mem_scores.get(key, 0.0) + idf * tf * (K1 + 1) / (tf + length_norm)
+
+            candidates = [
+                (score, base.keys[doc_index], doc_index) for doc_index, score in base_scores.items()
+                if base.keys[doc_index].startswith(key_prefix)
+            ]
+            candidates.extend(
+                (score, key, None) for key, score in mem_scores.items() if key.startswith(key_prefix)
+            )
+            hits = []
+            for score, key, doc_index in heapq.nlargest(limit, candidates, key=lambda hit: (hit[0], hit[1])):
+                payload = base.payload(doc_index) if doc_index is not None else self._mem_docs[key][2]
+                hits.append((key, round(score, 4), json.loads(payload)))
+            return hits
+
+    # --- Persistence ---
+
+    def load(self, path: str) -> None:
+        """
+        Replaces the index contents with the base segment stored at `path`.
+        """
+        segment = _DiskSegment(path)
+        with self._lock:
+            self._base = segment
+            self._base_deleted = set()
+            self._mem_docs = {}
+            self._mem_postings = {}
+            self._mem_terms_sorted = None
+            self._total_len = segment.total_len
+            self.dirty = False
+
+    def save(self, path: str) -> None:
+        """
+        Merges everything into a new base segment at `path` and switches to it.
+        Searches and updates keep running while the file is written.
+        """
+        with self._lock:
+            if self._touched_during_save is not None:
+                raise RuntimeError("A save is already in progress")
+            base = self._base
+            base_deleted = set(self._base_deleted)
+            mem_docs = dict(self._mem_docs)
+            self._touched_during_save = set()
+            self.dirty = False
+
+        try:
+            # New doc order: all live keys sorted, so prefix removal can bisect.
+            live_base = [] if base is None else [i for i in range(base.n_docs) if i not in base_deleted]
+            keys = sorted([base.keys[i] for i in live_base] + list(mem_docs))
+            new_index = {key: i for i, key in enumerate(keys)}
+            docs = []
+            for key in keys:
+                if key in mem_docs:
+                    length, _, payload = mem_docs[key]
+                else:
+                    doc_index = base.key_index[key]
+                    length, payload = base.doc_lengths[doc_index], base.payload(doc_index)
+                docs.append((key, length, payload))
+
+            postings: Dict[str, List[Tuple[int, int]]] = {}
+            if base is not None:
+                for term in base.terms:
+                    doc_indexes, tfs = base.postings(term)
+                    entries = [
+                        (new_index[base.keys[doc_index]], tf)
+                        for doc_index, tf in zip(doc_indexes, tfs) if doc_index not in base_deleted
+                    ]
+                    if entries:
+                        postings[term] = entries
+            for key, (_, terms, _) in mem_docs.items():
+                for term, tf in terms.items():
+                    postings.setdefault(term, []).append((new_index[key], tf))
+            for entries in postings.values():
+                entries.sort()
+
+            _write_segment(path, docs, postings)
+            segment = _DiskSegment(path)
+        except BaseException:
+            with self._lock:
+                self._touched_during_save = None
+                self.dirty = True
+            raise
+
+        with self._lock:
+            touched = self._touched_during_save
+            self._touched_during_save = None
+            current_docs = self._mem_docs
+            self._base = segment
+            self._base_deleted = set()
+            self._mem_docs = {}
+            self._mem_postings = {}
+            self._mem_terms_sorted = None
+            self._total_len = segment.total_len
+            # Replay what changed while the file was being written.
+            for key in touched:
+                doc_index = segment.key_index.get(key)
+                if doc_index is not None:
+                    self._base_deleted.add(doc_index)
+                    self._total_len -= segment.doc_lengths[doc_index]
+                doc = current_docs.get(key)
+                if doc is not None:
+                    length, terms, _ = doc
+                    self._mem_docs[key] = doc
+                    self._total_len += length
+                    for term, tf in terms.items():
+                        self._mem_postings.setdefault(term, {})[key] = tf
+            self.dirty = bool(touched)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "documents": len(self),
+                "base_documents": self._base.n_docs if self._base else 0,
+                "base_deleted": len(self._base_deleted),
+                "memory_documents": len(self._mem_docs),
+                "memory_terms": len(self._mem_postings),
+            }
@@ -1,5 +1,8 @@
+import threading
+import time
+import uuid
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from pydantic import ValidationError
 from datetime import datetime, timedelta, timezone
 from jose import JWTError, jwt
@@ -11,6 +14,10 @@ from app.core.config import settings
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
+ACCESS_TOKEN_TYPE = "access"
+REFRESH_TOKEN_TYPE = "refresh"
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -18,10 +25,90 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
+    # A unique token id lets a single token be put on the deny-list.
+    to_encode.setdefault("jti", uuid.uuid4().hex)
+    to_encode.setdefault("type", ACCESS_TOKEN_TYPE)
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
 
+def get_access_token_expire_minutes() -> int:
+    if settings.STATELESS_AUTH_ENABLED:
+        return settings.STATELESS_ACCESS_TOKEN_EXPIRE_MINUTES
+    return settings.ACCESS_TOKEN_EXPIRE_MINUTES
+
+
+def build_access_token_claims(user: dict) -> dict:
+    """
+    Builds the access token payload for a user document.
+    In stateless mode the profile claims needed to authenticate a request are embedded,
+    so get_current_user_firestore can trust the token without reading the user.
+    """
+    claims = {"sub": user['username'], "anonymous_id": user['anonymous_id']}
+    if settings.STATELESS_AUTH_ENABLED:
+        claims.update({
+            "username": user.get('username'),
+            "avatar_url": user.get('avatar_url'),
+            "is_active": bool(user.get('is_active', True)),
+            "cv": user.get('claims_version', 0),
+        })
+    return claims
+
+
+def create_refresh_token(user: dict) -> str:
+    """
+    Creates a long-lived refresh token. It only identifies the user; `tv` must match the
+    user's token_version, which is bumped to revoke every refresh token of that user.
+    """
+    expire = datetime.now(timezone.utc) + timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES)
+    to_encode = {
+        "sub": user['anonymous_id'],
+        "anonymous_id": user['anonymous_id'],
+        "tv": user.get('token_version', 0),
+        "type": REFRESH_TOKEN_TYPE,
+        "jti": uuid.uuid4().hex,
+        "exp": expire,
+    }
+    return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+
+
+def create_token_response(user: dict) -> dict:
+    """
+    Issues an access/refresh token pair for a user document, shaped like schemas.Token.
+    """
+    expire_minutes = get_access_token_expire_minutes()
+    access_token = create_access_token(
+        data=build_access_token_claims(user),
+        expires_delta=timedelta(minutes=expire_minutes),
+    )
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "username": user['username'],
+        "anonymous_id": user['anonymous_id'],
+        "refresh_token": create_refresh_token(user),
+        "expires_in": expire_minutes * 60,
+    }
+
+
+def user_from_token_claims(payload: dict) -> Optional[dict]:
+    """
+    Builds a partial user dict from a stateless access token.
+    Returns None for tokens issued without profile claims (they need a Firestore lookup).
+    The result is marked with 'claims_only' so callers needing the full profile can reload it.
+    """
+    if "cv" not in payload or "is_active" not in payload:
+        return None
+    return {
+        "anonymous_id": payload["anonymous_id"],
+        "username": payload.get("username"),
+        "avatar_url": payload.get("avatar_url"),
+        "is_active": payload["is_active"],
+        "claims_version": payload["cv"],
+        "claims_only": True,
+    }
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -47,4 +134,70 @@ def decode_access_token(token_data: str) -> Optional[dict]: # Or Optional[TokenP
     except JWTError: # Catches expired signature, invalid signature, etc.
         return None
     except ValidationError: # If you use Pydantic model validation for payload
-        return None
\ No newline at end of file
+        return None
+
+
+class TokenDenyList:
+    """
+    In-memory revocation list checked on every authenticated request.
+
+    Only two compact maps are kept, and entries are dropped once no token they could
+    match can still be valid:
+    - revoked token ids (jti -> token expiry),
+    - per-user minimum claims version (anonymous_id -> (version, drop_after)), which rejects
+      stateless access tokens minted before a profile change, deactivation or deletion.
+
+    NOTE: Like the ConnectionManager, this is per-instance. Revocations made on another
+    Cloud Run instance are only bounded by the short access token lifetime; refresh tokens
+    are checked against the user's token_version in Firestore instead.
+    """
+
+    def __init__(self):
+        self._revoked_jtis: Dict[str, float] = {}
+        self._min_claims_versions: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        self._next_prune = 0.0
+
+    def _prune(self, now: float) -> None:
+        if now < self._next_prune:
+            return
+        self._revoked_jtis = {jti: exp for jti, exp in self._revoked_jtis.items() if exp > now}
+        self._min_claims_versions = {
+            user_id: entry for user_id, entry in self._min_claims_versions.items() if entry[1] > now
+        }
+        self._next_prune = now + 60
+
+    def revoke_token(self, jti: str, expires_at: float) -> None:
+        with self._lock:
+            self._revoked_jtis[jti] = expires_at
+            self._prune(time.time())
+
+    def set_min_claims_version(self, anonymous_id: str, version: float) -> None:
+        """
+        Rejects access tokens for this user whose claims version is below `version`.
+        Pass float('inf') to reject all of them (e.g. when the user is deleted).
+        """
+        drop_after = time.time() + get_access_token_expire_minutes() * 60
+        with self._lock:
+            current = self._min_claims_versions.get(anonymous_id)
+            if current is None or version >= current[0]:
+                self._min_claims_versions[anonymous_id] = (version, drop_after)
+            self._prune(time.time())
+
+    def is_revoked(self, payload: dict) -> bool:
+        jti = payload.get("jti")
+        if jti and jti in self._revoked_jtis:
+            return True
+        # Only stateless tokens carry a claims version; the others are re-validated
+        # against the user document anyway.
+        if "cv" in payload:
+            entry = self._min_claims_versions.get(payload.get("anonymous_id"))
+            if entry is not None and payload["cv"] < entry[0]:
+                return True
+        return False
+
+    def __len__(self) -> int:
+        return len(self._revoked_jtis) + len(self._min_claims_versions)
+
+
+token_denylist = TokenDenyList()
@@ -1,6 +1,8 @@
 import os
+from contextlib import asynccontextmanager
 import uvicorn
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Request
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import firebase_admin
@@ -17,7 +19,16 @@ from app.api.v1.endpoints import (
     reports as reports_router,
     chat as chat_router,
     avatars as avatars_router,
+    jobs as jobs_router,
+    topics as topics_router,
+    search as search_router,
+    metrics as metrics_router,
 )
+from app.core.background import run_in_background
+from app.core.chat_manager import manager as chat_connection_manager
+from app.core.exceptions import DeadlineExceededError
+from app.core.pagination import NEXT_CURSOR_HEADER
+from app.services.firestore_services import author_fanout_service, counter_service, deletion_service, post_service, search_service, related_service
 
 # --- Firebase Initialization ---
 print("Initializing Firebase Admin SDK...")
@@ -42,10 +53,34 @@ if not firebase_admin._apps:
 else:
     print("Firebase app already initialized.")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pick up background jobs interrupted by a previous instance shutting down.
+    run_in_background(author_fanout_service.resume_pending_jobs)
+    run_in_background(deletion_service.resume_pending_jobs)
+    # Fold sharded vote/comment counters back into their documents for list reads.
+    counter_service.start_counter_materializer()
+    # Serve the first home-feed requests from memory.
+    run_in_background(post_service.warm_feed_cache)
+    # Load (or build) the full-text search index and keep saving it.
+    run_in_background(search_service.load_search_index)
+    search_service.start_search_index_persister()
+    # Fill the related-posts index from the newest posts (RELATED_INDEX_WARM_POSTS).
+    run_in_background(related_service.build_related_index)
+    related_service.start_related_index_compactor()
+    # Relay chat messages between instances.
+    await chat_connection_manager.start()
+    yield
+    await chat_connection_manager.stop()
+    counter_service.stop_counter_materializer()
+    search_service.stop_search_index_persister()
+    related_service.stop_related_index_compactor()
+
 app = FastAPI(
     title=f"{settings.PROJECT_NAME} - Firestore Backend",
     description="API for Empathy Hub, running on a serverless Firestore backend.",
     version="0.2.0",
+    lifespan=lifespan,
 )
 
 if settings.BACKEND_CORS_ORIGINS:
@@ -55,8 +90,13 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER],
     )
 
+@app.exception_handler(DeadlineExceededError)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceededError):
+    return JSONResponse(status_code=504, content={"detail": "The request took too long. Please try again."})
+
 # --- Firestore Backend API Router ---
 api_router_firestore = APIRouter()
 api_router_firestore.include_router(auth_router.router, prefix="/auth", tags=["auth"])
@@ -68,6 +108,10 @@ api_router_firestore.include_router(user_actions_router.router, prefix="/user-ac
 api_router_firestore.include_router(reports_router.router, prefix="/reports", tags=["reports"])
 api_router_firestore.include_router(chat_router.router, prefix="/chat", tags=["chat"])
 api_router_firestore.include_router(avatars_router.router, prefix="/avatars", tags=["avatars"])
+api_router_firestore.include_router(jobs_router.router, prefix="/jobs", tags=["jobs"])
+api_router_firestore.include_router(topics_router.router, prefix="/topics", tags=["topics"])
+api_router_firestore.include_router(search_router.router, prefix="/search", tags=["search"])
+api_router_firestore.include_router(metrics_router.router, prefix="/metrics", tags=["metrics"])
 
 app.include_router(api_router_firestore, prefix=settings.API_V1_STR)
 
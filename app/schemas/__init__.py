@@ -1,4 +1,4 @@
-from .user import UserCreate, UserRead, UserUpdate, UserBase, AuthorRead # Added User, AuthorRead, UserLogin, UserWithToken
+from .user import UserCreate, UserRead, UserUpdate, UserBase, AuthorRead, UserBatchRequest # Added User, AuthorRead, UserLogin, UserWithToken
 from .enums import ChatAvailabilityEnum, VoteTypeEnum, ChatRequestStatusEnum, ChatRoomTypeEnum, RelationshipTypeEnum # Added VoteTypeEnum, ChatRequestStatusEnum, ChatRoomTypeEnum
 from .post import PostCreate, PostRead, PostUpdate, PostBase, PostVoteCreate
 from .comment import CommentCreate, CommentRead, CommentUpdate, CommentBase, CommentVoteCreate
@@ -34,6 +34,10 @@ from .report import (
     ReportUpdate
 )
 
+from .job import JobRead
+from .topic import TopicRead
+from .search import SearchResult
+
 from .generic import ( # Add this
     DeletionSummary,
     AllContentDeletionSummary
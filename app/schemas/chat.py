@@ -12,7 +12,7 @@ from datetime import datetime
 class UserSimple(BaseModel):
     anonymous_id: uuid.UUID
     username: str
-    # avatar_url: Optional[str] = None # If you have avatar URLs
+    avatar_url: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -24,6 +24,8 @@ class CommentRead(CommentBase):
     updated_at: Optional[datetime] = None
     upvotes: int
     downvotes: int
+    # How the requesting user voted on this comment (None if they haven't or aren't signed in)
+    my_vote: Optional[VoteTypeEnum] = None
     post_id: uuid.UUID
 
     model_config = ConfigDict(from_attributes=True)
@@ -19,6 +19,19 @@ class VoteTypeEnum(str, enum.Enum):
     UPVOTE = "upvote"
     DOWNVOTE = "downvote"
 
+class PostSortEnum(str, enum.Enum):
+    HOT = "hot"
+    TOP = "top"
+    NEW = "new"
+
+class TopicSortEnum(str, enum.Enum):
+    ACTIVE = "active" # Most recent activity first
+    POPULAR = "popular" # Most posts first
+
+class SearchTypeEnum(str, enum.Enum):
+    POST = "post"
+    COMMENT = "comment"
+
 class RelationshipTypeEnum(str, enum.Enum):
     MUTE = "mute"
     BLOCK = "block"
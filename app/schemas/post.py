@@ -1,10 +1,11 @@
-from pydantic import BaseModel, ConfigDict, Field, computed_field
+from pydantic import BaseModel, ConfigDict, Field, computed_field, field_validator
 from typing import Optional, List, TYPE_CHECKING
 from datetime import datetime
 import uuid
 from app.schemas.enums import VoteTypeEnum
 # from .comment import CommentRead # No longer directly embedding full CommentRead here
 from .user import AuthorRead
+from .topic import normalize_topics
 
 
 # Shared properties
@@ -14,15 +15,21 @@ class PostBase(BaseModel):
 
 # Properties to receive on post creation
 class PostCreate(PostBase):
+    content: str = Field(..., min_length=1, max_length=20000)
     # user_id will be set based on the authenticated user in the endpoint
-    pass
+    topics: List[str] = []
+
+    _normalize_topics = field_validator('topics')(normalize_topics)
 
 # Properties to receive on post update
 class PostUpdate(BaseModel):
     title: Optional[str] = None
-    content: Optional[str] = None
+    content: Optional[str] = Field(None, min_length=1, max_length=20000)
     # is_active could be updated by admins/moderators or specific user actions
     is_active: Optional[bool] = None
+    topics: Optional[List[str]] = None
+
+    _normalize_topics = field_validator('topics')(normalize_topics)
 
 class PostVoteCreate(BaseModel):
     vote_type: VoteTypeEnum
@@ -41,11 +48,14 @@ class PostRead(PostBase):
     # For now, let's include the author's anonymous_id
     # In a more advanced setup, we might embed a UserRead schema here.
     author: AuthorRead
+    topics: List[str] = []
     
     is_active: bool
     is_edited: bool
     upvotes: int
     downvotes: int
+    # How the requesting user voted on this post (None if they haven't or aren't signed in)
+    my_vote: Optional[VoteTypeEnum] = None
     created_at: datetime
     updated_at: Optional[datetime] = None
 
@@ -0,0 +1,18 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import List, Optional
+from .enums import SearchTypeEnum
+
+class SearchResult(BaseModel):
+    type: SearchTypeEnum
+    id: str # anonymous_post_id or anonymous_comment_id
+    post_id: str # The post itself, or the post a comment belongs to
+    title: Optional[str] = None # Posts only
+    snippet: str
+    author_username: Optional[str] = None
+    topics: List[str] = []
+    created_at: Optional[datetime] = None
+    score: float
+
+    class Config:
+        from_attributes = True
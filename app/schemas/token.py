@@ -6,4 +6,6 @@ class Token(BaseModel):
     access_token: str
     token_type: str
     username: Optional[str] = None
-    anonymous_id: Optional[uuid.UUID] = None # Changed from str to uuid.UUID
\ No newline at end of file
+    anonymous_id: Optional[uuid.UUID] = None # Changed from str to uuid.UUID
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None # Access token lifetime in seconds
@@ -0,0 +1,34 @@
+import re
+from pydantic import BaseModel
+from datetime import datetime
+from typing import List, Optional
+
+MAX_TOPICS_PER_POST = 3
+_TOPIC_SLUG_PATTERN = re.compile(r"^[a-z0-9][a-z0-9-]{0,31}$")
+
+def normalize_topics(topics: Optional[List[str]]) -> Optional[List[str]]:
+    """
+    Turns topic names into slugs ("Mental Health" -> "mental-health") and drops duplicates.
+    Slugs are the topic document IDs, so they are limited to lowercase letters, digits and dashes.
+    """
+    if topics is None:
+        return None
+    slugs = []
+    for topic in topics:
+        slug = re.sub(r"[\s_]+", "-", topic.strip().lower())
+        if not _TOPIC_SLUG_PATTERN.match(slug):
+            raise ValueError(f"Invalid topic '{topic}': use up to 32 letters, digits or dashes.")
+        if slug not in slugs:
+            slugs.append(slug)
+    if len(slugs) > MAX_TOPICS_PER_POST:
+        raise ValueError(f"A post can have at most {MAX_TOPICS_PER_POST} topics.")
+    return slugs
+
+class TopicRead(BaseModel):
+    slug: str
+    post_count: int = 0
+    last_activity_at: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, ConfigDict, Field, computed_field
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from .enums import ChatAvailabilityEnum
 import uuid
@@ -46,6 +46,10 @@ class UserRead(UserBase): # Inherits username and avatar_url from UserBase
     model_config = ConfigDict(from_attributes=True)
 
 
+class UserBatchRequest(BaseModel):
+    anonymous_ids: List[uuid.UUID] = Field(..., min_length=1, max_length=100)
+
+
 class AuthorRead(BaseModel):
     id: uuid.UUID = Field(validation_alias='anonymous_id') # This will be the user's anonymous_id, Pydantic handles UUID -> str serialization
     username: str
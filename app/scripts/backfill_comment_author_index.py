@@ -0,0 +1,76 @@
+import os
+import sys
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.scripts.cleanup_orphaned_posts import initialize_firebase
+
+JOB_TYPE = "comment_author_backfill"
+BATCH_SIZE = 300
+LEASE_SECONDS = 300
+
+def backfill_comment_author_index():
+    """
+    One-off backfill for the per-author comment index.
+    Walks every 'comments' subcollection once and fills in the fields the collection-group
+    path relies on for comments written before it existed: post_id (taken from the document
+    path) and the denormalized author_username/author_avatar_url.
+    Progress is stored as a job, so re-running the script resumes where it stopped.
+    """
+    from firebase_admin import firestore
+    from app.services.firestore_services import job_service, user_service
+
+    jobs = job_service.get_resumable_jobs(JOB_TYPE, limit=1)
+    job = jobs[0] if jobs else job_service.create_job(JOB_TYPE, {})
+    job = job_service.claim_job(job['job_id'], LEASE_SECONDS)
+    if job is None:
+        print("The backfill is already running elsewhere. Exiting.")
+        return
+
+    db = firestore.client()
+    cursor = job.get('cursor') or {"last_path": None}
+    progress = job.get('progress') or {"scanned": 0, "updated": 0}
+    print(f"Starting comment author index backfill (job {job['job_id']}, resuming after {cursor['last_path']})...")
+
+    while True:
+        query = db.collection_group('comments').order_by('__name__')
+        if cursor['last_path']:
+            query = query.start_after({'__name__': db.document(cursor['last_path'])})
+        docs = list(query.limit(BATCH_SIZE).stream())
+        if not docs:
+            break
+
+        comments = [(doc, doc.to_dict()) for doc in docs]
+        authors = user_service.get_users_by_anonymous_ids(
+            [data.get('author_id') for _, data in comments if 'author_username' not in data]
+        )
+
+        batch = db.batch()
+        writes = 0
+        for doc, data in comments:
+            update_data = {}
+            if not data.get('post_id'):
+                update_data['post_id'] = doc.reference.parent.parent.id
+            if 'author_username' not in data:
+                author = authors.get(data.get('author_id')) or {}
+                update_data['author_username'] = author.get('username', "Unknown")
+                update_data['author_avatar_url'] = author.get('avatar_url')
+            if update_data:
+                batch.update(doc.reference, update_data)
+                writes += 1
+        if writes:
+            batch.commit()
+
+        progress['scanned'] += len(docs)
+        progress['updated'] += writes
+        cursor = {"last_path": docs[-1].reference.path}
+        job_service.record_progress(job['job_id'], cursor, progress, LEASE_SECONDS)
+        print(f"Scanned {progress['scanned']} comments, updated {progress['updated']}...")
+
+    job_service.finish_job(job['job_id'], progress)
+    print(f"Backfill finished: {progress}")
+
+if __name__ == "__main__":
+    initialize_firebase()
+    backfill_comment_author_index()
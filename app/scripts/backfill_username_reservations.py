@@ -0,0 +1,132 @@
+import os
+import sys
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.scripts.cleanup_orphaned_posts import initialize_firebase
+
+JOB_TYPE = "username_reservation_backfill"
+BATCH_SIZE = 300
+LEASE_SECONDS = 300
+
+def _fill_username_normalized(docs) -> int:
+    """
+    Sets 'username_normalized' on the users of a page that lack it or have a stale one.
+    Returns the number of users updated.
+    """
+    from firebase_admin import firestore
+    from app.services.firestore_services import user_service
+
+    batch = firestore.client().batch()
+    normalized = 0
+    for doc in docs:
+        data = doc.to_dict()
+        username = data.get('username')
+        if username and data.get('username_normalized') != user_service.normalize_username(username):
+            batch.update(doc.reference, {'username_normalized': user_service.normalize_username(username)})
+            normalized += 1
+    if normalized:
+        batch.commit()
+    return normalized
+
+def _reserve_usernames(docs, progress: dict) -> int:
+    """
+    Reserves the usernames of a page of users that aren't reserved yet, counting conflicts
+    in `progress`. Returns the number of reservations created.
+    """
+    from firebase_admin import firestore
+    from google.api_core.exceptions import Conflict
+    from app.services.firestore_services import user_service
+
+    db = firestore.client()
+    usernames_collection = user_service.get_usernames_collection()
+    # reservation key -> [(anonymous_id, username)], the first user of a key wins
+    wanted = {}
+    for doc in docs:
+        username = doc.to_dict().get('username')
+        if username:
+            wanted.setdefault(user_service.username_key(username), []).append((doc.id, username))
+    reserved = {
+        doc.id: doc.get('anonymous_id')
+        for doc in db.get_all([usernames_collection.document(key) for key in wanted])
+        if doc.exists
+    }
+
+    to_create = {}
+    for key, users in wanted.items():
+        owner = reserved.get(key)
+        for anonymous_id, username in users:
+            if owner is None:
+                owner = anonymous_id
+                to_create[key] = user_service.username_reservation_data(anonymous_id, username)
+            elif owner != anonymous_id:
+                progress['conflicts'] += 1
+                print(f"Conflict: '{username}' (user {anonymous_id}) is taken by user {owner}.")
+    if not to_create:
+        return 0
+
+    batch = db.batch()
+    for key, data in to_create.items():
+        batch.create(usernames_collection.document(key), data)
+    try:
+        batch.commit()
+    except Conflict:
+        # A signup reserved one of the names meanwhile; reserve the rest one by one.
+        for key, data in list(to_create.items()):
+            try:
+                usernames_collection.document(key).create(data)
+            except Conflict:
+                del to_create[key]
+                progress['conflicts'] += 1
+                print(f"Conflict: '{data['username']}' (user {data['anonymous_id']}) was reserved meanwhile.")
+    return len(to_create)
+
+def backfill_username_reservations():
+    """
+    One-off backfill of the username reservation index (usernames/{username_key}) and of
+    the users' 'username_normalized' field used by prefix search.
+    Reserves the username of every user created before the index existed. Run it before
+    relying on the index for uniqueness: until then, signups can take the names of users
+    that aren't reserved yet.
+    Usernames that now share a key with another user's reserved name (e.g. 'Sam' and 'sam')
+    are reported and left unreserved; those users keep their name until they change it.
+    Progress is stored as a job, so re-running the script resumes where it stopped.
+    """
+    from app.services.firestore_services import job_service, user_service
+
+    jobs = job_service.get_resumable_jobs(JOB_TYPE, limit=1)
+    job = jobs[0] if jobs else job_service.create_job(JOB_TYPE, {})
+    job = job_service.claim_job(job['job_id'], LEASE_SECONDS)
+    if job is None:
+        print("The backfill is already running elsewhere. Exiting.")
+        return
+
+    cursor = job.get('cursor') or {"last_id": None}
+    progress = job.get('progress') or {"scanned": 0, "reserved": 0, "normalized": 0, "conflicts": 0}
+    print(f"Starting username reservation backfill (job {job['job_id']}, resuming after {cursor['last_id']})...")
+
+    while True:
+        query = user_service.get_users_collection().order_by('__name__').select(['username', 'username_normalized'])
+        if cursor['last_id']:
+            query = query.start_after({'__name__': user_service.get_users_collection().document(cursor['last_id'])})
+        docs = list(query.limit(BATCH_SIZE).stream())
+        if not docs:
+            break
+
+        normalized = _fill_username_normalized(docs)
+        reserved = _reserve_usernames(docs, progress)
+
+        progress['scanned'] += len(docs)
+        progress['reserved'] += reserved
+        progress['normalized'] = progress.get('normalized', 0) + normalized
+        cursor = {"last_id": docs[-1].id}
+        job_service.record_progress(job['job_id'], cursor, progress, LEASE_SECONDS)
+        print(f"Scanned {progress['scanned']} users, reserved {progress['reserved']} usernames...")
+
+    job_service.finish_job(job['job_id'], progress)
+    print(f"Backfill finished: {progress}")
+
+if __name__ == "__main__":
+    initialize_firebase()
+    backfill_username_reservations()
@@ -0,0 +1,63 @@
+import os
+import sys
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.scripts.cleanup_orphaned_posts import initialize_firebase
+
+JOB_TYPE = "vote_voter_id_backfill"
+BATCH_SIZE = 400
+LEASE_SECONDS = 300
+
+def backfill_vote_voter_ids():
+    """
+    One-off backfill for account deletion's votes phase.
+    Walks every 'votes' subcollection once and sets voter_id (the vote document's ID) on
+    votes written before vote documents carried it.
+    Progress is stored as a job, so re-running the script resumes where it stopped.
+    """
+    from firebase_admin import firestore
+    from app.services.firestore_services import job_service
+
+    jobs = job_service.get_resumable_jobs(JOB_TYPE, limit=1)
+    job = jobs[0] if jobs else job_service.create_job(JOB_TYPE, {})
+    job = job_service.claim_job(job['job_id'], LEASE_SECONDS)
+    if job is None:
+        print("The backfill is already running elsewhere. Exiting.")
+        return
+
+    db = firestore.client()
+    cursor = job.get('cursor') or {"last_path": None}
+    progress = job.get('progress') or {"scanned": 0, "updated": 0}
+    print(f"Starting vote voter_id backfill (job {job['job_id']}, resuming after {cursor['last_path']})...")
+
+    while True:
+        query = db.collection_group('votes').order_by('__name__')
+        if cursor['last_path']:
+            query = query.start_after({'__name__': db.document(cursor['last_path'])})
+        docs = list(query.limit(BATCH_SIZE).stream())
+        if not docs:
+            break
+
+        batch = db.batch()
+        writes = 0
+        for doc in docs:
+            if doc.to_dict().get('voter_id') != doc.id:
+                batch.update(doc.reference, {'voter_id': doc.id})
+                writes += 1
+        if writes:
+            batch.commit()
+
+        progress['scanned'] += len(docs)
+        progress['updated'] += writes
+        cursor = {"last_path": docs[-1].reference.path}
+        job_service.record_progress(job['job_id'], cursor, progress, LEASE_SECONDS)
+        print(f"Scanned {progress['scanned']} votes, updated {progress['updated']}...")
+
+    job_service.finish_job(job['job_id'], progress)
+    print(f"Backfill finished: {progress}")
+
+if __name__ == "__main__":
+    initialize_firebase()
+    backfill_vote_voter_ids()
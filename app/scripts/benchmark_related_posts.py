@@ -0,0 +1,55 @@
+import itertools
+import os
+import random
+import sys
+import time
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import numpy as np
+from app.core.related_index import RelatedIndex
+
+VOCABULARY_SIZE = 30000
+POST_WORDS = 80
+QUERIES = 200
+
+def benchmark_related_posts(sizes=(1000, 10000, 50000, 100000), seed: int = 11):
+    """
+    Measures related-posts query latency against corpus size on synthetic posts with a
+    Zipf-like word distribution: after compaction (everything in the base matrix), and
+    with 1000 uncompacted additions on top.
+    """
+    rng = random.Random(seed)
+    vocabulary = [f"w{i}" for i in range(VOCABULARY_SIZE)]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(VOCABULARY_SIZE)))
+
+    print(f"{'posts':>8} {'build s':>8} {'compact s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p50 +delta':>11}")
+    for size in sizes:
+        index = RelatedIndex(max_rows=size + 1000)
+        start = time.perf_counter()
+        for i in range(size):
+            index.add(f"p{i}", rng.choices(vocabulary, cum_weights=cum_weights, k=POST_WORDS))
+        build_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        index.compact()
+        compact_seconds = time.perf_counter() - start
+
+        def latencies():
+            timings = []
+            for _ in range(QUERIES):
+                key = f"p{rng.randrange(size)}"
+                vector = index.vector_for(key)
+                start = time.perf_counter()
+                index.query(vector, k=10, exclude=[key])
+                timings.append((time.perf_counter() - start) * 1000)
+            return np.percentile(timings, [50, 95])
+
+        p50, p95 = latencies()
+        for i in range(1000):
+            index.add(f"d{i}", rng.choices(vocabulary, cum_weights=cum_weights, k=POST_WORDS))
+        delta_p50, _ = latencies()
+        print(f"{size:>8} {build_seconds:>8.2f} {compact_seconds:>9.2f} {p50:>8.2f} {p95:>8.2f} {delta_p50:>11.2f}")
+
+if __name__ == "__main__":
+    benchmark_related_posts(tuple(int(arg) for arg in sys.argv[1:]) or (1000, 10000, 50000, 100000))
@@ -32,7 +32,7 @@ async def cleanup_orphaned_posts():
     from app.services.firestore_services import post_service, user_service
 
     print("Starting cleanup of orphaned posts...")
-    all_posts = post_service.get_posts(limit=1000) # Adjust limit as needed
+    all_posts, _ = post_service.get_posts(limit=1000) # Adjust limit as needed
     orphaned_posts_count = 0
     for post in all_posts:
         author_id = post.get('author', {}).get('anonymous_id')
@@ -0,0 +1,54 @@
+import os
+import sys
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.scripts.cleanup_orphaned_posts import initialize_firebase
+
+BATCH_SIZE = 200
+
+def _migrate(query, fields, label):
+    """
+    Moves the totals of every unsharded document returned by `query` into shard 0.
+    Each document is migrated in its own transaction, so a vote landing mid-migration
+    is never lost. Already-sharded documents are skipped, which makes re-runs safe.
+    """
+    from app.services.firestore_services import counter_service
+
+    scanned = migrated = 0
+    last_doc = None
+    while True:
+        page = query.order_by('__name__')
+        if last_doc is not None:
+            page = page.start_after(last_doc)
+        docs = list(page.limit(BATCH_SIZE).stream())
+        if not docs:
+            break
+        for doc in docs:
+            scanned += 1
+            if (doc.to_dict() or {}).get(counter_service.SHARDED_FLAG):
+                continue
+            if counter_service.ensure_sharded(doc.reference, fields):
+                migrated += 1
+        last_doc = docs[-1]
+        print(f"{label}: scanned {scanned}, migrated {migrated}...")
+    return migrated
+
+def migrate_sharded_counters():
+    """
+    One-off migration of post and comment counters to sharded counters.
+    Unmigrated documents keep working (they are migrated on their next increment), so this
+    only saves that first increment the extra work and lets the materializer own every total.
+    """
+    from firebase_admin import firestore
+    from app.services.firestore_services import counter_service
+
+    db = firestore.client()
+    posts = _migrate(db.collection('posts'), counter_service.POST_COUNTER_FIELDS, "Posts")
+    comments = _migrate(db.collection_group('comments'), counter_service.COMMENT_COUNTER_FIELDS, "Comments")
+    print(f"Migration finished: {posts} posts and {comments} comments moved to sharded counters.")
+
+if __name__ == "__main__":
+    initialize_firebase()
+    migrate_sharded_counters()
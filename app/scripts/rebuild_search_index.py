@@ -0,0 +1,21 @@
+import os
+import sys
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.scripts.cleanup_orphaned_posts import initialize_firebase
+
+def rebuild_search_index(path=None):
+    """
+    Rebuilds the full-text search index from every post and comment and writes it to
+    `path` (SEARCH_INDEX_PATH by default). Instances load the file when they start; run
+    this after deploying to a fresh volume, or periodically to pick up writes that other
+    instances made.
+    """
+    from app.services.firestore_services import search_service
+    search_service.rebuild_search_index(path)
+
+if __name__ == "__main__":
+    initialize_firebase()
+    rebuild_search_index(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,56 @@
+import os
+import sys
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.scripts.cleanup_orphaned_posts import initialize_firebase
+
+BATCH_SIZE = 300
+
+def recompute_post_scores():
+    """
+    Batch recompute of the hot/top ranking scores stored on every post.
+    Scores are normally kept current by the counter materializer; run this periodically
+    (e.g. from Cloud Scheduler) to backfill posts created before ranking existed, to fix
+    up drift, and after changing the ranking settings.
+    Sharded posts are scored from exact shard totals, which are written back as well.
+    """
+    from firebase_admin import firestore
+    from app.core import ranking
+    from app.services.firestore_services import counter_service
+
+    db = firestore.client()
+    scanned = updated = 0
+    last_doc = None
+    while True:
+        query = db.collection('posts').order_by('__name__')
+        if last_doc is not None:
+            query = query.start_after(last_doc)
+        docs = list(query.limit(BATCH_SIZE).stream())
+        if not docs:
+            break
+
+        batch = db.batch()
+        writes = 0
+        for doc in docs:
+            data = doc.to_dict()
+            totals = counter_service.aggregate(doc.reference, data, counter_service.POST_COUNTER_FIELDS)
+            update_data = {**totals, **ranking.post_scores(totals['upvotes'], totals['downvotes'], data.get('created_at'))}
+            if all(data.get(field) == value for field, value in update_data.items()):
+                continue
+            batch.update(doc.reference, update_data)
+            writes += 1
+        if writes:
+            batch.commit()
+
+        scanned += len(docs)
+        updated += writes
+        last_doc = docs[-1]
+        print(f"Scanned {scanned} posts, updated {updated}...")
+
+    print(f"Recompute finished: {updated} of {scanned} posts updated.")
+
+if __name__ == "__main__":
+    initialize_firebase()
+    recompute_post_scores()
@@ -0,0 +1,31 @@
+import os
+import sys
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.scripts.cleanup_orphaned_posts import initialize_firebase
+
+def run_author_fanout(author_id: str = None):
+    """
+    Resumes unfinished author fan-out jobs, or runs a new one for `author_id`, in the foreground.
+    """
+    from app.services.firestore_services import author_fanout_service, job_service
+
+    if author_id:
+        job = job_service.create_job(author_fanout_service.JOB_TYPE, {"author_id": author_id})
+        job_ids = [job['job_id']]
+    else:
+        job_ids = [job['job_id'] for job in job_service.get_resumable_jobs(author_fanout_service.JOB_TYPE)]
+
+    print(f"Running {len(job_ids)} author fan-out job(s)...")
+    for job_id in job_ids:
+        progress = author_fanout_service.run_author_fanout(job_id)
+        if progress is None:
+            print(f"Job {job_id} is finished or leased by another worker. Skipping.")
+        else:
+            print(f"Job {job_id} finished: {progress}")
+
+if __name__ == "__main__":
+    initialize_firebase()
+    run_author_fanout(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,55 @@
+from typing import List, Optional
+from firebase_admin import firestore_async
+from app.core import pagination
+from app.core.pagination import Page
+from app.schemas.chat import ChatMessageCreate
+from app.services.firestore_services.chat_service import build_message_writes, build_messages_query
+from app.services.firestore_async_services import user_service
+
+# Async counterpart of firestore_services/chat_service.py built on Firestore's AsyncClient.
+# The websocket handler and the message history endpoint run on the event loop and use
+# this module; document shapes come from the shared builders in the sync service.
+
+def get_chat_rooms_collection():
+    """Returns the async 'chat_rooms' collection reference, ensuring the client is requested after initialization."""
+    return firestore_async.client().collection('chat_rooms')
+
+async def get_chat_room(room_id: str) -> Optional[dict]:
+    """
+    Retrieves a chat room document by its ID.
+    """
+    doc = await get_chat_rooms_collection().document(room_id).get()
+    if doc.exists:
+        return doc.to_dict()
+    return None
+
+async def add_message_to_chat_room(room_id: str, message_in: ChatMessageCreate, sender_id: str) -> dict:
+    """
+    Adds a new message to a chat room's 'messages' subcollection and updates the room's 'last_message'.
+    """
+    room_ref = get_chat_rooms_collection().document(room_id)
+
+    sender_data = await user_service.get_user_by_anonymous_id(sender_id)
+    if not sender_data:
+        raise ValueError("Sender not found")
+
+    message_data, room_update = build_message_writes(room_id, message_in, sender_id, sender_data)
+    message_ref = room_ref.collection('messages').document(message_data['message_id'])
+
+    # Use a batch write to add the message and update the room atomically
+    batch = firestore_async.client().batch()
+    batch.set(message_ref, message_data)
+    batch.update(room_ref, room_update)
+    write_results = await batch.commit()
+
+    # The server timestamp resolves to the commit time; use it instead of the sentinel.
+    message_data['timestamp'] = write_results[0].update_time
+    return message_data
+
+async def get_messages_for_chat_room(room_id: str, limit: int = 50, cursor: Optional[str] = None) -> Page:
+    """
+    Retrieves a page of messages for a specific chat room, newest first, and the cursor for older messages.
+    """
+    query = build_messages_query(get_chat_rooms_collection().document(room_id), limit, cursor)
+    docs = [doc async for doc in query.stream()]
+    return [doc.to_dict() for doc in docs], pagination.next_cursor(docs, limit, ['timestamp'])
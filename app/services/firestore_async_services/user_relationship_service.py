@@ -0,0 +1,40 @@
+from firebase_admin import firestore_async
+from app.core.config import settings
+from app.services.firestore_services.user_relationship_service import (
+    RelationshipSets,
+    build_relationship_sets,
+    cache_relationship_sets,
+    relationship_cache,
+    relationship_cache_generation,
+    relationships_query,
+)
+
+# Async counterpart of the block/mute lookups in firestore_services/user_relationship_service.py,
+# for the event loop (websockets). It shares the per-instance relationship cache with the
+# sync service, so invalidation done by sync writes is seen here too.
+
+def get_relationships_collection():
+    """Returns the async 'user_relationships' collection reference, ensuring the client is requested after initialization."""
+    return firestore_async.client().collection('user_relationships')
+
+async def get_relationship_sets(user_id: str) -> RelationshipSets:
+    """
+    Returns whom the user blocked and muted and who blocked and muted them.
+    A cache hit costs no reads; a miss costs one query.
+    """
+    if settings.RELATIONSHIP_CACHE_ENABLED:
+        cached = relationship_cache.get(user_id)
+        if cached is not None:
+            return cached
+    generation = relationship_cache_generation()
+    query = relationships_query(get_relationships_collection(), user_id)
+    sets = build_relationship_sets(user_id, [doc.to_dict() async for doc in query.stream()])
+    cache_relationship_sets(user_id, sets, generation)
+    return sets
+
+async def is_blocked(user_id: str, other_user_id: str) -> bool:
+    """
+    Whether either user blocked the other.
+    """
+    sets = await get_relationship_sets(user_id)
+    return other_user_id in sets.blocking or other_user_id in sets.blocked_by
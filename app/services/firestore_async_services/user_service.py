@@ -0,0 +1,32 @@
+from typing import Optional
+from firebase_admin import firestore_async
+from app.core.config import settings
+from app.services.firestore_services.user_service import user_cache
+
+# Async counterpart of firestore_services/user_service.py built on Firestore's AsyncClient.
+# Used from the event loop (auth dependencies, websockets) so lookups never block it.
+# It shares the per-instance user cache with the sync service, so invalidation done by
+# sync writes is seen here too.
+
+def get_users_collection():
+    """Returns the async 'users' collection reference, ensuring the client is requested after initialization."""
+    return firestore_async.client().collection('users')
+
+async def get_user_by_anonymous_id(anonymous_id: str) -> Optional[dict]:
+    """
+    Retrieves a user document by its anonymous_id (which is the document ID).
+    Served from the per-instance user cache when USER_CACHE_ENABLED is set.
+    """
+    if settings.USER_CACHE_ENABLED:
+        cached_user = user_cache.get(anonymous_id)
+        if cached_user is not None:
+            return dict(cached_user)
+
+    doc = await get_users_collection().document(anonymous_id).get()
+    if doc.exists:
+        user = doc.to_dict()
+        if settings.USER_CACHE_ENABLED:
+            user_cache.set(anonymous_id, user)
+            return dict(user)
+        return user
+    return None
@@ -0,0 +1,119 @@
+import time
+from typing import Optional
+from firebase_admin import firestore
+from app.core.background import run_in_background, run_later
+from app.core.config import settings
+from app.services.firestore_services import job_service
+
+# Posts and comments store the author's username and avatar at write time so feeds are
+# single-collection reads. When a user changes either, this job rewrites the copies.
+# It runs in the background with batched, rate-limited writes and records a cursor after
+# every batch, so an interrupted job resumes where it stopped, and a failed run is retried
+# with backoff (job_service.record_failed_attempt). Rewrites are idempotent, so replaying a
+# batch is harmless.
+
+JOB_TYPE = "author_fanout"
+LEASE_SECONDS = 120
+
+# Each phase pages through the author's documents ordered by document path.
+PHASES = ("posts", "comments")
+
+def _phase_query(phase: str, author_id: str):
+    db = firestore.client()
+    if phase == "posts":
+        query = db.collection('posts').where('author_id', '==', author_id)
+    else:
+        # Needs the collection-group index on comments.author_id (firestore.indexes.json).
+        query = db.collection_group('comments').where('author_id', '==', author_id)
+    return query.order_by('__name__')
+
+def schedule_author_fanout(author_id: str) -> dict:
+    """
+    Creates a fan-out job for an author and starts it in the background.
+    """
+    job = job_service.create_job(JOB_TYPE, {"author_id": author_id})
+    run_in_background(run_author_fanout, job['job_id'])
+    return job
+
+def run_author_fanout(job_id: str) -> Optional[dict]:
+    """
+    Runs (or resumes) a fan-out job. Returns the final progress, or None if the job
+    is finished or currently owned by another worker.
+    """
+    job = job_service.claim_job(job_id, LEASE_SECONDS)
+    if job is None:
+        return None
+
+    author_id = job['params']['author_id']
+    cursor = job.get('cursor') or {"phase": PHASES[0], "last_path": None}
+    progress = job.get('progress') or {"posts_updated": 0, "comments_updated": 0}
+    batch_size = settings.AUTHOR_FANOUT_BATCH_SIZE
+    db = firestore.client()
+
+    try:
+        for phase in PHASES[PHASES.index(cursor['phase']):]:
+            last_path = cursor['last_path'] if cursor['phase'] == phase else None
+            while True:
+                started = time.monotonic()
+                # Re-read the author every batch so a newer profile change always wins. Read
+                # the document itself: user_cache may still hold the profile from before it.
+                author_doc = db.collection('users').document(author_id).get(field_paths=['username', 'avatar_url'])
+                if not author_doc.exists:
+                    # The account was deleted; its content is removed by the delete flow.
+                    job_service.finish_job(job_id, progress)
+                    return progress
+                author = author_doc.to_dict()
+                denormalized = {
+                    "author_username": author.get('username'),
+                    "author_avatar_url": author.get('avatar_url'),
+                }
+
+                query = _phase_query(phase, author_id)
+                if last_path:
+                    query = query.start_after({'__name__': db.document(last_path)})
+                docs = list(query.limit(batch_size).stream())
+                if not docs:
+                    break
+
+                batch = db.batch()
+                writes = 0
+                for doc in docs:
+                    data = doc.to_dict()
+                    if all(data.get(field) == value for field, value in denormalized.items()):
+                        continue
+                    batch.update(doc.reference, denormalized)
+                    writes += 1
+                if writes:
+                    batch.commit()
+
+                progress[f"{phase}_updated"] += writes
+                last_path = docs[-1].reference.path
+                cursor = {"phase": phase, "last_path": last_path}
+                job_service.record_progress(job_id, cursor, progress, LEASE_SECONDS)
+
+                # Rate limit: spread writes so the fan-out never dominates write capacity.
+                min_seconds = writes / settings.AUTHOR_FANOUT_MAX_WRITES_PER_SECOND
+                elapsed = time.monotonic() - started
+                if elapsed < min_seconds:
+                    time.sleep(min_seconds - elapsed)
+                if len(docs) < batch_size:
+                    break
+    except Exception as e:
+        retry_in = job_service.record_failed_attempt(job, progress, str(e))
+        if retry_in is not None:
+            run_later(retry_in, run_author_fanout, job_id)
+        raise
+
+    job_service.finish_job(job_id, progress)
+    return progress
+
+def resume_pending_jobs() -> int:
+    """
+    Restarts unfinished fan-out jobs in the background (e.g. after an instance restart).
+    Each is started once its lease or retry backoff runs out; jobs whose lease another
+    worker keeps renewing are skipped when claimed.
+    """
+    jobs = job_service.get_resumable_jobs(JOB_TYPE)
+    for job in jobs:
+        run_later(job_service.seconds_until_claimable(job), run_author_fanout, job['job_id'])
+    return len(jobs)
@@ -1,8 +1,11 @@
 import uuid
 from typing import List, Optional
 from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+from app.core.firestore_writes import merge_update, resolve_server_timestamps
 from app.schemas.chat_request import ChatRequestCreate
 from app.schemas.enums import ChatRequestStatusEnum
+from app.services.firestore_services import user_service
 
 # This service replaces the functionality of crud/crud_chat_request.py for a Firestore database.
 
@@ -33,8 +36,31 @@ def create_chat_request(request_in: ChatRequestCreate, requester_id: str) -> dic
         "created_at": firestore.SERVER_TIMESTAMP,
         "responded_at": None,
     }
-    chat_requests_collection.document(request_id).set(request_data)
-    return request_data
+    write_result = chat_requests_collection.document(request_id).set(request_data)
+    return resolve_server_timestamps(request_data, write_result.update_time)
+
+def format_chat_requests(requests: List[dict]) -> List[dict]:
+    """
+    Formats chat requests for ChatRequestRead. The requesters and requestees of all
+    requests are loaded with one batched read.
+    """
+    users = user_service.get_users_by_anonymous_ids(
+        [user_id for request in requests for user_id in (request['requester_id'], request['requestee_id'])]
+    )
+    return [
+        {
+            "anonymous_request_id": request['request_id'],
+            "requester_anonymous_id": request['requester_id'],
+            "requestee_anonymous_id": request['requestee_id'],
+            "initial_message": request.get('initial_message'),
+            "status": request['status'],
+            "created_at": request['created_at'],
+            "responded_at": request.get('responded_at'),
+            "requester": user_service.format_user_simple(request['requester_id'], users.get(request['requester_id'])),
+            "requestee": user_service.format_user_simple(request['requestee_id'], users.get(request['requestee_id'])),
+        }
+        for request in requests
+    ]
 
 def get_chat_request(request_id: str) -> Optional[dict]:
     """
@@ -58,19 +84,22 @@ def get_pending_requests_for_user(user_id: str, limit: int = 20) -> List[dict]:
     docs = query.limit(limit).stream()
     return [doc.to_dict() for doc in docs]
 
-def update_request_status(request_id: str, status: ChatRequestStatusEnum) -> Optional[dict]:
+def update_request_status(request_id: str, status: ChatRequestStatusEnum, current_request: Optional[dict] = None) -> Optional[dict]:
     """
     Updates the status of a chat request.
+    Pass the request the caller already read as `current_request` to skip the read-back.
     """
     chat_requests_collection = get_chat_requests_collection()
     doc_ref = chat_requests_collection.document(request_id)
-    doc = doc_ref.get()
-    if not doc.exists:
-        return None
 
     update_data = {
         "status": status.value,
         "responded_at": firestore.SERVER_TIMESTAMP,
     }
-    doc_ref.update(update_data)
-    return doc_ref.get().to_dict()
+    try:
+        write_result = doc_ref.update(update_data) # Fails if the request doesn't exist
+    except NotFound:
+        return None
+    if current_request is None:
+        return get_chat_request(request_id)
+    return merge_update(current_request, update_data, write_result.update_time)
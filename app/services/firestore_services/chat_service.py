@@ -1,8 +1,11 @@
 import uuid
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from firebase_admin import firestore
 from app.schemas.chat import ChatRoomCreate, ChatMessageCreate
-from app.services.firestore_services import user_service
+from app.core import pagination
+from app.core.firestore_writes import resolve_server_timestamps
+from app.core.pagination import Page
+from app.services.firestore_services import user_service, moderation_service
 
 # This service replaces the functionality of crud/crud_chat.py for a Firestore database.
 
@@ -17,7 +20,8 @@ def create_chat_room(room_in: ChatRoomCreate, initiator_id: str) -> dict:
     chat_rooms_collection = get_chat_rooms_collection()
     room_id = str(uuid.uuid4())
     
-    all_participant_ids = list(set([initiator_id] + [str(p_id) for p_id in room_in.participant_anonymous_ids]))
+    # Sorted, so a direct chat's participant list is the same whoever started it.
+    all_participant_ids = sorted(set([initiator_id] + [str(p_id) for p_id in room_in.participant_anonymous_ids]))
 
     if not room_in.is_group and len(all_participant_ids) != 2:
         raise ValueError("Direct chats must have exactly two participants.")
@@ -37,8 +41,8 @@ def create_chat_room(room_in: ChatRoomCreate, initiator_id: str) -> dict:
         "created_at": firestore.SERVER_TIMESTAMP,
         "updated_at": firestore.SERVER_TIMESTAMP,
     }
-    chat_rooms_collection.document(room_id).set(room_data)
-    return room_data
+    write_result = chat_rooms_collection.document(room_id).set(room_data)
+    return resolve_server_timestamps(room_data, write_result.update_time)
 
 def get_chat_room(room_id: str) -> Optional[dict]:
     """
@@ -75,51 +79,119 @@ def get_chat_rooms_for_user(user_id: str, limit: int = 20) -> List[dict]:
     docs = query.limit(limit).stream()
     return [doc.to_dict() for doc in docs]
 
-def add_message_to_chat_room(room_id: str, message_in: ChatMessageCreate, sender_id: str) -> dict:
+def build_message_writes(room_id: str, message_in: ChatMessageCreate, sender_id: str, sender_data: dict) -> Tuple[dict, dict]:
     """
-    Adds a new message to a chat room's 'messages' subcollection and updates the room's 'last_message'.
+    Builds the message document and the room update for a new chat message.
+    Shared with the async chat service so both write identical documents.
+    The content goes through the moderation phrase filter first.
     """
-    chat_rooms_collection = get_chat_rooms_collection()
-    room_ref = chat_rooms_collection.document(room_id)
-    message_id = str(uuid.uuid4())
-    message_ref = room_ref.collection('messages').document(message_id)
-
-    sender_data = user_service.get_user_by_anonymous_id(sender_id)
-    if not sender_data:
-        raise ValueError("Sender not found")
-
+    content, moderation_flags = moderation_service.filter_text(message_in.content)
     message_data = {
-        "message_id": message_id,
+        "message_id": str(uuid.uuid4()),
         "room_id": room_id,
-        "content": message_in.content,
+        "content": content,
         "sender_id": sender_id,
         "sender_username": sender_data.get('username'),
         "timestamp": firestore.SERVER_TIMESTAMP,
     }
+    if moderation_flags:
+        message_data['moderation_flags'] = moderation_flags
 
     last_message_summary = {
-        "content": message_in.content,
+        "message_id": message_data['message_id'],
+        "content": content,
         "sender_id": sender_id,
+        "sender_username": message_data['sender_username'],
         "timestamp": firestore.SERVER_TIMESTAMP,
     }
+    room_update = {
+        'last_message': last_message_summary,
+        'updated_at': firestore.SERVER_TIMESTAMP
+    }
+    return message_data, room_update
+
+def format_message(message: dict) -> dict:
+    """
+    Formats a message document (or a room's last_message summary) for ChatMessageRead.
+    The sender comes from the username stored on the message, without a read.
+    """
+    return {
+        "anonymous_message_id": message['message_id'],
+        "chatroom_anonymous_id": message['room_id'],
+        "sender_anonymous_id": message['sender_id'],
+        "content": message['content'],
+        "timestamp": message['timestamp'],
+        "sender": {"anonymous_id": message['sender_id'], "username": message.get('sender_username') or "Unknown"},
+    }
+
+def format_chat_rooms(rooms: List[dict]) -> List[dict]:
+    """
+    Formats chat rooms for ChatRoomRead. The participants of all rooms are loaded with
+    one batched read.
+    """
+    users = user_service.get_users_by_anonymous_ids(
+        [participant_id for room in rooms for participant_id in room.get('participants', [])]
+    )
+    formatted_rooms = []
+    for room in rooms:
+        last_message = room.get('last_message')
+        if last_message and last_message.get('message_id'):
+            # Summaries written before they carried the message ID can't be shown.
+            last_message = format_message({**last_message, 'room_id': room['room_id']})
+        else:
+            last_message = None
+        formatted_rooms.append({
+            "anonymous_room_id": room['room_id'],
+            "name": room.get('name'),
+            "is_group": room.get('is_group', False),
+            "created_at": room.get('created_at'),
+            "updated_at": room.get('updated_at'),
+            "participants": [
+                user_service.format_user_simple(participant_id, users.get(participant_id))
+                for participant_id in room.get('participants', [])
+            ],
+            "last_message": last_message,
+        })
+    return formatted_rooms
+
+def build_messages_query(room_ref, limit: int, cursor: Optional[str] = None):
+    """
+    Builds the newest-first message history query for a (sync or async) chat room reference,
+    starting after `cursor` when given.
+    """
+    query = room_ref.collection('messages').order_by('timestamp', direction='DESCENDING') \
+                                           .order_by('__name__', direction='DESCENDING')
+    return pagination.apply_cursor(query, cursor).limit(limit)
+
+def add_message_to_chat_room(room_id: str, message_in: ChatMessageCreate, sender_id: str) -> dict:
+    """
+    Adds a new message to a chat room's 'messages' subcollection and updates the room's 'last_message'.
+    """
+    chat_rooms_collection = get_chat_rooms_collection()
+    room_ref = chat_rooms_collection.document(room_id)
+
+    sender_data = user_service.get_user_by_anonymous_id(sender_id)
+    if not sender_data:
+        raise ValueError("Sender not found")
+
+    message_data, room_update = build_message_writes(room_id, message_in, sender_id, sender_data)
+    message_ref = room_ref.collection('messages').document(message_data['message_id'])
 
     # Use a batch write to add the message and update the room atomically
     db = firestore.client()
     batch = db.batch()
     batch.set(message_ref, message_data)
-    batch.update(room_ref, {
-        'last_message': last_message_summary,
-        'updated_at': firestore.SERVER_TIMESTAMP
-    })
-    batch.commit()
+    batch.update(room_ref, room_update)
+    write_results = batch.commit()
 
+    # The server timestamp resolves to the commit time; use it instead of the sentinel.
+    message_data['timestamp'] = write_results[0].update_time
     return message_data
 
-def get_messages_for_chat_room(room_id: str, limit: int = 50) -> List[dict]:
+def get_messages_for_chat_room(room_id: str, limit: int = 50, cursor: Optional[str] = None) -> Page:
     """
-    Retrieves a list of messages for a specific chat room.
+    Retrieves a page of messages for a specific chat room, newest first, and the cursor for older messages.
     """
     chat_rooms_collection = get_chat_rooms_collection()
-    messages_query = chat_rooms_collection.document(room_id).collection('messages').order_by('timestamp', direction='DESCENDING')
-    docs = messages_query.limit(limit).stream()
-    return [doc.to_dict() for doc in docs]
+    docs = list(build_messages_query(chat_rooms_collection.document(room_id), limit, cursor).stream())
+    return [doc.to_dict() for doc in docs], pagination.next_cursor(docs, limit, ['timestamp'])
@@ -1,9 +1,14 @@
 import uuid
-from typing import List, Optional
+from typing import Dict, List, Optional
 from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
 from app.schemas.comment import CommentCreate, CommentUpdate
 from app.schemas.enums import VoteTypeEnum
-from app.services.firestore_services import user_service
+from app.core import concurrency, pagination
+from app.core.cache import TTLCache
+from app.core.firestore_writes import merge_update, resolve_server_timestamps
+from app.core.pagination import Page
+from app.services.firestore_services import user_service, counter_service, deletion_service, user_relationship_service, topic_service, search_service, moderation_service
 
 def get_posts_collection():
     return firestore.client().collection('posts')
@@ -11,27 +16,29 @@ def get_posts_collection():
 def get_comment_post_mapping_collection():
     return firestore.client().collection('comment_post_mapping')
 
-def delete_collection(coll_ref, batch_size):
-    docs = coll_ref.limit(batch_size).stream()
-    deleted = 0
-    for doc in docs:
-        doc.reference.delete()
-        deleted += 1
-    if deleted >= batch_size:
-        return delete_collection(coll_ref, batch_size)
-
-def _format_comment_response(comment: dict) -> Optional[dict]:
+def _format_comment_response(comment: dict, authors: Optional[Dict[str, dict]] = None) -> Optional[dict]:
+    """
+    Formats a comment document to match the CommentRead schema.
+    Author fields are denormalized on the comment at write time; `authors` (see
+    _format_comments) is only needed for legacy comments written before that.
+    """
     if not comment:
         return None
     author_id = comment.get('author_id')
     if author_id:
-        author_data = user_service.get_user_by_anonymous_id(author_id)
+        if 'author_username' in comment:
+            author_data = {
+                'username': comment.get('author_username'),
+                'avatar_url': comment.get('author_avatar_url'),
+            }
+        else:
+            if authors is None:
+                authors = user_service.get_users_by_anonymous_ids([author_id])
+            author_data = authors.get(author_id)
         comment['author'] = {
             "anonymous_id": author_id,
             "username": author_data.get('username') if author_data else "Unknown",
             "avatar_url": author_data.get('avatar_url') if author_data else None,
-            "bio": author_data.get('bio') if author_data else None,
-            "created_at": author_data.get('created_at') if author_data else None
         }
         comment.pop('author_id', None)
         comment.pop('author_username', None)
@@ -40,49 +47,85 @@ def _format_comment_response(comment: dict) -> Optional[dict]:
         comment['anonymous_comment_id'] = comment.pop('comment_id')
     return comment
 
+def _format_comments(comments: List[dict]) -> List[dict]:
+    """
+    Formats a page of comments. Authors of legacy comments without denormalized author
+    fields are hydrated with one batched user read (cached users cost nothing).
+    """
+    comments = [comment for comment in comments if comment]
+    legacy_author_ids = [comment.get('author_id') for comment in comments if 'author_username' not in comment]
+    authors = user_service.get_users_by_anonymous_ids(legacy_author_ids) if legacy_author_ids else {}
+    return [_format_comment_response(comment, authors) for comment in comments]
+
 def create_comment(post_id: str, comment_in: CommentCreate, author_id: str) -> dict:
     db = firestore.client()
     post_ref = get_posts_collection().document(post_id)
-    if not post_ref.get().exists:
+    post_snapshot, author_data = concurrency.fan_out(post_ref.get, lambda: user_service.get_user_by_anonymous_id(author_id))
+    if not post_snapshot.exists:
         raise ValueError("Post not found")
-
-    author_data = user_service.get_user_by_anonymous_id(author_id)
     if not author_data:
         raise ValueError("Author not found")
-
     comment_id = str(uuid.uuid4())
+    content, moderation_flags = moderation_service.filter_text(comment_in.content)
+    verdict = moderation_service.check_duplicates(moderation_service.comment_key(post_id, comment_id), content, author_id)
+    moderation_flags = list(dict.fromkeys(moderation_flags + verdict['flags']))
+
     comment_ref = post_ref.collection('comments').document(comment_id)
     comment_data = {
         "comment_id": comment_id,
         "post_id": post_id,
-        "content": comment_in.content,
+        "content": content,
         "author_id": author_id,
+        # Denormalized like posts; kept up to date by author_fanout_service.
+        "author_username": author_data.get('username'),
+        "author_avatar_url": author_data.get('avatar_url'),
         "upvotes": 0,
         "downvotes": 0,
+        counter_service.SHARDED_FLAG: True,
         "created_at": firestore.SERVER_TIMESTAMP,
         "updated_at": firestore.SERVER_TIMESTAMP,
     }
+    if moderation_flags:
+        comment_data['moderation_flags'] = moderation_flags
 
     mapping_ref = get_comment_post_mapping_collection().document(comment_id)
 
-    @firestore.transactional
-    def update_in_transaction(transaction, post_ref, comment_ref, comment_data, mapping_ref):
-        post_snapshot = post_ref.get(transaction=transaction)
-        current_comment_count = post_snapshot.get('comment_count') or 0
-        transaction.set(comment_ref, comment_data)
-        transaction.set(mapping_ref, {'post_id': post_id})
-        transaction.update(post_ref, {'comment_count': current_comment_count + 1})
+    try:
+        if not post_snapshot.to_dict().get(counter_service.SHARDED_FLAG):
+            # Legacy post: move its counters into shards once, so the count below is a blind increment.
+            counter_service.ensure_sharded(post_ref, counter_service.POST_COUNTER_FIELDS)
 
-    transaction = db.transaction()
-    update_in_transaction(transaction, post_ref, comment_ref, comment_data, mapping_ref)
+        # The comment count lives in shards, so nothing here reads the post again: a single
+        # batch commit writes everything and its result carries the server timestamp.
+        batch = db.batch()
+        batch.create(comment_ref, comment_data)
+        batch.set(mapping_ref, {'post_id': post_id})
+        counter_service.increment_in_batch(batch, post_ref, {'comment_count': 1})
+        topic_service.record_activity(batch, post_snapshot.to_dict().get('topics') or [])
+        write_results = batch.commit()
+    except Exception:
+        moderation_service.forget_comment(post_id, comment_id)
+        raise
+    comment_post_ids.set(comment_id, post_id)
+
+    created_comment = _format_comments([resolve_server_timestamps(comment_data, write_results[0].update_time)])[0]
+    search_service.index_comment(created_comment)
+    return created_comment
 
-    created_comment = comment_ref.get().to_dict()
-    return _format_comment_response(created_comment)
+# A comment never moves to another post, so its mapping entry can be cached until the
+# comment is deleted. This takes the mapping read out of the mapping -> comment chain.
+comment_post_ids = TTLCache(maxsize=50000, ttl=3600)
 
 def get_post_id_for_comment(comment_id: str) -> Optional[str]:
+    post_id = comment_post_ids.get(comment_id)
+    if post_id is not None:
+        return post_id
     mapping_doc = get_comment_post_mapping_collection().document(comment_id).get()
     if mapping_doc.exists:
-        return mapping_doc.to_dict().get('post_id')
+        post_id = mapping_doc.to_dict().get('post_id')
+        if post_id:
+            comment_post_ids.set(comment_id, post_id)
+        return post_id
     return None
 
 def get_comment_by_id(comment_id: str) -> Optional[dict]:
@@ -93,39 +136,125 @@ def get_comment_by_id(comment_id: str) -> Optional[dict]:
 
 def get_comment(post_id: str, comment_id: str) -> Optional[dict]:
     doc_ref = get_posts_collection().document(post_id).collection('comments').document(comment_id)
-    doc = doc_ref.get()
-    return _format_comment_response(doc.to_dict())
-
-def get_comments_for_post(post_id: str, skip: int = 0, limit: int = 100) -> List[dict]:
-    comments_query = get_posts_collection().document(post_id).collection('comments').order_by('created_at', direction='DESCENDING')
-    docs = comments_query.limit(limit).offset(skip).stream()
-    return [_format_comment_response(doc.to_dict()) for doc in docs]
-
-def get_comments_by_author(author_id: str) -> List[dict]:
-    # This is inefficient. A better solution would be a root-level 'comments' collection.
-    all_posts = get_posts_collection().stream()
-    comments = []
-    for post in all_posts:
-        comments_query = post.reference.collection('comments').where('author_id', '==', author_id)
-        user_comments = comments_query.stream()
-        for comment in user_comments:
-            comments.append(comment.to_dict())
-    return comments
-
-def update_comment(comment_id: str, comment_in: CommentUpdate) -> Optional[dict]:
-    post_id = get_post_id_for_comment(comment_id)
+    comment_data = counter_service.get_with_counters(doc_ref, counter_service.COMMENT_COUNTER_FIELDS)
+    return _format_comments([comment_data])[0] if comment_data else None
+
+def get_comments_for_post(post_id: str, limit: int = 100, cursor: Optional[str] = None, skip: int = 0) -> Page:
+    """
+    Retrieves a page of a post's comments, newest first, and the cursor for the next page.
+    `skip` is the deprecated offset paging; it is ignored when a cursor is given.
+    """
+    comments_query = get_posts_collection().document(post_id).collection('comments') \
+                                           .order_by('created_at', direction='DESCENDING') \
+                                           .order_by('__name__', direction='DESCENDING')
+    docs = list(pagination.apply_cursor(comments_query, cursor, skip).limit(limit).stream())
+    return _format_comments([doc.to_dict() for doc in docs]), pagination.next_cursor(docs, limit, ['created_at'])
+
+def get_my_votes(comments: List[dict], user_id: str) -> Dict[str, str]:
+    """
+    Returns the user's vote type per comment ID for the given (formatted) comments, with
+    one batched read of their votes/{user_id} documents.
+    """
+    if not comments:
+        return {}
+    posts_collection = get_posts_collection()
+    vote_refs = [
+        posts_collection.document(str(comment['post_id'])).collection('comments')
+                        .document(comment['anonymous_comment_id']).collection('votes').document(user_id)
+        for comment in comments
+    ]
+    return {
+        doc.reference.parent.parent.id: doc.get('vote_type')
+        for doc in firestore.client().get_all(vote_refs)
+        if doc.exists
+    }
+
+def get_comments_for_viewer(post_id: str, viewer_id: str, limit: int = 100, cursor: Optional[str] = None, skip: int = 0) -> Page:
+    """
+    get_comments_for_post for a signed-in user: drops comments by authors the viewer muted
+    or blocked (reading ahead so the page stays full) and sets `my_vote` on every comment.
+    """
+    hidden_author_ids = user_relationship_service.get_hidden_author_ids(viewer_id)
+    if hidden_author_ids:
+        comments, next_page_cursor = pagination.fill_page(
+            lambda page_cursor, page_skip: get_comments_for_post(post_id, limit, page_cursor, page_skip),
+            lambda comment: comment['author']['anonymous_id'] not in hidden_author_ids,
+            limit,
+            lambda comment: pagination.encode_cursor({'created_at': comment.get('created_at'), '__name__': comment['anonymous_comment_id']}),
+            cursor=cursor,
+            skip=skip,
+        )
+    else:
+        comments, next_page_cursor = get_comments_for_post(post_id, limit, cursor, skip)
+
+    my_votes = get_my_votes(comments, viewer_id)
+    for comment in comments:
+        comment['my_vote'] = my_votes.get(comment['anonymous_comment_id'])
+    return comments, next_page_cursor
+
+def get_comments_by_author(author_id: str, limit: Optional[int] = None) -> List[dict]:
+    """
+    Retrieves an author's comments across all posts, newest first.
+    Uses a collection-group query over every 'comments' subcollection, so it costs reads
+    proportional to the author's comments only. Requires the (author_id, created_at)
+    collection-group index declared in firestore.indexes.json.
+    """
+    query = firestore.client().collection_group('comments') \
+                              .where('author_id', '==', author_id) \
+                              .order_by('created_at', direction='DESCENDING')
+    if limit:
+        query = query.limit(limit)
+    return [doc.to_dict() for doc in query.stream()]
+
+def update_comment(comment_id: str, comment_in: CommentUpdate, current_comment: Optional[dict] = None) -> Optional[dict]:
+    """
+    Updates a comment. Pass the formatted comment the caller already read as
+    `current_comment` to skip the post lookup and the read-back.
+    """
+    post_id = current_comment.get('post_id') if current_comment else None
+    if not post_id:
+        post_id = get_post_id_for_comment(comment_id)
     if not post_id:
         return None
     doc_ref = get_posts_collection().document(post_id).collection('comments').document(comment_id)
-    if not doc_ref.get().exists:
-        return None
     update_data = comment_in.model_dump(exclude_unset=True)
     update_data['updated_at'] = firestore.SERVER_TIMESTAMP
-    doc_ref.update(update_data)
-    return get_comment(post_id, comment_id)
+    if update_data.get('content'):
+        if current_comment is None:
+            current_comment = get_comment(post_id, comment_id)
+            if current_comment is None:
+                return None
+        update_data['content'], moderation_flags = moderation_service.filter_text(update_data['content'])
+        # Screened like a new comment, under the same key, so the edit replaces its old text.
+        verdict = moderation_service.check_duplicates(
+            moderation_service.comment_key(post_id, comment_id), update_data['content'],
+            current_comment['author']['anonymous_id'],
+        )
+        moderation_flags = list(dict.fromkeys(moderation_flags + verdict['flags']))
+        if moderation_flags:
+            update_data['moderation_flags'] = firestore.ArrayUnion(moderation_flags)
+    try:
+        write_result = doc_ref.update(update_data) # Fails if the comment doesn't exist
+    except NotFound:
+        moderation_service.forget_comment(post_id, comment_id)
+        return None
+    if current_comment is None:
+        updated_comment = get_comment(post_id, comment_id)
+    else:
+        updated_comment = merge_update(current_comment, update_data, write_result.update_time)
+    if updated_comment:
+        search_service.index_comment(updated_comment)
+    return updated_comment
 
-def delete_comment(comment_id: str) -> bool:
-    post_id = get_post_id_for_comment(comment_id)
+def delete_comment(comment_id: str, current_comment: Optional[dict] = None) -> bool:
+    """
+    Deletes a comment with its votes and counter shards.
+    Pass the formatted comment the caller already read as `current_comment` to skip
+    looking it up again.
+    """
+    post_id = current_comment.get('post_id') if current_comment else None
+    if not post_id:
+        post_id = get_post_id_for_comment(comment_id)
     if not post_id:
         return False
     
@@ -133,22 +262,32 @@ def delete_comment(comment_id: str) -> bool:
     post_ref = get_posts_collection().document(post_id)
     comment_ref = post_ref.collection('comments').document(comment_id)
     
-    if not comment_ref.get().exists:
+    if current_comment is None and not comment_ref.get().exists:
         return False
 
-    delete_collection(comment_ref.collection('votes'), 50)
+    deletion_service.delete_descendants(comment_ref) # Votes and counter shards
     mapping_ref = get_comment_post_mapping_collection().document(comment_id)
 
     @firestore.transactional
     def delete_in_transaction(transaction, post_ref, comment_ref, mapping_ref):
+        # Re-read in the transaction, so concurrent deletes take one off the count only once.
+        if not comment_ref.get(transaction=transaction, field_paths=['comment_id']).exists:
+            return False
         post_snapshot = post_ref.get(transaction=transaction)
-        current_comment_count = post_snapshot.get('comment_count') or 0
         transaction.delete(comment_ref)
         transaction.delete(mapping_ref)
-        transaction.update(post_ref, {'comment_count': max(0, current_comment_count - 1)})
+        counter_service.increment_in_transaction(
+            transaction, post_ref, post_snapshot, {'comment_count': -1}, counter_service.POST_COUNTER_FIELDS
+        )
+        return True
 
     transaction = db.transaction()
-    delete_in_transaction(transaction, post_ref, comment_ref, mapping_ref)
+    deleted = delete_in_transaction(transaction, post_ref, comment_ref, mapping_ref)
+    comment_post_ids.invalidate(comment_id)
+    if not deleted:
+        return False
+    search_service.remove_comment(post_id, comment_id)
+    moderation_service.forget_comment(post_id, comment_id)
     return True
 
 def vote_on_comment(comment_id: str, user_id: str, vote_type: VoteTypeEnum) -> Optional[dict]:
@@ -167,39 +306,26 @@ def vote_on_comment(comment_id: str, user_id: str, vote_type: VoteTypeEnum) -> O
             raise ValueError("Comment not found")
 
         vote_snapshot = vote_ref.get(transaction=transaction)
-        current_upvotes = comment_snapshot.get('upvotes') or 0
-        current_downvotes = comment_snapshot.get('downvotes') or 0
         existing_vote_type = vote_snapshot.get('vote_type') if vote_snapshot.exists else None
+        new_vote_type, deltas = counter_service.vote_counter_deltas(existing_vote_type, vote_type)
 
-        upvote_change = 0
-        downvote_change = 0
-
-        if existing_vote_type == vote_type.value: # Unvoting
+        if new_vote_type is None:
             transaction.delete(vote_ref)
-            if vote_type == VoteTypeEnum.UPVOTE:
-                upvote_change = -1
-            else:
-                downvote_change = -1
-        elif existing_vote_type: # Changing vote
-            transaction.set(vote_ref, {'vote_type': vote_type.value})
-            if vote_type == VoteTypeEnum.UPVOTE:
-                upvote_change = 1
-                downvote_change = -1
-            else:
-                upvote_change = -1
-                downvote_change = 1
-        else: # New vote
-            transaction.set(vote_ref, {'vote_type': vote_type.value})
-            if vote_type == VoteTypeEnum.UPVOTE:
-                upvote_change = 1
-            else:
-                downvote_change = 1
-        
-        transaction.update(comment_ref, {
-            'upvotes': current_upvotes + upvote_change,
-            'downvotes': current_downvotes + downvote_change
-        })
+        else:
+            # voter_id lets account deletion find the user's votes (collection group query).
+            transaction.set(vote_ref, {'vote_type': new_vote_type, 'voter_id': user_id})
+        counter_service.increment_in_transaction(
+            transaction, comment_ref, comment_snapshot, deltas, counter_service.COMMENT_COUNTER_FIELDS
+        )
+        comment_data = comment_snapshot.to_dict()
+        comment_data[counter_service.SHARDED_FLAG] = True # Migrated by the increment if it wasn't
+        return comment_data, new_vote_type
 
     transaction = db.transaction()
-    update_in_transaction(transaction, comment_ref, vote_ref)
-    return get_comment(post_id, comment_id)
+    comment_data, my_vote = update_in_transaction(transaction, comment_ref, vote_ref)
+
+    # The comment comes from the transaction's snapshot; only the counters need a fresh read.
+    comment_data.update(counter_service.aggregate(comment_ref, comment_data, counter_service.COMMENT_COUNTER_FIELDS))
+    comment = _format_comments([comment_data])[0]
+    comment['my_vote'] = my_vote
+    return comment
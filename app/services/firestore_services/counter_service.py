@@ -0,0 +1,231 @@
+import random
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+from app.core import concurrency, ranking
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.schemas.enums import VoteTypeEnum
+
+# Sharded distributed counters for votes and comment counts.
+#
+# Firestore sustains about one write per second per document, so counters on a hot post
+# used to make every vote contend on the post document. Increments now go to one of
+# COUNTER_SHARD_COUNT shard documents in the '{doc}/counter_shards' subcollection, picked
+# at random, and never touch the parent document.
+#
+# - Single-document reads aggregate the shards (one extra query) for exact counts. For
+#   documents this instance has seen sharded, the document and the shards are read at once.
+# - List reads use the totals materialized on the parent document. Every increment marks
+#   the parent dirty and a background materializer folds the shards back into it
+#   every COUNTER_MATERIALIZE_INTERVAL_SECONDS, together with the post ranking scores
+#   derived from them (app/core/ranking.py).
+# - Documents written before sharding carry their totals on the document itself and no
+#   'counters_sharded' flag. The first increment (or migrate_sharded_counters.py) moves
+#   those totals into shard 0.
+
+SHARDS_COLLECTION = 'counter_shards'
+SHARDED_FLAG = 'counters_sharded'
+
+POST_COUNTER_FIELDS = ('upvotes', 'downvotes', 'comment_count')
+COMMENT_COUNTER_FIELDS = ('upvotes', 'downvotes')
+
+_dirty_paths = set()
+# Paths of documents known to be sharded. The flag is never taken off, so entries only
+# expire to bound memory.
+_sharded_paths = TTLCache(maxsize=50000, ttl=3600)
+_dirty_lock = threading.Lock()
+_materializer_thread: Optional[threading.Thread] = None
+_materializer_stop = threading.Event()
+
+def _random_shard_ref(doc_ref):
+    shard_id = str(random.randrange(max(1, settings.COUNTER_SHARD_COUNT)))
+    return doc_ref.collection(SHARDS_COLLECTION).document(shard_id)
+
+def mark_dirty(doc_path: str) -> None:
+    _sharded_paths.set(doc_path, True) # Incremented documents are sharded
+    with _dirty_lock:
+        _dirty_paths.add(doc_path)
+
+def vote_counter_deltas(existing_vote_type: Optional[str], vote_type: VoteTypeEnum) -> Tuple[Optional[str], Dict[str, int]]:
+    """
+    Works out a vote toggle. Returns the vote type to store (None to remove the vote)
+    and the upvotes/downvotes deltas to apply.
+    """
+    deltas = {'upvotes': 0, 'downvotes': 0}
+    field = 'upvotes' if vote_type == VoteTypeEnum.UPVOTE else 'downvotes'
+    other_field = 'downvotes' if vote_type == VoteTypeEnum.UPVOTE else 'upvotes'
+
+    if existing_vote_type == vote_type.value: # Unvoting
+        deltas[field] = -1
+        return None, deltas
+    if existing_vote_type: # Changing vote
+        deltas[field] = 1
+        deltas[other_field] = -1
+        return vote_type.value, deltas
+    deltas[field] = 1 # New vote
+    return vote_type.value, deltas
+
+def increment_in_transaction(transaction, doc_ref, doc_snapshot, deltas: Dict[str, int], fields: Iterable[str]) -> None:
+    """
+    Applies counter deltas inside a transaction that has read `doc_snapshot`.
+    Unsharded (legacy) documents are migrated on the fly: their totals plus the deltas
+    become shard 0.
+    """
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    data = doc_snapshot.to_dict() or {}
+    if data.get(SHARDED_FLAG):
+        if deltas:
+            transaction.set(
+                _random_shard_ref(doc_ref),
+                {field: firestore.Increment(delta) for field, delta in deltas.items()},
+                merge=True,
+            )
+    else:
+        base = {field: max(0, (data.get(field) or 0) + deltas.get(field, 0)) for field in fields}
+        transaction.set(doc_ref.collection(SHARDS_COLLECTION).document('0'), base)
+        transaction.update(doc_ref, {SHARDED_FLAG: True})
+    mark_dirty(doc_ref.path)
+
+def increment_in_batch(batch, doc_ref, deltas: Dict[str, int]) -> None:
+    """
+    Adds counter deltas to a write batch. The document must already be sharded
+    (see ensure_sharded): a batch can't migrate legacy totals safely.
+    """
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if deltas:
+        batch.set(
+            _random_shard_ref(doc_ref),
+            {field: firestore.Increment(delta) for field, delta in deltas.items()},
+            merge=True,
+        )
+    mark_dirty(doc_ref.path)
+
+def ensure_sharded(doc_ref, fields: Iterable[str]) -> bool:
+    """
+    Migrates a legacy document's totals into shard 0 in its own transaction.
+    Returns True if the document was migrated, False if it was already sharded or is gone.
+    """
+    @firestore.transactional
+    def migrate_in_transaction(transaction, doc_ref):
+        snapshot = doc_ref.get(transaction=transaction)
+        if not snapshot.exists or (snapshot.to_dict() or {}).get(SHARDED_FLAG):
+            return False
+        increment_in_transaction(transaction, doc_ref, snapshot, {}, fields)
+        return True
+
+    return migrate_in_transaction(firestore.client().transaction(), doc_ref)
+
+def aggregate(doc_ref, doc_data: dict, fields: Iterable[str]) -> Dict[str, int]:
+    """
+    Returns exact counter totals for a document by summing its shards.
+    `doc_data` is the parent document, used as-is for unsharded documents.
+    """
+    if not doc_data.get(SHARDED_FLAG):
+        return {field: doc_data.get(field) or 0 for field in fields}
+    return _sum_shards(doc_ref.collection(SHARDS_COLLECTION).stream(), fields)
+
+def _sum_shards(shards, fields: Iterable[str]) -> Dict[str, int]:
+    totals = {field: 0 for field in fields}
+    for shard in shards:
+        shard_data = shard.to_dict()
+        for field in fields:
+            totals[field] += shard_data.get(field) or 0
+    return totals
+
+def get_with_counters(doc_ref, fields: Iterable[str]) -> Optional[dict]:
+    """
+    Reads a document with exact counter totals (see aggregate), or returns None if it
+    doesn't exist. For a document known to be sharded, the document and its shards are
+    read concurrently (one round trip instead of two); others are read first, so an
+    unsharded document isn't billed for an empty shard query.
+    """
+    shards_query = doc_ref.collection(SHARDS_COLLECTION)
+    if _sharded_paths.get(doc_ref.path):
+        snapshot, shards = concurrency.fan_out(doc_ref.get, lambda: list(shards_query.stream()))
+    else:
+        snapshot, shards = doc_ref.get(), None
+    if not snapshot.exists:
+        return None
+    doc_data = snapshot.to_dict()
+    if doc_data.get(SHARDED_FLAG):
+        _sharded_paths.set(doc_ref.path, True)
+        doc_data.update(_sum_shards(shards if shards is not None else shards_query.stream(), fields))
+    else:
+        doc_data.update({field: doc_data.get(field) or 0 for field in fields})
+    return doc_data
+
+def derived_fields(doc_ref, doc_data: dict, totals: Dict[str, int]) -> dict:
+    """
+    Fields computed from the counters that are stored next to them (post ranking scores).
+    """
+    if doc_ref.parent.id != 'posts':
+        return {}
+    return ranking.post_scores(totals.get('upvotes'), totals.get('downvotes'), doc_data.get('created_at'))
+
+def materialize(doc_ref, fields: Iterable[str]) -> Optional[Dict[str, int]]:
+    """
+    Writes the current shard totals (and the fields derived from them) onto the parent
+    document. Returns the totals, or None if the document no longer exists.
+    """
+    snapshot = doc_ref.get()
+    if not snapshot.exists:
+        return None
+    doc_data = snapshot.to_dict()
+    if not doc_data.get(SHARDED_FLAG):
+        # Not migrated yet: the document itself still holds the totals.
+        return aggregate(doc_ref, doc_data, fields)
+    totals = aggregate(doc_ref, doc_data, fields)
+    update_data = {**totals, **derived_fields(doc_ref, doc_data, totals)}
+    if all(doc_data.get(field) == value for field, value in update_data.items()):
+        return totals
+    try:
+        doc_ref.update({**update_data, 'counters_materialized_at': firestore.SERVER_TIMESTAMP})
+    except NotFound:
+        return None
+    return totals
+
+def fields_for_path(doc_path: str) -> Tuple[str, ...]:
+    # posts/{post_id} or posts/{post_id}/comments/{comment_id}
+    return COMMENT_COUNTER_FIELDS if '/comments/' in doc_path else POST_COUNTER_FIELDS
+
+def flush_dirty_counters() -> int:
+    """
+    Materializes every document whose counters changed since the last flush.
+    """
+    global _dirty_paths
+    with _dirty_lock:
+        paths, _dirty_paths = _dirty_paths, set()
+    db = firestore.client()
+    flushed = 0
+    for path in paths:
+        try:
+            if materialize(db.document(path), fields_for_path(path)) is not None:
+                flushed += 1
+        except Exception as e:
+            print(f"Failed to materialize counters for {path}: {e}")
+            mark_dirty(path) # Retry on the next flush
+    return flushed
+
+def _materializer_loop() -> None:
+    while not _materializer_stop.wait(settings.COUNTER_MATERIALIZE_INTERVAL_SECONDS):
+        flush_dirty_counters()
+
+def start_counter_materializer() -> None:
+    """
+    Starts the periodic materializer thread (idempotent).
+    """
+    global _materializer_thread
+    if _materializer_thread is not None and _materializer_thread.is_alive():
+        return
+    _materializer_stop.clear()
+    _materializer_thread = threading.Thread(target=_materializer_loop, name="counter-materializer", daemon=True)
+    _materializer_thread.start()
+
+def stop_counter_materializer() -> None:
+    """
+    Stops the materializer thread and flushes pending counters one last time.
+    """
+    _materializer_stop.set()
+    flush_dirty_counters()
@@ -0,0 +1,269 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+from firebase_admin import firestore
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions
+from app.core.background import run_in_background, run_later
+from app.core.config import settings
+from app.schemas.enums import VoteTypeEnum
+from app.services.firestore_services import job_service, counter_service, post_service, topic_service, search_service, related_service, moderation_service, user_relationship_service
+
+# Cascade deletion engine for posts, comments and whole accounts.
+#
+# Deletes are queued on a BulkWriter, which groups them into batches and commits the
+# batches in parallel under a rate limit (DELETION_MAX_OPS_PER_SECOND), instead of one
+# delete round trip per document. Finding what to delete (the subcollections under a
+# document) is read-only and is fanned out on a small thread pool; the BulkWriter is not
+# thread-safe, so all writes are queued from the calling thread.
+#
+# Account deletion runs as a tracked background job (job_service): it reports progress
+# per page and is resumed by the lifespan hook after a restart, or retried after a failed
+# run. A page may be replayed, so deleting a counted document (a post, comment or vote)
+# and taking it off its counters commit together in one batch: a replay finds only what
+# wasn't deleted, and no counter is decremented twice.
+
+JOB_TYPE = "account_deletion"
+LEASE_SECONDS = 120
+
+# An account's data, in deletion order. Every phase re-queries until nothing matches,
+# so the phase name alone is a valid resume cursor. Votes come after the user's own posts
+# and comments, which take the votes on them along; what is left are votes on other
+# people's content, taken off its counters. Votes cast before vote documents carried
+# voter_id are found once app/scripts/backfill_vote_voter_ids.py has run.
+PHASES = ("posts", "comments", "votes", "chat_rooms", "chat_requests", "relationships")
+
+def new_bulk_writer():
+    ops_per_second = settings.DELETION_MAX_OPS_PER_SECOND
+    return firestore.client().bulk_writer(
+        BulkWriterOptions(initial_ops_per_second=ops_per_second, max_ops_per_second=ops_per_second)
+    )
+
+def list_descendants(doc_ref) -> List:
+    """
+    Returns references to every document nested under `doc_ref`, at any depth.
+    One ID-only query per direct subcollection.
+    """
+    refs = []
+    for collection_ref in doc_ref.collections():
+        for doc in collection_ref.recursive().select(['__name__']).stream():
+            refs.append(doc.reference)
+    return refs
+
+def _is_post_comment(doc_ref) -> bool:
+    # posts/{post_id}/comments/{comment_id}
+    return doc_ref.parent.id == 'comments' and doc_ref.parent.parent is not None \
+        and doc_ref.parent.parent.parent.id == 'posts'
+
+def delete_trees(doc_refs: Iterable, bulk_writer, root_writer=None) -> int:
+    """
+    Queues deletes for each document in `doc_refs` and everything nested under it, plus
+    the comment_post_mapping entry of every comment removed on the way.
+    The documents themselves (and their mappings) go to `root_writer` if given, e.g. a
+    batch that also holds their counter updates, and their subtrees to the BulkWriter.
+    Returns the number of documents queued; call bulk_writer.flush() to wait for them.
+    """
+    doc_refs = list(doc_refs)
+    if not doc_refs:
+        return 0
+    root_writer = root_writer or bulk_writer
+    with ThreadPoolExecutor(max_workers=settings.DELETION_READ_CONCURRENCY) as pool:
+        descendants = list(pool.map(list_descendants, doc_refs))
+
+    mapping_collection = firestore.client().collection('comment_post_mapping')
+    deleted = 0
+    for doc_ref, nested_refs in zip(doc_refs, descendants):
+        for ref in nested_refs + [doc_ref]:
+            writer = root_writer if ref is doc_ref else bulk_writer
+            writer.delete(ref)
+            deleted += 1
+            if _is_post_comment(ref):
+                writer.delete(mapping_collection.document(ref.id))
+    return deleted
+
+def delete_descendants(doc_ref) -> int:
+    """
+    Deletes everything nested under `doc_ref` but not the document itself.
+    """
+    bulk_writer = new_bulk_writer()
+    nested_refs = list_descendants(doc_ref)
+    for ref in nested_refs:
+        bulk_writer.delete(ref)
+    bulk_writer.close()
+    return len(nested_refs)
+
+def delete_post_tree(post_id: str) -> int:
+    """
+    Deletes a post with its comments, votes, counter shards and comment mappings.
+    Returns the number of documents deleted.
+    """
+    post_ref = firestore.client().collection('posts').document(post_id)
+    bulk_writer = new_bulk_writer()
+    deleted = delete_trees([post_ref], bulk_writer)
+    bulk_writer.close()
+    return deleted
+
+def _delete_comments(docs, bulk_writer) -> int:
+    """
+    Deletes comments (with their subcollections and mappings) and takes them off their
+    posts' comment counts.
+    """
+    db = firestore.client()
+    batch = db.batch()
+    removed_per_post = Counter(doc.reference.parent.parent.path for doc in docs)
+    post_refs = [db.document(path) for path in removed_per_post]
+    for post in db.get_all(post_refs):
+        if not post.exists:
+            continue
+        if not post.to_dict().get(counter_service.SHARDED_FLAG):
+            counter_service.ensure_sharded(post.reference, counter_service.POST_COUNTER_FIELDS)
+        counter_service.increment_in_batch(
+            batch, post.reference, {'comment_count': -removed_per_post[post.reference.path]}
+        )
+    deleted = delete_trees([doc.reference for doc in docs], bulk_writer, root_writer=batch)
+    bulk_writer.flush() # Subtrees first: the comments must stay findable until they're gone
+    batch.commit()
+    return deleted
+
+def _delete_votes(docs) -> int:
+    """
+    Deletes votes on posts and comments and takes them off the voted documents' counters.
+    """
+    db = firestore.client()
+    batch = db.batch()
+    deltas_per_doc: Dict[str, Counter] = {}
+    for doc in docs:
+        field = 'upvotes' if doc.get('vote_type') == VoteTypeEnum.UPVOTE.value else 'downvotes'
+        deltas_per_doc.setdefault(doc.reference.parent.parent.path, Counter())[field] -= 1
+    for voted in db.get_all([db.document(path) for path in deltas_per_doc]):
+        if not voted.exists:
+            continue
+        if not voted.to_dict().get(counter_service.SHARDED_FLAG):
+            counter_service.ensure_sharded(voted.reference, counter_service.fields_for_path(voted.reference.path))
+        counter_service.increment_in_batch(batch, voted.reference, dict(deltas_per_doc[voted.reference.path]))
+    for doc in docs:
+        batch.delete(doc.reference)
+    batch.commit()
+    return len(docs)
+
+def _phase_queries(phase: str, user_id: str) -> list:
+    db = firestore.client()
+    if phase == "posts":
+        return [db.collection('posts').where('author_id', '==', user_id)]
+    if phase == "comments":
+        return [db.collection_group('comments').where('author_id', '==', user_id)]
+    if phase == "votes":
+        return [db.collection_group('votes').where('voter_id', '==', user_id)]
+    if phase == "chat_rooms":
+        return [db.collection('chat_rooms').where('participants', 'array_contains', user_id)]
+    if phase == "chat_requests":
+        requests_collection = db.collection('chat_requests')
+        return [requests_collection.where('requester_id', '==', user_id),
+                requests_collection.where('requestee_id', '==', user_id)]
+    relationships_collection = db.collection('user_relationships')
+    return [relationships_collection.where('actor_id', '==', user_id),
+            relationships_collection.where('target_id', '==', user_id)]
+
+def _delete_page(phase: str, user_id: str, docs, bulk_writer) -> int:
+    """
+    Queues the writes that remove one page of a phase. Returns the documents deleted.
+    """
+    if phase == "posts":
+        for doc in docs:
+            search_service.remove_post(doc.id)
+            related_service.remove_post(doc.id)
+            moderation_service.forget_post(doc.id)
+        batch = firestore.client().batch()
+        removed_per_topic = Counter(topic for doc in docs for topic in (doc.to_dict().get('topics') or []))
+        topic_service.record_post_counts(
+            batch, Counter({topic: -count for topic, count in removed_per_topic.items()})
+        )
+        deleted = delete_trees([doc.reference for doc in docs], bulk_writer, root_writer=batch)
+        bulk_writer.flush()
+        batch.commit()
+        return deleted
+    if phase == "comments":
+        for doc in docs:
+            search_service.remove_comment(doc.reference.parent.parent.id, doc.id)
+            moderation_service.forget_comment(doc.reference.parent.parent.id, doc.id)
+        return _delete_comments(docs, bulk_writer)
+    if phase == "votes":
+        return _delete_votes(docs)
+    if phase == "chat_rooms":
+        direct_rooms = []
+        for doc in docs:
+            if doc.to_dict().get('is_group'):
+                # Group chats go on without the user.
+                bulk_writer.update(doc.reference, {'participants': firestore.ArrayRemove([user_id])})
+            else:
+                direct_rooms.append(doc.reference)
+        return delete_trees(direct_rooms, bulk_writer)
+    for doc in docs:
+        bulk_writer.delete(doc.reference)
+        user_relationship_service.invalidate_relationship_sets(doc.get('actor_id'), doc.get('target_id'))
+    return len(docs)
+
+def schedule_account_deletion(user_id: str) -> dict:
+    """
+    Creates a deletion job for everything an account owns and starts it in the background.
+    """
+    job = job_service.create_job(JOB_TYPE, {"user_id": user_id})
+    run_in_background(run_account_deletion, job['job_id'])
+    return job
+
+def run_account_deletion(job_id: str) -> Optional[dict]:
+    """
+    Runs (or resumes) an account deletion job. Returns the final progress, or None if the
+    job is finished or currently owned by another worker.
+    """
+    job = job_service.claim_job(job_id, LEASE_SECONDS)
+    if job is None:
+        return None
+
+    user_id = job['params']['user_id']
+    cursor = job.get('cursor') or {"phase": PHASES[0]}
+    progress = job.get('progress') or {}
+    batch_size = settings.DELETION_BATCH_SIZE
+    bulk_writer = new_bulk_writer()
+
+    try:
+        for phase in PHASES[PHASES.index(cursor['phase']):]:
+            for query in _phase_queries(phase, user_id):
+                last_first_path = None
+                while True:
+                    docs = list(query.limit(batch_size).stream())
+                    if not docs:
+                        break
+                    if docs[0].reference.path == last_first_path:
+                        # Not the path: vote documents are named after the user, and job errors are public.
+                        raise RuntimeError(f"Deletion of a page of {phase} did not go through")
+                    last_first_path = docs[0].reference.path
+
+                    deleted = _delete_page(phase, user_id, docs, bulk_writer)
+                    bulk_writer.flush() # The next page is re-queried, so wait for these writes
+                    if phase == "posts":
+                        post_service.invalidate_feed_cache()
+                    progress[f"{phase}_deleted"] = progress.get(f"{phase}_deleted", 0) + len(docs)
+                    progress['documents_deleted'] = progress.get('documents_deleted', 0) + deleted
+                    job_service.record_progress(job_id, {"phase": phase}, progress, LEASE_SECONDS)
+                    if len(docs) < batch_size:
+                        break
+    except Exception as e:
+        retry_in = job_service.record_failed_attempt(job, progress, str(e))
+        if retry_in is not None:
+            run_later(retry_in, run_account_deletion, job_id)
+        raise
+    finally:
+        bulk_writer.close()
+
+    job_service.finish_job(job_id, progress)
+    return progress
+
+def resume_pending_jobs() -> int:
+    """
+    Restarts unfinished account deletions in the background (e.g. after an instance restart),
+    each once its lease or retry backoff runs out.
+    """
+    jobs = job_service.get_resumable_jobs(JOB_TYPE)
+    for job in jobs:
+        run_later(job_service.seconds_until_claimable(job), run_account_deletion, job['job_id'])
+    return len(jobs)
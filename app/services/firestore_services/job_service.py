@@ -0,0 +1,149 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from firebase_admin import firestore
+from app.core.config import settings
+from app.core.firestore_writes import resolve_server_timestamps
+
+# Tracks long-running background jobs in the 'jobs' collection so they report progress
+# and can be resumed after an instance restarts.
+#
+# A failed run doesn't end a job: it goes back to pending with its lease pushed out by an
+# exponential backoff, so nobody claims it before then, and only after JOB_MAX_ATTEMPTS
+# failed runs is it marked failed.
+
+JOB_STATUS_PENDING = "pending"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_COMPLETED = "completed"
+JOB_STATUS_FAILED = "failed"
+
+RESUMABLE_STATUSES = [JOB_STATUS_PENDING, JOB_STATUS_RUNNING]
+
+def get_jobs_collection():
+    """Returns the 'jobs' collection reference, ensuring the client is requested after initialization."""
+    return firestore.client().collection('jobs')
+
+def create_job(job_type: str, params: dict) -> dict:
+    """
+    Creates a new pending job document.
+    """
+    job_id = str(uuid.uuid4())
+    job_data = {
+        "job_id": job_id,
+        "job_type": job_type,
+        "params": params,
+        "status": JOB_STATUS_PENDING,
+        "cursor": None,
+        "progress": {},
+        "error": None,
+        "failed_attempts": 0,
+        "lease_expires_at": None,
+        "created_at": firestore.SERVER_TIMESTAMP,
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    }
+    write_result = get_jobs_collection().document(job_id).set(job_data)
+    return resolve_server_timestamps(job_data, write_result.update_time)
+
+def get_job(job_id: str) -> Optional[dict]:
+    """
+    Retrieves a job document by its ID.
+    """
+    doc = get_jobs_collection().document(job_id).get()
+    if doc.exists:
+        return doc.to_dict()
+    return None
+
+def get_resumable_jobs(job_type: str, limit: int = 50) -> List[dict]:
+    """
+    Retrieves jobs of a type that haven't finished yet.
+    """
+    query = get_jobs_collection().where('job_type', '==', job_type) \
+                                 .where('status', 'in', RESUMABLE_STATUSES)
+    return [doc.to_dict() for doc in query.limit(limit).stream()]
+
+def claim_job(job_id: str, lease_seconds: int) -> Optional[dict]:
+    """
+    Marks a job as running for this worker if nobody else holds a live lease on it.
+    Returns the job document, or None if it is finished or owned by another worker.
+    """
+    db = firestore.client()
+    job_ref = get_jobs_collection().document(job_id)
+
+    @firestore.transactional
+    def claim_in_transaction(transaction, job_ref):
+        snapshot = job_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        job = snapshot.to_dict()
+        if job.get('status') not in RESUMABLE_STATUSES:
+            return None
+        now = datetime.now(timezone.utc)
+        lease_expires_at = job.get('lease_expires_at')
+        if lease_expires_at and lease_expires_at > now:
+            return None
+        job['status'] = JOB_STATUS_RUNNING
+        job['lease_expires_at'] = now + timedelta(seconds=lease_seconds)
+        transaction.update(job_ref, {
+            'status': JOB_STATUS_RUNNING,
+            'lease_expires_at': job['lease_expires_at'],
+            'updated_at': firestore.SERVER_TIMESTAMP,
+        })
+        return job
+
+    transaction = db.transaction()
+    return claim_in_transaction(transaction, job_ref)
+
+def record_progress(job_id: str, cursor: Optional[dict], progress: dict, lease_seconds: int) -> None:
+    """
+    Persists the resume cursor and progress counters of a running job and renews its lease.
+    """
+    get_jobs_collection().document(job_id).update({
+        'cursor': cursor,
+        'progress': progress,
+        'lease_expires_at': datetime.now(timezone.utc) + timedelta(seconds=lease_seconds),
+        'updated_at': firestore.SERVER_TIMESTAMP,
+    })
+
+def finish_job(job_id: str, progress: dict, error: Optional[str] = None) -> None:
+    """
+    Marks a job as completed, or failed when an error message is given.
+    """
+    get_jobs_collection().document(job_id).update({
+        'status': JOB_STATUS_FAILED if error else JOB_STATUS_COMPLETED,
+        'progress': progress,
+        'error': error,
+        'lease_expires_at': None,
+        'updated_at': firestore.SERVER_TIMESTAMP,
+    })
+
+def record_failed_attempt(job: dict, progress: dict, error: str) -> Optional[float]:
+    """
+    Records a failed run of a claimed job. Returns the seconds to wait before it can be
+    claimed again, or None once it has failed JOB_MAX_ATTEMPTS times and is marked failed.
+    """
+    failed_attempts = (job.get('failed_attempts') or 0) + 1
+    update_data = {
+        'progress': progress,
+        'error': error,
+        'failed_attempts': failed_attempts,
+        'updated_at': firestore.SERVER_TIMESTAMP,
+    }
+    retry_in = None
+    if failed_attempts >= settings.JOB_MAX_ATTEMPTS:
+        update_data['status'] = JOB_STATUS_FAILED
+        update_data['lease_expires_at'] = None
+    else:
+        retry_in = min(settings.JOB_RETRY_BASE_SECONDS * 2 ** (failed_attempts - 1), settings.JOB_RETRY_MAX_SECONDS)
+        update_data['status'] = JOB_STATUS_PENDING
+        update_data['lease_expires_at'] = datetime.now(timezone.utc) + timedelta(seconds=retry_in)
+    get_jobs_collection().document(job['job_id']).update(update_data)
+    return retry_in
+
+def seconds_until_claimable(job: dict) -> float:
+    """
+    Returns how long a resumable job's lease (or retry backoff) still holds it.
+    """
+    lease_expires_at = job.get('lease_expires_at')
+    if not lease_expires_at:
+        return 0.0
+    return max(0.0, (lease_expires_at - datetime.now(timezone.utc)).total_seconds())
@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+from app.core.config import settings
+from app.core import content_filter, duplicate_detector
+from app.core.exceptions import ContentRejectedError
+
+# Screening of user-written text, done before it is written.
+#
+# Posts, comments, chat messages and profile fields go through the phrase filter
+# (app/core/content_filter.py). Each phrase category has an action: 'reject' refuses the
+# text (422), 'mask' replaces the phrase with asterisks, and 'flag' keeps it. Every matched
+# category is stored in the document's 'moderation_flags' for moderators, e.g. 'crisis'
+# for posts whose authors may need support. The phrase list file is reloaded on change.
+#
+# Spam floods from throwaway accounts arrive as near-identical texts. Posts and comments are
+# remembered in a bounded, per-instance MinHash LSH index (see app/core/duplicate_detector.py),
+# and new content is compared against its matches at DUPLICATE_FLAG_SIMILARITY or above:
+# - the author's own copies: one at DUPLICATE_REJECT_SIMILARITY is rejected (409), and
+#   DUPLICATE_THROTTLE_MATCHES of them throttle the author (429) until the oldest leaves
+#   the window,
+# - other authors' copies are normal here (the same words of support under many posts);
+#   only DUPLICATE_CLUSTER_MATCHES of them from distinct authors within
+#   DUPLICATE_CLUSTER_WINDOW_SECONDS, a coordinated flood, are throttled (429),
+# - anything else is accepted and stored with a 'near_duplicate' moderation flag.
+# Accepted content enters the index as it is checked, under a lock, so a concurrent burst
+# can't all pass the check. Callers take it out again if the write fails, and on delete.
+# Only the first DUPLICATE_MAX_TEXT_LENGTH characters are screened.
+
+NEAR_DUPLICATE_FLAG = "near_duplicate"
+
+_filter: Optional[content_filter.ContentFilter] = None
+_filter_mtime: Optional[float] = None
+_filter_checked_at = 0.0
+_filter_lock = threading.Lock()
+
+duplicate_index = duplicate_detector.DuplicateIndex(
+    max_entries=settings.DUPLICATE_INDEX_MAX_ENTRIES,
+    max_age=settings.DUPLICATE_WINDOW_SECONDS,
+)
+_screen_lock = threading.Lock() # Makes check-and-add atomic across request threads
+
+def post_key(post_id: str) -> str:
+    return f"post:{post_id}"
+
+def comment_key(post_id: str, comment_id: str) -> str:
+    return f"comment:{post_id}/{comment_id}"
+
+def get_content_filter() -> Optional[content_filter.ContentFilter]:
+    """
+    Returns the compiled phrase filter, recompiling it if the phrase list file changed.
+    A broken file keeps the previous filter in place.
+    """
+    global _filter, _filter_mtime, _filter_checked_at
+    now = time.monotonic()
+    if _filter is not None and now - _filter_checked_at < settings.CONTENT_FILTER_RELOAD_INTERVAL_SECONDS:
+        return _filter
+    with _filter_lock:
+        if _filter is not None and now - _filter_checked_at < settings.CONTENT_FILTER_RELOAD_INTERVAL_SECONDS:
+            return _filter
+        _filter_checked_at = now
+        try:
+            mtime = os.path.getmtime(settings.CONTENT_FILTER_PATH)
+            if mtime != _filter_mtime:
+                _filter = content_filter.ContentFilter.from_file(settings.CONTENT_FILTER_PATH)
+                _filter_mtime = mtime
+                print(f"Loaded content filter: {len(_filter)} phrases from {settings.CONTENT_FILTER_PATH}")
+        except (OSError, ValueError) as e:
+            print(f"Could not load content filter from {settings.CONTENT_FILTER_PATH}: {e}")
+    return _filter
+
+def filter_text(text: Optional[str], allow_mask: bool = True) -> Tuple[Optional[str], List[str]]:
+    """
+    Runs text through the phrase filter. Returns the text to store (with 'mask' phrases
+    masked) and the matched categories, or raises ContentRejectedError for 'reject'
+    phrases. With `allow_mask=False` (e.g. usernames), 'mask' phrases are rejected too.
+    """
+    if not text or not settings.CONTENT_FILTER_ENABLED:
+        return text, []
+    phrase_filter = get_content_filter()
+    if phrase_filter is None:
+        return text, []
+    matches = phrase_filter.scan(text)
+    if not matches:
+        return text, []
+    actions = {phrase_filter.actions[category] for category, _, _, _ in matches}
+    if "reject" in actions or ("mask" in actions and not allow_mask):
+        raise ContentRejectedError("This contains language that isn't allowed here.", status_code=422)
+    to_mask = [match for match in matches if phrase_filter.actions[match[0]] == "mask"]
+    if to_mask:
+        text = content_filter.mask(text, to_mask)
+    return text, list(dict.fromkeys(category for category, _, _, _ in matches))
+
+def check_duplicates(key: str, text: str, author_id: Optional[str] = None) -> dict:
+    """
+    Checks new or edited content before it is written, and enters it in the index under
+    `key` (see post_key/comment_key), replacing the entry of its previous text. Raises
+    ContentRejectedError if it must not be written; otherwise returns a verdict with the
+    moderation flags to store on the document.
+    If the write then fails, take the content out with forget_post/forget_comment.
+    """
+    verdict = {"flags": []}
+    if not settings.DUPLICATE_DETECTION_ENABLED:
+        return verdict
+    normalized = duplicate_detector.normalize_text(text[:settings.DUPLICATE_MAX_TEXT_LENGTH])
+    signature = duplicate_detector.signature(normalized) \
+        if len(normalized) >= settings.DUPLICATE_MIN_TEXT_LENGTH else None
+    if signature is None:
+        duplicate_index.remove(key) # An edit down to a few words leaves nothing to compare
+        return verdict
+
+    with _screen_lock:
+        # An edited document doesn't count as a copy of its own previous text.
+        matches = [match for match in duplicate_index.query(signature, settings.DUPLICATE_FLAG_SIMILARITY)
+                   if match[0] != key]
+        _judge_matches(matches, author_id)
+        duplicate_index.add(key, signature, author_id)
+    if matches:
+        verdict["flags"].append(NEAR_DUPLICATE_FLAG)
+    return verdict
+
+def _judge_matches(matches: List[Tuple[str, float, Optional[str], float]], author_id: Optional[str]) -> None:
+    own = [match for match in matches if author_id is not None and match[2] == author_id]
+    if own and own[0][1] >= settings.DUPLICATE_REJECT_SIMILARITY:
+        raise ContentRejectedError("You just posted this.", status_code=409)
+    if len(own) >= settings.DUPLICATE_THROTTLE_MATCHES:
+        _throttle(max(age for _, _, _, age in own), settings.DUPLICATE_WINDOW_SECONDS)
+
+    # One copy per other author, the most recent, counted if it is a close one.
+    cluster = {}
+    for _, score, match_author_id, age in matches:
+        if match_author_id == author_id or score < settings.DUPLICATE_REJECT_SIMILARITY:
+            continue
+        if age <= settings.DUPLICATE_CLUSTER_WINDOW_SECONDS:
+            cluster[match_author_id] = min(age, cluster.get(match_author_id, age))
+    if len(cluster) >= settings.DUPLICATE_CLUSTER_MATCHES:
+        _throttle(max(cluster.values()), settings.DUPLICATE_CLUSTER_WINDOW_SECONDS)
+
+def _throttle(oldest_age: float, window: float) -> None:
+    raise ContentRejectedError(
+        "Too much similar content has been posted recently. Please try again later.",
+        status_code=429, retry_after=max(1, int(window - oldest_age)),
+    )
+
+def forget_post(post_id: str) -> None:
+    """
+    Takes a post and its comments out of the duplicate index, so they can be posted again.
+    """
+    duplicate_index.remove(post_key(post_id))
+    duplicate_index.remove_prefix(comment_key(post_id, ""))
+
+def forget_comment(post_id: str, comment_id: str) -> None:
+    duplicate_index.remove(comment_key(post_id, comment_id))
+
+def get_moderation_stats() -> dict:
+    return {"duplicate_detection_enabled": settings.DUPLICATE_DETECTION_ENABLED, **duplicate_index.stats()}
@@ -1,9 +1,16 @@
 import uuid
-from typing import List, Optional
+from collections import Counter
+from typing import Dict, List, Optional
 from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
 from app.schemas.post import PostCreate, PostUpdate
-from app.schemas.enums import VoteTypeEnum
-from app.services.firestore_services import user_service
+from app.schemas.enums import PostSortEnum, VoteTypeEnum
+from app.core import concurrency, pagination, ranking
+from app.core.cache import SingleFlight, TTLCache
+from app.core.config import settings
+from app.core.firestore_writes import merge_update, resolve_server_timestamps
+from app.core.pagination import Page
+from app.services.firestore_services import user_service, counter_service, deletion_service, user_relationship_service, topic_service, search_service, moderation_service, related_service
 
 # This service replaces the functionality of crud/crud_post.py for a Firestore database.
 
@@ -25,17 +32,6 @@ def _format_post(post_dict: dict) -> dict:
     }
     return post_dict
 
-def delete_collection(coll_ref, batch_size):
-    docs = coll_ref.limit(batch_size).stream()
-    deleted = 0
-
-    for doc in docs:
-        doc.reference.delete()
-        deleted = deleted + 1
-
-    if deleted >= batch_size:
-        return delete_collection(coll_ref, batch_size)
-
 def create_post(post_in: PostCreate, author_id: str) -> dict:
     """
     Creates a new post document in Firestore.
@@ -45,51 +41,250 @@ def create_post(post_in: PostCreate, author_id: str) -> dict:
     author_data = user_service.get_user_by_anonymous_id(author_id)
     if not author_data:
         raise ValueError("Author not found")
+    title, title_flags = moderation_service.filter_text(post_in.title)
+    content, content_flags = moderation_service.filter_text(post_in.content)
+    verdict = moderation_service.check_duplicates(moderation_service.post_key(post_id), f"{title}\n{content}", author_id)
+    moderation_flags = list(dict.fromkeys(title_flags + content_flags + verdict['flags']))
 
     post_data = {
         "post_id": post_id,
-        "title": post_in.title,
-        "content": post_in.content,
+        "title": title,
+        "content": content,
         "author_id": author_id,
         "author_username": author_data.get('username'),
         "author_avatar_url": author_data.get('avatar_url'),
+        "topics": post_in.topics,
         "upvotes": 0,
         "downvotes": 0,
         "comment_count": 0,
+        counter_service.SHARDED_FLAG: True,
+        **ranking.post_scores(0, 0),
         "is_active": True,
         "is_edited": False,
         "created_at": firestore.SERVER_TIMESTAMP,
         "updated_at": firestore.SERVER_TIMESTAMP,
     }
+    if moderation_flags:
+        post_data['moderation_flags'] = moderation_flags
     
     doc_ref = posts_collection.document(post_id)
-    doc_ref.set(post_data)
+    batch = firestore.client().batch()
+    # create() fails instead of overwriting if the ID is somehow taken.
+    batch.create(doc_ref, post_data)
+    topic_service.record_post_counts(batch, Counter(post_in.topics))
+    try:
+        write_results = batch.commit()
+    except Exception:
+        moderation_service.forget_post(post_id)
+        raise
+    invalidate_feed_cache()
+    created_post = _format_post(resolve_server_timestamps(post_data, write_results[0].update_time))
+    search_service.index_post(created_post)
+    related_service.index_post(created_post)
+    return created_post
 
-    # Retrieve the document to get server-generated timestamps
-    created_doc = doc_ref.get()
-    if not created_doc.exists:
-        raise ValueError("Failed to create post")
+def get_post(post_id: str) -> Optional[dict]:
+    """
+    Retrieves a post document by its ID, with exact (shard-aggregated) counters.
+    """
+    post_data = counter_service.get_with_counters(get_posts_collection().document(post_id), counter_service.POST_COUNTER_FIELDS)
+    return _format_post(post_data) if post_data else None
 
-    return _format_post(created_doc.to_dict())
+def post_exists(post_id: str) -> bool:
+    """
+    Checks that a post exists, reading a single field of it.
+    """
+    return get_posts_collection().document(post_id).get(field_paths=['post_id']).exists
 
-def get_post(post_id: str) -> Optional[dict]:
+# Ranked feeds order active posts by a score precomputed on the post (see app/core/ranking.py)
+# and need the (is_active, <score> DESC) composite indexes in firestore.indexes.json.
+SORT_FIELDS = {
+    PostSortEnum.HOT: ranking.HOT_SCORE_FIELD,
+    PostSortEnum.TOP: ranking.TOP_SCORE_FIELD,
+    PostSortEnum.NEW: 'created_at',
+}
+
+# The first FEED_CACHE_PAGES pages of every feed are served from memory. Pages are keyed by
+# (sort, topic, limit, cursor); a cursor is only cacheable once a cached page has handed it out,
+# which keeps deep pagination out of the cache. Concurrent misses on a page share one
+# query, and local writes patch or drop the cached pages (see invalidate_feed_cache and
+# _patch_cached_post).
+feed_cache = TTLCache(maxsize=256, ttl=settings.FEED_CACHE_TTL_SECONDS)
+_feed_page_numbers = TTLCache(maxsize=1024, ttl=settings.FEED_CACHE_TTL_SECONDS)
+_feed_loads = SingleFlight()
+# Bumped by every invalidation so a query that started before it doesn't cache stale posts.
+_feed_generation = 0
+
+def invalidate_feed_cache() -> None:
     """
-    Retrieves a post document by its ID.
+    Drops every cached feed page. Call after writes that add, remove or reorder posts.
     """
+    global _feed_generation
+    _feed_generation += 1
+    feed_cache.clear()
+    _feed_page_numbers.clear()
+
+def get_feed_cache_stats() -> dict:
+    """
+    Returns hit/miss counters of the feed cache and how many misses were coalesced.
+    """
+    return {"enabled": settings.FEED_CACHE_ENABLED, "coalesced": _feed_loads.coalesced, **feed_cache.stats()}
+
+def _patch_cached_post(post: dict) -> None:
+    """
+    Updates a post in place wherever it appears in the cached feed pages.
+    """
+    post_id = post.get('anonymous_post_id')
+    for _, (items, _) in feed_cache.items():
+        for cached_post in items:
+            if cached_post.get('anonymous_post_id') == post_id:
+                cached_post.update({key: value for key, value in post.items() if key != 'author'})
+
+def _load_feed_page(sort: PostSortEnum, topic: Optional[str], limit: int, cursor: Optional[str]) -> Page:
+    generation = _feed_generation
+    page = _query_posts(limit, cursor, 0, sort, topic)
+    if generation == _feed_generation:
+        feed_cache.set((sort, topic, limit, cursor), page)
+    return page
+
+def warm_feed_cache(limit: int = 100) -> None:
+    """
+    Loads the first page of every feed (at the endpoint's default page size) into the cache.
+    """
+    if not settings.FEED_CACHE_ENABLED:
+        return
+    for sort in PostSortEnum:
+        try:
+            get_posts(limit=limit, sort=sort)
+        except Exception as e:
+            print(f"Failed to warm the '{sort.value}' feed cache: {e}")
+
+def get_posts(
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    skip: int = 0,
+    sort: PostSortEnum = PostSortEnum.NEW,
+    topic: Optional[str] = None,
+) -> Page:
+    """
+    Retrieves a page of posts in `sort` order (newest first by default) and the cursor for the next page.
+    With `topic`, only that topic's posts (an indexed array_contains query).
+    `skip` is the deprecated offset paging; it is ignored when a cursor is given.
+    The first FEED_CACHE_PAGES pages are served from the feed cache.
+    """
+    page_number = None
+    if settings.FEED_CACHE_ENABLED and not (skip and not cursor):
+        page_number = 1 if cursor is None else _feed_page_numbers.get((sort, topic, limit, cursor))
+    if page_number is None:
+        return _query_posts(limit, cursor, skip, sort, topic)
+
+    key = (sort, topic, limit, cursor)
+    page = feed_cache.get(key)
+    if page is None:
+        page = _feed_loads.do(key, _load_feed_page, sort, topic, limit, cursor)
+    items, next_page_cursor = page
+    if next_page_cursor and page_number < settings.FEED_CACHE_PAGES:
+        _feed_page_numbers.set((sort, topic, limit, next_page_cursor), page_number + 1)
+    # Callers may annotate the posts, so hand out copies of the cached ones.
+    return [dict(post) for post in items], next_page_cursor
+
+def get_my_votes(post_ids: List[str], user_id: str) -> Dict[str, str]:
+    """
+    Returns the user's vote type per post ID for the given posts, with one batched read
+    of their votes/{user_id} documents. Posts the user hasn't voted on are absent.
+    """
+    if not post_ids:
+        return {}
     posts_collection = get_posts_collection()
-    doc_ref = posts_collection.document(post_id)
-    doc = doc_ref.get()
-    if doc.exists:
-        return _format_post(doc.to_dict())
-    return None
+    vote_refs = [posts_collection.document(post_id).collection('votes').document(user_id) for post_id in post_ids]
+    return {
+        doc.reference.parent.parent.id: doc.get('vote_type')
+        for doc in firestore.client().get_all(vote_refs)
+        if doc.exists
+    }
 
-def get_posts(skip: int = 0, limit: int = 100) -> List[dict]:
+def get_posts_for_viewer(
+    viewer_id: str,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    skip: int = 0,
+    sort: PostSortEnum = PostSortEnum.NEW,
+    topic: Optional[str] = None,
+) -> Page:
     """
-    Retrieves a list of posts with pagination.
+    get_posts for a signed-in user: drops posts by authors the viewer muted or blocked
+    (reading ahead so the page stays full) and sets `my_vote` on every post.
     """
+    hidden_author_ids = user_relationship_service.get_hidden_author_ids(viewer_id)
+    if hidden_author_ids:
+        sort_field = SORT_FIELDS[sort]
+        posts, next_page_cursor = pagination.fill_page(
+            lambda page_cursor, page_skip: get_posts(limit, page_cursor, page_skip, sort, topic),
+            lambda post: post['author']['anonymous_id'] not in hidden_author_ids,
+            limit,
+            lambda post: pagination.encode_cursor({sort_field: post.get(sort_field), '__name__': post['anonymous_post_id']}),
+            cursor=cursor,
+            skip=skip,
+        )
+    else:
+        posts, next_page_cursor = get_posts(limit, cursor, skip, sort, topic)
+
+    my_votes = get_my_votes([post['anonymous_post_id'] for post in posts], viewer_id)
+    for post in posts:
+        post['my_vote'] = my_votes.get(post['anonymous_post_id'])
+    return posts, next_page_cursor
+
+def _query_posts(limit: int, cursor: Optional[str], skip: int, sort: PostSortEnum, topic: Optional[str] = None) -> Page:
+    sort_field = SORT_FIELDS[sort]
+    query = get_posts_collection()
+    if topic:
+        # Topic feeds use the (topics CONTAINS, ...) composite indexes.
+        query = query.where('topics', 'array_contains', topic)
+    if sort != PostSortEnum.NEW:
+        query = query.where('is_active', '==', True)
+    query = query.order_by(sort_field, direction='DESCENDING') \
+                 .order_by('__name__', direction='DESCENDING')
+    docs = list(pagination.apply_cursor(query, cursor, skip).limit(limit).stream())
+    return [_format_post(doc.to_dict()) for doc in docs], pagination.next_cursor(docs, limit, [sort_field])
+
+def get_posts_by_ids(post_ids: List[str]) -> List[dict]:
+    """
+    Retrieves posts by ID with one batched read, in the given order, with their
+    materialized counters. Missing and inactive posts are left out.
+    """
+    if not post_ids:
+        return []
     posts_collection = get_posts_collection()
-    docs = posts_collection.order_by('created_at', direction='DESCENDING').limit(limit).offset(skip).stream()
-    return [_format_post(doc.to_dict()) for doc in docs]
+    docs = firestore.client().get_all([posts_collection.document(post_id) for post_id in post_ids])
+    posts = {doc.id: doc.to_dict() for doc in docs if doc.exists}
+    return [
+        _format_post(posts[post_id]) for post_id in post_ids
+        if post_id in posts and posts[post_id].get('is_active', True)
+    ]
+
+def get_related_posts(post_id: str, limit: int = 5, viewer_id: Optional[str] = None) -> Optional[List[dict]]:
+    """
+    Retrieves the posts most similar to a post (see related_service), or None if the post
+    doesn't exist. For a signed-in viewer, posts by muted or blocked authors are left out
+    and `my_vote` is set.
+    """
+    source_post = {'post_id': post_id}
+    if related_service.related_index.vector_for(post_id) is None:
+        source_post = get_post(post_id)
+        if not source_post:
+            return None
+    related_ids = related_service.get_related_post_ids(source_post, limit * 2) # Room for filtering
+    posts, hidden_author_ids = concurrency.fan_out(
+        lambda: get_posts_by_ids(related_ids),
+        lambda: user_relationship_service.get_hidden_author_ids(viewer_id) if viewer_id else set(),
+    )
+    posts = [post for post in posts if post['author']['anonymous_id'] not in hidden_author_ids]
+    posts = posts[:limit]
+    if viewer_id:
+        my_votes = get_my_votes([post['anonymous_post_id'] for post in posts], viewer_id)
+        for post in posts:
+            post['my_vote'] = my_votes.get(post['anonymous_post_id'])
+    return posts
 
 def get_posts_by_author(author_id: str) -> List[dict]:
     """
@@ -99,39 +294,84 @@ def get_posts_by_author(author_id: str) -> List[dict]:
     docs = posts_collection.where('author_id', '==', author_id).stream()
     return [doc.to_dict() for doc in docs]
 
-def update_post(post_id: str, post_in: PostUpdate) -> Optional[dict]:
+def update_post(post_id: str, post_in: PostUpdate, current_post: Optional[dict] = None) -> Optional[dict]:
     """
     Updates a post document in Firestore.
+    Pass the formatted post the caller already read as `current_post` and the response is
+    built from it and the write result, without reading the post again.
     """
     posts_collection = get_posts_collection()
     doc_ref = posts_collection.document(post_id)
-    doc = doc_ref.get()
-    if not doc.exists:
-        return None
 
     update_data = post_in.model_dump(exclude_unset=True)
     update_data['updated_at'] = firestore.SERVER_TIMESTAMP
     if 'content' in update_data:
         update_data['is_edited'] = True
+    if update_data.get('topics') is None:
+        update_data.pop('topics', None)
+    moderation_flags = []
+    for field in ('title', 'content'):
+        if update_data.get(field):
+            update_data[field], flags = moderation_service.filter_text(update_data[field])
+            moderation_flags += flags
+    rescreened = bool(update_data.get('title') or update_data.get('content'))
+    if rescreened or 'topics' in update_data:
+        if current_post is None:
+            current_post = get_post(post_id)
+        if current_post is None:
+            return None
+    if rescreened:
+        # Screened like a new post, under the same key, so the edit replaces its old text.
+        title = update_data.get('title') or current_post.get('title') or ""
+        content = update_data.get('content') or current_post.get('content') or ""
+        verdict = moderation_service.check_duplicates(
+            moderation_service.post_key(post_id), f"{title}\n{content}", current_post['author']['anonymous_id']
+        )
+        moderation_flags += verdict['flags']
+    if moderation_flags:
+        update_data['moderation_flags'] = firestore.ArrayUnion(list(dict.fromkeys(moderation_flags)))
 
-    doc_ref.update(update_data)
-    return _format_post(doc_ref.get().to_dict())
+    batch = firestore.client().batch()
+    batch.update(doc_ref, update_data) # Fails the whole batch if the post doesn't exist
+    if 'topics' in update_data:
+        topic_counts = Counter(update_data['topics'])
+        topic_counts.subtract(Counter(current_post.get('topics') or []))
+        topic_service.record_post_counts(batch, topic_counts)
+    try:
+        write_results = batch.commit()
+    except NotFound:
+        moderation_service.forget_post(post_id)
+        return None
+    updated_post = get_post(post_id) if current_post is None else merge_update(current_post, update_data, write_results[0].update_time)
+    if 'is_active' in update_data or 'topics' in update_data:
+        invalidate_feed_cache() # The post enters or leaves feeds
+    elif updated_post:
+        _patch_cached_post(updated_post)
+    if updated_post:
+        search_service.index_post(updated_post)
+        if {'title', 'content', 'topics', 'is_active'} & update_data.keys():
+            related_service.index_post(updated_post)
+    return updated_post
 
-def delete_post(post_id: str) -> bool:
+def delete_post(post_id: str, current_post: Optional[dict] = None) -> bool:
     """
-    Deletes a post document and its subcollections from Firestore.
+    Deletes a post document and everything under it (comments and their votes, votes,
+    counter shards) plus the comments' mapping entries, with batched parallel writes.
+    Pass the post the caller already read as `current_post` to skip reading its topics.
     """
-    posts_collection = get_posts_collection()
-    post_ref = posts_collection.document(post_id)
-    
-    # Delete subcollections
-    comments_ref = post_ref.collection('comments')
-    votes_ref = post_ref.collection('votes')
-    delete_collection(comments_ref, 50)
-    delete_collection(votes_ref, 50)
-
-    # Delete the post document itself
-    post_ref.delete()
+    if current_post is None:
+        doc = get_posts_collection().document(post_id).get()
+        current_post = doc.to_dict() if doc.exists else {}
+    deletion_service.delete_post_tree(post_id)
+    topics = current_post.get('topics') or []
+    if topics:
+        batch = firestore.client().batch()
+        topic_service.record_post_counts(batch, Counter({topic: -count for topic, count in Counter(topics).items()}))
+        batch.commit()
+    invalidate_feed_cache()
+    search_service.remove_post(post_id)
+    related_service.remove_post(post_id)
+    moderation_service.forget_post(post_id)
     return True
 
 def vote_on_post(post_id: str, user_id: str, vote_type: VoteTypeEnum) -> Optional[dict]:
@@ -145,46 +385,35 @@ def vote_on_post(post_id: str, user_id: str, vote_type: VoteTypeEnum) -> Optiona
 
     @firestore.transactional
     def update_in_transaction(transaction, post_ref, vote_ref):
+        # The post is only read (to check it exists); the counters live in shards,
+        # so concurrent voters don't contend on the post document.
         post_snapshot = post_ref.get(transaction=transaction)
         if not post_snapshot.exists:
             raise ValueError("Post not found")
 
         vote_snapshot = vote_ref.get(transaction=transaction)
+        existing_vote_type = vote_snapshot.get('vote_type') if vote_snapshot.exists else None
+        new_vote_type, deltas = counter_service.vote_counter_deltas(existing_vote_type, vote_type)
 
-        current_upvotes = post_snapshot.get('upvotes')
-        current_downvotes = post_snapshot.get('downvotes')
-
-        if vote_snapshot.exists:
-            existing_vote_type = vote_snapshot.get('vote_type')
-            if existing_vote_type == vote_type.value:
-                # Unvoting
-                transaction.delete(vote_ref)
-                if vote_type == VoteTypeEnum.UPVOTE:
-                    transaction.update(post_ref, {'upvotes': current_upvotes - 1})
-                else:
-                    transaction.update(post_ref, {'downvotes': current_downvotes - 1})
-            else:
-                # Changing vote
-                transaction.set(vote_ref, {'vote_type': vote_type.value})
-                if vote_type == VoteTypeEnum.UPVOTE: # Was downvote, now upvote
-                    transaction.update(post_ref, {
-                        'upvotes': current_upvotes + 1,
-                        'downvotes': current_downvotes - 1
-                    })
-                else: # Was upvote, now downvote
-                    transaction.update(post_ref, {
-                        'upvotes': current_upvotes - 1,
-                        'downvotes': current_downvotes + 1
-                    })
+        if new_vote_type is None:
+            transaction.delete(vote_ref)
         else:
-            # New vote
-            transaction.set(vote_ref, {'vote_type': vote_type.value})
-            if vote_type == VoteTypeEnum.UPVOTE:
-                transaction.update(post_ref, {'upvotes': current_upvotes + 1})
-            else:
-                transaction.update(post_ref, {'downvotes': current_downvotes + 1})
+            # voter_id lets account deletion find the user's votes (collection group query).
+            transaction.set(vote_ref, {'vote_type': new_vote_type, 'voter_id': user_id})
+        counter_service.increment_in_transaction(
+            transaction, post_ref, post_snapshot, deltas, counter_service.POST_COUNTER_FIELDS
+        )
+        post_data = post_snapshot.to_dict()
+        post_data[counter_service.SHARDED_FLAG] = True # Migrated by the increment if it wasn't
+        return post_data, new_vote_type
 
     transaction = db.transaction()
-    update_in_transaction(transaction, post_ref, vote_ref)
+    post_data, my_vote = update_in_transaction(transaction, post_ref, vote_ref)
 
-    return _format_post(post_ref.get().to_dict())
+    # The post comes from the transaction's snapshot; only the counters need a fresh read.
+    post_data.update(counter_service.aggregate(post_ref, post_data, counter_service.POST_COUNTER_FIELDS))
+    post = _format_post(post_data)
+    # Patch the new counts into cached pages; rank changes show up when the pages expire.
+    _patch_cached_post({key: post[key] for key in ('anonymous_post_id', *counter_service.POST_COUNTER_FIELDS)})
+    post['my_vote'] = my_vote
+    return post
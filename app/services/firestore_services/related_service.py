@@ -0,0 +1,96 @@
+import threading
+from typing import List, Optional
+from firebase_admin import firestore
+from app.core.config import settings
+from app.core.related_index import RelatedIndex, hash_features
+from app.core.search_index import tokenize
+
+# "Related posts" recommendations from an in-process TF-IDF index (app/core/related_index.py).
+#
+# At start the index is filled with the RELATED_INDEX_WARM_POSTS newest posts (one query
+# per instance), then kept current by post_service and deletion_service as posts are
+# created, edited and deleted, up to RELATED_INDEX_MAX_POSTS. Requests never scan the posts collection. A compactor
+# thread folds recent additions into the index's base matrix.
+
+# Shared topics count like a few shared words.
+TOPIC_FEATURE_WEIGHT = 3
+
+related_index = RelatedIndex(max_rows=settings.RELATED_INDEX_MAX_POSTS)
+
+_compactor_thread: Optional[threading.Thread] = None
+_compactor_stop = threading.Event()
+
+def _post_tokens(post: dict) -> List[str]:
+    tokens = tokenize(f"{post.get('title') or ''}\n{post.get('content') or ''}")
+    for topic in post.get('topics') or []:
+        tokens.extend([f"topic:{topic}"] * TOPIC_FEATURE_WEIGHT)
+    return tokens
+
+def index_post(post: dict) -> None:
+    """
+    Adds or refreshes a post (raw or formatted) in the index. Inactive posts are taken out.
+    """
+    if not settings.RELATED_POSTS_ENABLED:
+        return
+    post_id = post.get('anonymous_post_id') or post.get('post_id')
+    if post.get('is_active', True):
+        related_index.add(post_id, _post_tokens(post))
+    else:
+        related_index.remove(post_id)
+
+def remove_post(post_id: str) -> None:
+    related_index.remove(post_id)
+
+def get_related_post_ids(post: dict, limit: int) -> List[str]:
+    """
+    Returns the IDs of the posts most similar to `post`, best first. Posts outside the
+    index (e.g. older ones) are vectorized on the fly.
+    """
+    post_id = post.get('anonymous_post_id') or post.get('post_id')
+    vector = related_index.vector_for(post_id) or hash_features(_post_tokens(post))
+    return [key for key, _ in related_index.query(vector, k=limit, exclude=[post_id])]
+
+def build_related_index() -> int:
+    """
+    Fills the index with the RELATED_INDEX_WARM_POSTS newest posts and compacts it.
+    Returns the number of posts indexed.
+    """
+    warm_posts = min(settings.RELATED_INDEX_WARM_POSTS, settings.RELATED_INDEX_MAX_POSTS)
+    if not settings.RELATED_POSTS_ENABLED or warm_posts <= 0:
+        return 0
+    query = firestore.client().collection('posts') \
+        .order_by('created_at', direction='DESCENDING') \
+        .limit(warm_posts) \
+        .select(['post_id', 'title', 'content', 'topics', 'is_active'])
+    posts = [doc.to_dict() for doc in query.stream()]
+    for post in reversed(posts): # Oldest first, so eviction drops the oldest
+        if post.get('is_active', True):
+            related_index.add(post['post_id'], _post_tokens(post))
+    related_index.compact()
+    print(f"Related posts index built: {len(related_index)} posts.")
+    return len(related_index)
+
+def get_related_stats() -> dict:
+    return {"enabled": settings.RELATED_POSTS_ENABLED, **related_index.stats()}
+
+def _compactor_loop() -> None:
+    while not _compactor_stop.wait(settings.RELATED_COMPACT_INTERVAL_SECONDS):
+        try:
+            if related_index.needs_compaction(settings.RELATED_COMPACT_MAX_DELTA):
+                related_index.compact()
+        except Exception as e:
+            print(f"Failed to compact the related posts index: {e}")
+
+def start_related_index_compactor() -> None:
+    """
+    Starts the periodic compaction thread (idempotent).
+    """
+    global _compactor_thread
+    if not settings.RELATED_POSTS_ENABLED or (_compactor_thread is not None and _compactor_thread.is_alive()):
+        return
+    _compactor_stop.clear()
+    _compactor_thread = threading.Thread(target=_compactor_loop, name="related-index-compactor", daemon=True)
+    _compactor_thread.start()
+
+def stop_related_index_compactor() -> None:
+    _compactor_stop.set()
@@ -1,6 +1,8 @@
 import uuid
 from typing import List, Optional
 from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+from app.core.firestore_writes import merge_update
 from app.schemas.report import ReportCreate, ReportUpdate
 from app.schemas.enums import ReportStatusEnum
 
@@ -62,15 +64,13 @@ def get_reports(status: Optional[ReportStatusEnum] = None, limit: int = 100) ->
     docs = query.order_by('created_at', direction='DESCENDING').limit(limit).stream()
     return [doc.to_dict() for doc in docs]
 
-def update_report(report_id: str, report_in: ReportUpdate) -> Optional[dict]:
+def update_report(report_id: str, report_in: ReportUpdate, current_report: Optional[dict] = None) -> Optional[dict]:
     """
     Updates a report document (typically by an admin).
+    Pass the report the caller already read as `current_report` to skip the read-back.
     """
     reports_collection = get_reports_collection()
     doc_ref = reports_collection.document(report_id)
-    doc = doc_ref.get()
-    if not doc.exists:
-        return None
 
     update_data = report_in.model_dump(exclude_unset=True)
     
@@ -78,5 +78,10 @@ def update_report(report_id: str, report_in: ReportUpdate) -> Optional[dict]:
     if 'status' in update_data and update_data['status'] != ReportStatusEnum.PENDING.value:
         update_data['reviewed_at'] = firestore.SERVER_TIMESTAMP
 
-    doc_ref.update(update_data)
-    return doc_ref.get().to_dict()
+    try:
+        write_result = doc_ref.update(update_data) # Fails if the report doesn't exist
+    except NotFound:
+        return None
+    if current_report is None:
+        return get_report(report_id)
+    return merge_update(current_report, update_data, write_result.update_time)
@@ -0,0 +1,238 @@
+import os
+import threading
+from datetime import datetime
+from typing import List, Optional
+from firebase_admin import firestore
+from app.core import concurrency
+from app.core.config import settings
+from app.core.search_index import SearchIndex
+from app.schemas.enums import SearchTypeEnum
+from app.services.firestore_services import user_relationship_service
+
+# Full-text search over posts and comments, answered from an in-process index
+# (app/core/search_index.py). The index only ranks: hits are read back from Firestore in
+# one batched read, so results show current content and leave out anything deleted,
+# deactivated or (for a signed-in viewer) by muted or blocked authors.
+#
+# post_service and comment_service update the index as they create, edit and delete
+# content, and deletion_service does the same for account deletions. A persister thread
+# saves the index to SEARCH_INDEX_PATH, and instances load that file at start. Each
+# instance only sees its own writes, so content written elsewhere shows up after the next
+# rebuild (rebuild_search_index below, or app/scripts/rebuild_search_index.py).
+
+SNIPPET_LENGTH = 200
+
+search_index = SearchIndex()
+
+_persister_thread: Optional[threading.Thread] = None
+_persister_stop = threading.Event()
+
+def post_key(post_id: str) -> str:
+    return f"{SearchTypeEnum.POST.value}:{post_id}"
+
+def comment_key(post_id: str, comment_id: str) -> str:
+    # Comment keys start with their post's ID so a post's comments can be removed with it.
+    return f"{SearchTypeEnum.COMMENT.value}:{post_id}:{comment_id}"
+
+def _iso(value) -> Optional[str]:
+    return value.isoformat() if isinstance(value, datetime) else None
+
+def _author_username(doc: dict) -> Optional[str]:
+    # Accepts raw documents and ones formatted for the Read schemas.
+    if isinstance(doc.get('author'), dict):
+        return doc['author'].get('username')
+    return doc.get('author_username')
+
+def _post_entry(post: dict):
+    post_id = post.get('anonymous_post_id') or post.get('post_id')
+    title = post.get('title') or ""
+    content = post.get('content') or ""
+    return post_key(post_id), f"{title}\n{content}", {
+        "type": SearchTypeEnum.POST.value,
+        "id": post_id,
+        "post_id": post_id,
+        "title": title,
+        "snippet": content[:SNIPPET_LENGTH],
+        "author_username": _author_username(post),
+        "topics": post.get('topics') or [],
+        "created_at": _iso(post.get('created_at')),
+    }
+
+def _comment_entry(comment: dict):
+    comment_id = comment.get('anonymous_comment_id') or comment.get('comment_id')
+    post_id = comment.get('post_id')
+    content = comment.get('content') or ""
+    return comment_key(post_id, comment_id), content, {
+        "type": SearchTypeEnum.COMMENT.value,
+        "id": comment_id,
+        "post_id": post_id,
+        "snippet": content[:SNIPPET_LENGTH],
+        "author_username": _author_username(comment),
+        "created_at": _iso(comment.get('created_at')),
+    }
+
+def index_post(post: dict) -> None:
+    """
+    Adds or refreshes a post in the search index. Inactive posts are taken out of it,
+    with their comments.
+    """
+    if not settings.SEARCH_ENABLED:
+        return
+    key, text, payload = _post_entry(post)
+    if post.get('is_active', True):
+        search_index.add(key, text, payload)
+    else:
+        remove_post(payload['post_id'])
+
+def index_comment(comment: dict) -> None:
+    """
+    Adds or refreshes a comment in the search index.
+    """
+    if settings.SEARCH_ENABLED:
+        search_index.add(*_comment_entry(comment))
+
+def remove_post(post_id: str) -> None:
+    """
+    Removes a post and all of its comments from the search index.
+    """
+    search_index.remove(post_key(post_id))
+    search_index.remove_prefix(comment_key(post_id, ""))
+
+def remove_comment(post_id: str, comment_id: str) -> None:
+    search_index.remove(comment_key(post_id, comment_id))
+
+def search(query: str, doc_type: Optional[SearchTypeEnum] = None, limit: int = 20,
+           viewer_id: Optional[str] = None) -> List[dict]:
+    """
+    Ranks posts and comments (or only one of them) against `query`. The last word of the
+    query also matches as a prefix, for search-as-you-type. For a signed-in viewer, content
+    by muted or blocked authors is left out.
+    """
+    key_prefix = f"{doc_type.value}:" if doc_type else ""
+    hits = search_index.search(query, limit=limit * 2, key_prefix=key_prefix) # Room for filtering
+    if not hits:
+        return []
+    docs, hidden_author_ids = concurrency.fan_out(
+        lambda: _read_hits(hits),
+        lambda: user_relationship_service.get_hidden_author_ids(viewer_id) if viewer_id else set(),
+    )
+
+    results = []
+    for key, score, payload in hits:
+        post = docs.get(post_key(payload['post_id']))
+        doc = docs.get(key)
+        if post is None or doc is None or not post.get('is_active', True):
+            continue
+        if doc.get('author_id') in hidden_author_ids:
+            continue
+        is_post = payload['type'] == SearchTypeEnum.POST.value
+        results.append({**(_post_entry(doc) if is_post else _comment_entry(doc))[2], "score": score})
+        if len(results) == limit:
+            break
+    return results
+
+def _read_hits(hits) -> dict:
+    """
+    Reads the documents of search hits, and the posts of comment hits, with one get_all.
+    Returns the existing ones by index key; the others are dropped from the index.
+    """
+    db = firestore.client()
+    posts_collection = db.collection('posts')
+    refs = {}
+    for key, _, payload in hits:
+        post_ref = posts_collection.document(payload['post_id'])
+        refs[post_key(payload['post_id'])] = post_ref
+        if payload['type'] == SearchTypeEnum.COMMENT.value:
+            refs[key] = post_ref.collection('comments').document(payload['id'])
+    keys_by_path = {ref.path: key for key, ref in refs.items()}
+    docs = {}
+    for doc in db.get_all(list(refs.values())):
+        key = keys_by_path[doc.reference.path]
+        if doc.exists:
+            docs[key] = doc.to_dict()
+        elif doc.reference.parent.id == 'posts':
+            remove_post(doc.id) # Deleted on another instance
+        else:
+            search_index.remove(key)
+    return docs
+
+def get_search_stats() -> dict:
+    return {"enabled": settings.SEARCH_ENABLED, "path": settings.SEARCH_INDEX_PATH, **search_index.stats()}
+
+def rebuild_search_index(path: Optional[str] = None) -> int:
+    """
+    Builds a fresh index from every post and comment in Firestore, saves it to `path`
+    (SEARCH_INDEX_PATH by default) and swaps it in. Returns the number of documents indexed.
+    Local writes made while the rebuild streams are only kept if the stream saw them.
+    """
+    path = path or settings.SEARCH_INDEX_PATH
+    db = firestore.client()
+    fresh_index = SearchIndex()
+    post_fields = ['post_id', 'title', 'content', 'author_username', 'topics', 'is_active', 'created_at']
+    active_post_ids = set()
+    for doc in db.collection('posts').select(post_fields).stream():
+        post = doc.to_dict()
+        if post.get('is_active', True):
+            fresh_index.add(*_post_entry(post))
+            active_post_ids.add(doc.id)
+    comment_fields = ['comment_id', 'post_id', 'content', 'author_username', 'created_at']
+    for doc in db.collection_group('comments').select(comment_fields).stream():
+        # Comments of deactivated posts stay out, like the posts.
+        if doc.reference.parent.parent.id in active_post_ids:
+            fresh_index.add(*_comment_entry(doc.to_dict()))
+    fresh_index.save(path)
+    search_index.load(path)
+    print(f"Search index rebuilt: {len(search_index)} documents written to {path}.")
+    return len(search_index)
+
+def save_search_index() -> bool:
+    """
+    Saves the index if it changed since the last save.
+    """
+    if not search_index.dirty:
+        return False
+    search_index.save(settings.SEARCH_INDEX_PATH)
+    return True
+
+def load_search_index() -> None:
+    """
+    Loads the saved index at start, or builds it if there is none (SEARCH_REBUILD_IF_MISSING).
+    """
+    if not settings.SEARCH_ENABLED:
+        return
+    path = settings.SEARCH_INDEX_PATH
+    if os.path.exists(path):
+        try:
+            search_index.load(path)
+            print(f"Loaded search index from {path}: {len(search_index)} documents.")
+            return
+        except (OSError, ValueError) as e:
+            print(f"Could not load search index from {path}: {e}")
+    if settings.SEARCH_REBUILD_IF_MISSING:
+        rebuild_search_index(path)
+
+def _persister_loop() -> None:
+    while not _persister_stop.wait(settings.SEARCH_INDEX_SAVE_INTERVAL_SECONDS):
+        try:
+            save_search_index()
+        except Exception as e:
+            print(f"Failed to save search index: {e}")
+
+def start_search_index_persister() -> None:
+    """
+    Starts the thread that periodically saves the index (idempotent).
+    """
+    global _persister_thread
+    if not settings.SEARCH_ENABLED or (_persister_thread is not None and _persister_thread.is_alive()):
+        return
+    _persister_stop.clear()
+    _persister_thread = threading.Thread(target=_persister_loop, name="search-index-persister", daemon=True)
+    _persister_thread.start()
+
+def stop_search_index_persister() -> None:
+    """
+    Stops the persister thread and saves the index one last time.
+    """
+    _persister_stop.set()
+    if settings.SEARCH_ENABLED:
+        save_search_index()
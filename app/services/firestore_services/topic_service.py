@@ -0,0 +1,67 @@
+from collections import Counter
+from typing import Iterable, List, Optional
+from firebase_admin import firestore
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.schemas.enums import TopicSortEnum
+
+# Topics group posts into community threads. A post lists its topic slugs in a 'topics'
+# array (topic feeds are array_contains queries on it, see post_service.get_posts), and each
+# topic has a 'topics/{slug}' document with a post count and the time of its latest post or
+# comment. Those fields are maintained incrementally by the writes that change them, in the
+# same batch, so the directory never has to count posts.
+
+# The topic directory changes slowly and is read on every app start.
+topic_directory_cache = TTLCache(maxsize=64, ttl=settings.TOPIC_DIRECTORY_CACHE_TTL_SECONDS)
+
+TOPIC_SORT_FIELDS = {
+    TopicSortEnum.ACTIVE: 'last_activity_at',
+    TopicSortEnum.POPULAR: 'post_count',
+}
+
+def get_topics_collection():
+    """Returns the 'topics' collection reference, ensuring the client is requested after initialization."""
+    return firestore.client().collection('topics')
+
+def record_post_counts(writer, topic_counts: Counter) -> None:
+    """
+    Adds topic post-count changes to a batch (or BulkWriter). Topics gaining posts also
+    get their activity time bumped; topic documents are created on first use.
+    """
+    topics_collection = get_topics_collection()
+    for slug, delta in topic_counts.items():
+        if not delta:
+            continue
+        update_data = {"slug": slug, "post_count": firestore.Increment(delta)}
+        if delta > 0:
+            update_data["last_activity_at"] = firestore.SERVER_TIMESTAMP
+        writer.set(topics_collection.document(slug), update_data, merge=True)
+
+def record_activity(writer, topics: Iterable[str]) -> None:
+    """
+    Adds an activity-time bump (e.g. for a new comment) for each topic to a batch.
+    """
+    topics_collection = get_topics_collection()
+    for slug in topics:
+        writer.set(topics_collection.document(slug), {"slug": slug, "last_activity_at": firestore.SERVER_TIMESTAMP}, merge=True)
+
+def get_topic(slug: str) -> Optional[dict]:
+    """
+    Retrieves a topic document by its slug.
+    """
+    doc = get_topics_collection().document(slug).get()
+    if doc.exists:
+        return doc.to_dict()
+    return None
+
+def get_topics(sort: TopicSortEnum = TopicSortEnum.ACTIVE, limit: int = 50) -> List[dict]:
+    """
+    Retrieves the topic directory, served from a short-lived per-instance cache.
+    """
+    key = (sort, limit)
+    topics = topic_directory_cache.get(key)
+    if topics is None:
+        query = get_topics_collection().order_by(TOPIC_SORT_FIELDS[sort], direction='DESCENDING')
+        topics = [doc.to_dict() for doc in query.limit(limit).stream()]
+        topic_directory_cache.set(key, topics)
+    return [dict(topic) for topic in topics]
@@ -1,13 +1,109 @@
-from typing import List, Optional
+from typing import FrozenSet, Iterable, List, NamedTuple, Optional, Set
 from firebase_admin import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter, Or
+from app.core.cache import SingleFlight, TTLCache
+from app.core.config import settings
 from app.schemas.enums import RelationshipTypeEnum
 
 # This service replaces the functionality of crud/crud_user_relationship.py for a Firestore database.
 
+# Block and mute checks run on every feed page, chat initiation and websocket message, so
+# each user's relationships, in both directions, are loaded with one query and cached per
+# instance. create_relationship/remove_relationship invalidate both users' entries here;
+# other instances see the change after RELATIONSHIP_CACHE_TTL_SECONDS.
+
+class RelationshipSets(NamedTuple):
+    """The user IDs a user is related to, by type and direction."""
+    blocking: FrozenSet[str] # Blocked by the user
+    blocked_by: FrozenSet[str] # Blocking the user
+    muting: FrozenSet[str] # Muted by the user
+    muted_by: FrozenSet[str] # Muting the user
+
+relationship_cache = TTLCache(maxsize=settings.RELATIONSHIP_CACHE_MAX_SIZE, ttl=settings.RELATIONSHIP_CACHE_TTL_SECONDS)
+_relationship_loads = SingleFlight()
+# Bumped by every invalidation; a load that overlapped one doesn't cache its result.
+_generation = 0
+
 def get_relationships_collection():
     """Returns the 'user_relationships' collection reference, ensuring the client is requested after initialization."""
     return firestore.client().collection('user_relationships')
 
+def relationships_query(collection, user_id: str):
+    """
+    The query for every relationship the user is on either side of.
+    """
+    return collection.where(filter=Or([FieldFilter('actor_id', '==', user_id), FieldFilter('target_id', '==', user_id)]))
+
+def build_relationship_sets(user_id: str, relationships: Iterable[dict]) -> RelationshipSets:
+    sets = {field: set() for field in RelationshipSets._fields}
+    for relationship in relationships:
+        outgoing = relationship.get('actor_id') == user_id
+        if relationship.get('relationship_type') == RelationshipTypeEnum.BLOCK.value:
+            field = 'blocking' if outgoing else 'blocked_by'
+        else:
+            field = 'muting' if outgoing else 'muted_by'
+        sets[field].add(relationship.get('target_id') if outgoing else relationship.get('actor_id'))
+    return RelationshipSets(**{field: frozenset(ids) for field, ids in sets.items()})
+
+def cache_relationship_sets(user_id: str, sets: RelationshipSets, generation: int) -> None:
+    """
+    Caches sets loaded since `generation` (see relationship_cache_generation), unless a
+    relationship changed meanwhile.
+    """
+    if settings.RELATIONSHIP_CACHE_ENABLED and generation == _generation:
+        relationship_cache.set(user_id, sets)
+
+def relationship_cache_generation() -> int:
+    return _generation
+
+def invalidate_relationship_sets(*user_ids: str) -> None:
+    global _generation
+    _generation += 1
+    for user_id in user_ids:
+        relationship_cache.invalidate(user_id)
+
+def _load_relationship_sets(user_id: str) -> RelationshipSets:
+    generation = _generation
+    docs = relationships_query(get_relationships_collection(), user_id).stream()
+    sets = build_relationship_sets(user_id, (doc.to_dict() for doc in docs))
+    cache_relationship_sets(user_id, sets, generation)
+    return sets
+
+def get_relationship_sets(user_id: str) -> RelationshipSets:
+    """
+    Returns whom the user blocked and muted and who blocked and muted them.
+    A cache hit costs no reads; a miss costs one query.
+    """
+    if settings.RELATIONSHIP_CACHE_ENABLED:
+        cached = relationship_cache.get(user_id)
+        if cached is not None:
+            return cached
+    return _relationship_loads.do(user_id, _load_relationship_sets, user_id)
+
+def is_blocked(user_id: str, other_user_id: str) -> bool:
+    """
+    Whether either user blocked the other.
+    """
+    sets = get_relationship_sets(user_id)
+    return other_user_id in sets.blocking or other_user_id in sets.blocked_by
+
+def has_block_between(user_id: str, other_user_id: str) -> bool:
+    """
+    Whether either user blocked the other, read from the two block documents themselves
+    rather than the relationship cache, for checks that must see a block made a moment
+    ago on another instance (e.g. before opening a chat).
+    """
+    relationships_collection = get_relationships_collection()
+    block = RelationshipTypeEnum.BLOCK.value
+    refs = [
+        relationships_collection.document(f"{user_id}_{block}_{other_user_id}"),
+        relationships_collection.document(f"{other_user_id}_{block}_{user_id}"),
+    ]
+    return any(doc.exists for doc in firestore.client().get_all(refs, field_paths=['actor_id']))
+
+def get_relationship_cache_stats() -> dict:
+    return {"enabled": settings.RELATIONSHIP_CACHE_ENABLED, "coalesced": _relationship_loads.coalesced, **relationship_cache.stats()}
+
 def create_relationship(actor_id: str, target_id: str, relationship_type: RelationshipTypeEnum) -> dict:
     """
     Creates a new relationship document (e.g., mute, block).
@@ -32,6 +128,7 @@ def create_relationship(actor_id: str, target_id: str, relationship_type: Relati
         "created_at": firestore.SERVER_TIMESTAMP,
     }
     doc_ref.set(relationship_data)
+    invalidate_relationship_sets(actor_id, target_id)
     return relationship_data
 
 def get_relationship(actor_id: str, target_id: str, relationship_type: RelationshipTypeEnum) -> Optional[dict]:
@@ -56,6 +153,7 @@ def remove_relationship(actor_id: str, target_id: str, relationship_type: Relati
     doc = doc_ref.get()
     if doc.exists:
         doc_ref.delete()
+        invalidate_relationship_sets(actor_id, target_id)
         return True
     return False
 
@@ -74,5 +172,20 @@ def get_blocked_user_ids(user_id: str) -> List[str]:
     """
     Gets a list of user IDs that the specified user has blocked.
     """
-    blocked_relationships = get_relationships_by_actor(user_id, RelationshipTypeEnum.BLOCK)
-    return [rel['target_id'] for rel in blocked_relationships]
+    return list(get_relationship_sets(user_id).blocking)
+
+def get_hidden_author_ids(viewer_id: str) -> Set[str]:
+    """
+    Returns the IDs of users the viewer has muted or blocked.
+    Load it once per request and filter listings against it.
+    """
+    sets = get_relationship_sets(viewer_id)
+    return set(sets.blocking | sets.muting)
+
+def get_block_related_user_ids(user_id: str) -> Set[str]:
+    """
+    Returns the IDs of users the user has blocked or was blocked by.
+    Neither side of a block sees the other in user listings.
+    """
+    sets = get_relationship_sets(user_id)
+    return set(sets.blocking | sets.blocked_by)
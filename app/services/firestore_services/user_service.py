@@ -1,65 +1,306 @@
+import bisect
 import uuid
 import random
+import unicodedata
+from datetime import datetime, timezone
 from firebase_admin import firestore
+from google.api_core.exceptions import Conflict, NotFound
 from app.schemas.user import UserCreate, UserUpdate
 from app.core.config import settings
-from typing import List, Optional
-from app.services.firestore_services import post_service, comment_service
+from app.core import pagination
+from app.core.cache import TTLCache
+from app.core.firestore_writes import merge_update
+from app.core.pagination import Page
+from app.core.security import token_denylist
+from typing import Dict, List, Optional
+from app.services.firestore_services import author_fanout_service, deletion_service, moderation_service, user_relationship_service
 
 # This service replaces the functionality of crud/crud_user.py for a Firestore database.
 
+# User documents keyed by anonymous_id. Every authenticated request resolves its user
+# through get_user_by_anonymous_id, so this saves one Firestore read per API call.
+# Writes on this instance invalidate explicitly; other instances rely on the TTL.
+user_cache = TTLCache(maxsize=settings.USER_CACHE_MAX_SIZE, ttl=settings.USER_CACHE_TTL_SECONDS)
+
 def get_users_collection():
     """Returns the 'users' collection reference, ensuring the client is requested after initialization."""
     return firestore.client().collection('users')
 
+# Username uniqueness is enforced by a reservation index: usernames/{username_key} holds the
+# anonymous_id of the user owning that name. A new user and its reservation are committed
+# together, and the commit fails if the reservation already exists, so concurrent signups
+# can't end up with the same name. Renames and deletions move or release the reservation
+# in the same transaction as the user document.
+# app/scripts/backfill_username_reservations.py reserves the names of existing users.
+
+# Generated names are tried in rounds of GENERATED_USERNAME_CANDIDATES random candidates,
+# checked with one batch read. A round that finds all of them taken moves on to longer
+# random segments.
+GENERATED_USERNAME_CANDIDATES = 8
+GENERATED_USERNAME_SEGMENT_LENGTHS = (4, 6, 8, 12)
+
+def get_usernames_collection():
+    """Returns the 'usernames' reservation collection reference."""
+    return firestore.client().collection('usernames')
+
+def normalize_username(username: str) -> str:
+    """
+    Case-folded form of a username, stored as 'username_normalized' for prefix search.
+    """
+    return unicodedata.normalize("NFKC", username).casefold().strip()
+
+def username_key(username: str) -> str:
+    """
+    Returns the reservation document ID of a username. Names that only differ by case or
+    Unicode compatibility forms share a key, so only one of them can be taken.
+    """
+    key = normalize_username(username)
+    # Document IDs can't contain '/', be '.' or '..', or have the form '__id__'.
+    # A leading '%' can't come from an escape, so it keeps those keys distinct.
+    key = key.replace("%", "%25").replace("/", "%2F")
+    if not key.strip(".") or (key.startswith("__") and key.endswith("__")):
+        key = "%" + key
+    return key
+
+def username_reservation_data(anonymous_id: str, username: str) -> dict:
+    return {"anonymous_id": anonymous_id, "username": username, "created_at": firestore.SERVER_TIMESTAMP}
+
+def invalidate_cached_user(anonymous_id: str) -> None:
+    """
+    Drops a user from the per-instance cache. Call after any write to the user document.
+    """
+    user_cache.invalidate(anonymous_id)
+
+def get_user_cache_stats() -> dict:
+    """
+    Returns hit/miss counters and size of the per-instance user cache.
+    """
+    return {"enabled": settings.USER_CACHE_ENABLED, **user_cache.stats()}
+
+# Username prefix searches: normalized prefix -> (sorted username_normalized values, users,
+# whether that is every user with the prefix). See search_users.
+user_search_cache = TTLCache(maxsize=settings.USER_SEARCH_CACHE_MAX_PREFIXES, ttl=settings.USER_SEARCH_CACHE_TTL_SECONDS)
+
+def invalidate_user_search_cache(username: Optional[str]) -> None:
+    """
+    Drops the cached searches whose results may include `username`.
+    """
+    if not username:
+        return
+    normalized = normalize_username(username)
+    for length in range(1, len(normalized) + 1):
+        user_search_cache.invalidate(normalized[:length])
+
+# Fields embedded in stateless access tokens (see security.build_access_token_claims).
+TOKEN_CLAIM_FIELDS = ('username', 'avatar_url', 'is_active')
+# Fields copied onto the user's posts and comments at write time.
+DENORMALIZED_AUTHOR_FIELDS = ('username', 'avatar_url')
+
 # --- Service Functions ---
 
 def get_user_by_anonymous_id(anonymous_id: str) -> Optional[dict]:
     """
     Retrieves a user document by its anonymous_id (which is the document ID).
+    Served from the per-instance user cache when USER_CACHE_ENABLED is set.
     """
+    if settings.USER_CACHE_ENABLED:
+        cached_user = user_cache.get(anonymous_id)
+        if cached_user is not None:
+            # Hand out a copy so callers can't mutate the cached entry.
+            return dict(cached_user)
+
     users_collection = get_users_collection()
     doc_ref = users_collection.document(anonymous_id)
     doc = doc_ref.get()
     if doc.exists:
-        return doc.to_dict()
+        user = doc.to_dict()
+        if settings.USER_CACHE_ENABLED:
+            user_cache.set(anonymous_id, user)
+            return dict(user)
+        return user
     return None
 
+def get_users_by_anonymous_ids(anonymous_ids: List[str]) -> Dict[str, dict]:
+    """
+    Retrieves many users at once, keyed by anonymous_id.
+    Cached users are served from memory; the rest are fetched with a single get_all batch read.
+    Missing users are simply absent from the result.
+    """
+    users: Dict[str, dict] = {}
+    to_fetch = []
+    for anonymous_id in dict.fromkeys(anonymous_ids): # Deduplicate, keep order
+        if not anonymous_id:
+            continue
+        cached_user = user_cache.get(anonymous_id) if settings.USER_CACHE_ENABLED else None
+        if cached_user is not None:
+            users[anonymous_id] = dict(cached_user)
+        else:
+            to_fetch.append(anonymous_id)
+
+    if to_fetch:
+        users_collection = get_users_collection()
+        doc_refs = [users_collection.document(anonymous_id) for anonymous_id in to_fetch]
+        for doc in firestore.client().get_all(doc_refs):
+            if not doc.exists:
+                continue
+            user = doc.to_dict()
+            if settings.USER_CACHE_ENABLED:
+                user_cache.set(doc.id, user)
+            users[doc.id] = dict(user)
+    return users
+
+def get_user_profiles(anonymous_ids: List[str]) -> List[dict]:
+    """
+    Loads users for a list of IDs with at most one get_all batch read (see
+    get_users_by_anonymous_ids), in the order of the IDs. Duplicates are returned once and
+    missing users are left out.
+    """
+    users = get_users_by_anonymous_ids(anonymous_ids)
+    return [users[anonymous_id] for anonymous_id in dict.fromkeys(anonymous_ids) if anonymous_id in users]
+
+def format_user_simple(anonymous_id: str, user: Optional[dict]) -> dict:
+    """
+    Formats a user for the UserSimple schema; deleted users show up as "Unknown".
+    """
+    user = user or {}
+    return {
+        "anonymous_id": anonymous_id,
+        "username": user.get('username') or "Unknown",
+        "avatar_url": user.get('avatar_url'),
+    }
+
 def get_user_by_username(username: str) -> Optional[dict]:
     """
-    Retrieves a user by their username.
+    Retrieves a user by their username (case-insensitively), through the reservation index.
     """
-    users_collection = get_users_collection()
-    docs = users_collection.where('username', '==', username).limit(1).stream()
-    for doc in docs:
-        return doc.to_dict()
+    reservation = get_usernames_collection().document(username_key(username)).get()
+    if not reservation.exists:
+        return None
+    return get_user_by_anonymous_id(reservation.get('anonymous_id'))
+
+# Upper bound of a prefix range: sorts after any string starting with the prefix.
+PREFIX_RANGE_END = "\uf8ff"
+
+def _user_search_cursor(user: dict) -> str:
+    return pagination.encode_cursor({'username_normalized': user['username_normalized'], '__name__': user['anonymous_id']})
+
+def _query_users_by_prefix(prefix: str, limit: int, cursor: Optional[str] = None) -> Page:
+    # A range on one field ordered by it (then by ID) is served by the single-field index.
+    query = get_users_collection() \
+        .where('username_normalized', '>=', prefix) \
+        .where('username_normalized', '<', prefix + PREFIX_RANGE_END) \
+        .order_by('username_normalized') \
+        .order_by('__name__')
+    docs = list(pagination.apply_cursor(query, cursor).limit(limit).stream())
+    return [doc.to_dict() for doc in docs], pagination.next_cursor(docs, limit, ['username_normalized'])
+
+def _cached_prefix_users(prefix: str) -> Optional[tuple]:
+    """
+    Returns (users with the prefix, in username order, whether that is all of them) from
+    the cache entry of the prefix or of a shorter prefix holding all of its users, or None.
+    """
+    for length in range(len(prefix), 0, -1):
+        entry = user_search_cache.get(prefix[:length])
+        if entry is None:
+            continue
+        names, users, complete = entry
+        start = bisect.bisect_left(names, prefix)
+        end = bisect.bisect_left(names, prefix + PREFIX_RANGE_END)
+        # Names are sorted, so an entry that goes on past the prefix's range holds all of
+        # its users even if it stops short of all of its own.
+        holds_all = complete or end < len(names)
+        if length < len(prefix) and not holds_all:
+            return None # Query the longer prefix, so its own entry gets cached
+        return users[start:end], holds_all
     return None
 
-def get_users(skip: int = 0, limit: int = 100) -> List[dict]:
+def search_users(prefix: str, limit: int = 20, cursor: Optional[str] = None, viewer_id: Optional[str] = None) -> Page:
     """
-    Retrieves a list of users with pagination.
+    Finds active users whose username starts with `prefix` (case-insensitively), in
+    username order, and returns a page of them with the cursor for the next page.
+    Users the viewer blocked or was blocked by are left out.
+    First pages come from the prefix cache when it can answer them; a miss reads
+    USER_SEARCH_CACHE_DEPTH users with one range query and caches them for the next keystrokes.
     """
-    users_collection = get_users_collection()
-    docs = users_collection.limit(limit).offset(skip).stream()
-    return [doc.to_dict() for doc in docs]
+    prefix = normalize_username(prefix)
+    if not prefix:
+        return [], None
+    hidden_user_ids = user_relationship_service.get_block_related_user_ids(viewer_id) if viewer_id else set()
+
+    def keep(user: dict) -> bool:
+        return user.get('is_active', True) and user['anonymous_id'] not in hidden_user_ids
+
+    if cursor is None and settings.USER_SEARCH_CACHE_ENABLED and limit <= settings.USER_SEARCH_CACHE_DEPTH:
+        cached = _cached_prefix_users(prefix)
+        if cached is None:
+            users, next_page_cursor = _query_users_by_prefix(prefix, settings.USER_SEARCH_CACHE_DEPTH)
+            complete = next_page_cursor is None
+            user_search_cache.set(prefix, ([user['username_normalized'] for user in users], users, complete))
+        else:
+            users, complete = cached
+        kept = [user for user in users if keep(user)]
+        if complete or len(kept) > limit:
+            page = [dict(user) for user in kept[:limit]]
+            return page, _user_search_cursor(page[-1]) if len(kept) > limit else None
+        # Too many filtered out of a partial entry: page through Firestore instead.
+
+    return pagination.fill_page(
+        lambda page_cursor, page_skip: _query_users_by_prefix(prefix, limit, page_cursor),
+        keep,
+        limit,
+        _user_search_cursor,
+        cursor=cursor,
+    )
+
+def get_user_search_cache_stats() -> dict:
+    return {"enabled": settings.USER_SEARCH_CACHE_ENABLED, **user_search_cache.stats()}
+
+def get_users(limit: int = 100, cursor: Optional[str] = None, skip: int = 0) -> Page:
+    """
+    Retrieves a page of users (in document ID order) and the cursor for the next page.
+    `skip` is the deprecated offset paging; it is ignored when a cursor is given.
+    """
+    query = get_users_collection().order_by('__name__')
+    docs = list(pagination.apply_cursor(query, cursor, skip).limit(limit).stream())
+    return [doc.to_dict() for doc in docs], pagination.next_cursor(docs, limit)
+
+def _generated_usernames():
+    """
+    Yields random 'Anonymous{XXXX}' names that weren't reserved when checked.
+    """
+    usernames_collection = get_usernames_collection()
+    for segment_length in GENERATED_USERNAME_SEGMENT_LENGTHS:
+        candidates = list(dict.fromkeys(
+            f"Anonymous{uuid.uuid4().hex[:segment_length].upper()}" for _ in range(GENERATED_USERNAME_CANDIDATES)
+        ))
+        refs = [usernames_collection.document(username_key(candidate)) for candidate in candidates]
+        taken = {doc.id for doc in firestore.client().get_all(refs) if doc.exists}
+        for candidate, ref in zip(candidates, refs):
+            if ref.id not in taken:
+                yield candidate
+
+def _commit_new_user(user_ref, user_data: dict) -> None:
+    """
+    Writes a new user document together with its username reservation.
+    Raises Conflict (and writes nothing) if the username is already reserved.
+    """
+    reservation_ref = get_usernames_collection().document(username_key(user_data['username']))
+    batch = firestore.client().batch()
+    batch.create(reservation_ref, username_reservation_data(user_data['anonymous_id'], user_data['username']))
+    batch.set(user_ref, user_data)
+    batch.commit()
 
 def create_user(user_in: UserCreate) -> dict:
     """
     Creates a new user document in Firestore.
+    Without a requested username, one is generated.
     """
     users_collection = get_users_collection()
     generated_anonymous_id = str(uuid.uuid4())
-    final_username = user_in.username
-
-    if not final_username:
-        while True:
-            segment = str(uuid.uuid4()).replace("-", "")[:4].upper()
-            candidate_username = f"Anonymous{segment}"
-            if not get_user_by_username(candidate_username):
-                final_username = candidate_username
-                break
-    elif get_user_by_username(final_username):
-        raise ValueError(f"Username '{final_username}' already exists.")
+    requested_username, moderation_flags = moderation_service.filter_text(user_in.username, allow_mask=False)
+    bio, bio_flags = moderation_service.filter_text(user_in.bio)
+    pronouns, pronouns_flags = moderation_service.filter_text(user_in.pronouns, allow_mask=False)
+    moderation_flags = list(dict.fromkeys(moderation_flags + bio_flags + pronouns_flags))
 
     avatar = user_in.avatar_url
     if not avatar and settings.DEFAULT_AVATAR_FILENAMES:
@@ -68,60 +309,190 @@ def create_user(user_in: UserCreate) -> dict:
 
     user_data = {
         "anonymous_id": generated_anonymous_id,
-        "username": final_username,
-        "bio": user_in.bio,
-        "pronouns": user_in.pronouns,
+        "username": requested_username,
+        "username_normalized": normalize_username(requested_username) if requested_username else None,
+        "bio": bio,
+        "pronouns": pronouns,
         "avatar_url": avatar,
         "chat_availability": user_in.chat_availability.value if user_in.chat_availability else 'open_to_chat',
         "is_active": True,
+        "claims_version": 1, # Bumped whenever a field embedded in stateless access tokens changes
+        "token_version": 0, # Bumped to revoke all refresh tokens of the user
         "created_at": firestore.SERVER_TIMESTAMP,
         "updated_at": firestore.SERVER_TIMESTAMP,
     }
+    if moderation_flags:
+        user_data['moderation_flags'] = moderation_flags
 
     user_ref = users_collection.document(generated_anonymous_id)
-    user_ref.set(user_data)
-    return user_data
+    if requested_username:
+        try:
+            _commit_new_user(user_ref, user_data)
+        except Conflict:
+            raise ValueError(f"Username '{requested_username}' already exists.")
+        invalidate_user_search_cache(requested_username)
+        return user_data
+
+    for candidate_username in _generated_usernames():
+        user_data['username'] = candidate_username
+        user_data['username_normalized'] = normalize_username(candidate_username)
+        try:
+            _commit_new_user(user_ref, user_data)
+            invalidate_user_search_cache(candidate_username)
+            return user_data
+        except Conflict:
+            continue # Reserved by someone else since it was checked
+    raise ValueError("Could not generate a unique username. Please try again.")
 
-def update_user(anonymous_id: str, user_in: UserUpdate) -> Optional[dict]:
+def _update_with_username(anonymous_id: str, update_data: dict) -> Optional[dict]:
+    """
+    Applies an update that sets the username, moving the user's reservation to the new name
+    in the same transaction. Returns the user document as it was before the update, or None
+    if the user doesn't exist. Raises ValueError if the name is reserved by another user.
+    """
+    db = firestore.client()
+    user_ref = get_users_collection().document(anonymous_id)
+    usernames_collection = get_usernames_collection()
+    new_reservation_ref = usernames_collection.document(username_key(update_data['username']))
+
+    @firestore.transactional
+    def update_in_transaction(transaction):
+        user_snapshot = user_ref.get(transaction=transaction)
+        if not user_snapshot.exists:
+            return None
+        user = user_snapshot.to_dict()
+        refs = [new_reservation_ref]
+        if user.get('username') and username_key(user['username']) != new_reservation_ref.id:
+            refs.append(usernames_collection.document(username_key(user['username'])))
+        reservations = [doc for doc in db.get_all(refs, transaction=transaction) if doc.exists]
+
+        for reservation in reservations:
+            owned = reservation.get('anonymous_id') == anonymous_id
+            if reservation.id == new_reservation_ref.id and not owned:
+                raise ValueError(f"Username '{update_data['username']}' already exists.")
+            if reservation.id != new_reservation_ref.id and owned:
+                transaction.delete(reservation.reference) # The previous name is released
+        transaction.set(new_reservation_ref, username_reservation_data(anonymous_id, update_data['username']))
+        transaction.update(user_ref, update_data)
+        return user
+
+    return update_in_transaction(db.transaction())
+
+def update_user(anonymous_id: str, user_in: UserUpdate, current_user: Optional[dict] = None) -> Optional[dict]:
     """
     Updates a user document in Firestore.
+    `current_user` is the user document the caller already holds (e.g. the authenticated
+    user); the result is built from it and the write result instead of re-reading.
     """
     users_collection = get_users_collection()
     doc_ref = users_collection.document(anonymous_id)
-    doc = doc_ref.get()
-    if not doc.exists:
+    if current_user is None or current_user.get('claims_only'):
+        # A user built from stateless token claims lacks most profile fields.
+        current_user = get_user_by_anonymous_id(anonymous_id)
+    if current_user is None:
         return None
 
     update_data = user_in.model_dump(exclude_unset=True)
     update_data['updated_at'] = firestore.SERVER_TIMESTAMP
+    moderation_flags = []
+    for field, allow_mask in (('username', False), ('bio', True), ('pronouns', False)):
+        if update_data.get(field):
+            update_data[field], flags = moderation_service.filter_text(update_data[field], allow_mask=allow_mask)
+            moderation_flags += flags
+    if moderation_flags:
+        update_data['moderation_flags'] = firestore.ArrayUnion(list(dict.fromkeys(moderation_flags)))
+
+    if 'username' in update_data:
+        if not update_data['username']:
+            raise ValueError("Username can't be empty.")
+        update_data['username_normalized'] = normalize_username(update_data['username'])
+
+    claims_changed = any(field in update_data for field in TOKEN_CLAIM_FIELDS)
+    if claims_changed:
+        update_data['claims_version'] = firestore.Increment(1)
 
     if 'username' in update_data:
-        existing_user = get_user_by_username(update_data['username'])
-        if existing_user and existing_user['anonymous_id'] != anonymous_id:
-            raise ValueError(f"Username '{update_data['username']}' already exists.")
+        try:
+            stored_user = _update_with_username(anonymous_id, update_data)
+        finally:
+            invalidate_cached_user(anonymous_id)
+        if stored_user is None:
+            return None
+        invalidate_user_search_cache(stored_user.get('username'))
+        invalidate_user_search_cache(update_data['username'])
+        # The transaction read the stored user; its commit time isn't reported back.
+        current_user, update_time = stored_user, datetime.now(timezone.utc)
+        claims_version = stored_user.get('claims_version', 0) + 1
+    else:
+        try:
+            write_result = doc_ref.update(update_data) # Fails if the user was deleted meanwhile
+        except NotFound:
+            write_result = None
+        invalidate_cached_user(anonymous_id)
+        if write_result is None:
+            return None
+        update_time = write_result.update_time
+        if claims_changed:
+            # current_user may come from user_cache, so read the incremented version back.
+            claims_version = (doc_ref.get(field_paths=['claims_version']).to_dict() or {}).get('claims_version', 0)
 
-    doc_ref.update(update_data)
-    return doc_ref.get().to_dict()
+    author_fields_changed = any(
+        field in update_data and update_data[field] != current_user.get(field)
+        for field in DENORMALIZED_AUTHOR_FIELDS
+    )
+    updated_user = merge_update(current_user, update_data, update_time)
+    if claims_changed:
+        # Resolve the Increment sentinel with the stored version.
+        updated_user['claims_version'] = claims_version
+        # Stateless access tokens carrying the old claims are rejected on this instance.
+        token_denylist.set_min_claims_version(anonymous_id, updated_user['claims_version'])
+    if author_fields_changed:
+        # Rewrite the author copies stored on the user's posts and comments.
+        author_fanout_service.schedule_author_fanout(anonymous_id)
+    return updated_user
 
-def delete_user(anonymous_id: str) -> bool:
+def revoke_refresh_tokens(anonymous_id: str) -> bool:
     """
-    Deletes a user and all of their content (posts and comments) from Firestore.
+    Invalidates every refresh token issued to the user by bumping their token_version.
     """
-    # Delete user's posts
-    user_posts = post_service.get_posts_by_author(anonymous_id)
-    for post in user_posts:
-        post_service.delete_post(post['post_id'])
+    doc_ref = get_users_collection().document(anonymous_id)
+    try:
+        doc_ref.update({'token_version': firestore.Increment(1)})
+    except NotFound:
+        return False
+    invalidate_cached_user(anonymous_id)
+    return True
 
-    # Delete user's comments
-    user_comments = comment_service.get_comments_by_author(anonymous_id)
-    for comment in user_comments:
-        comment_service.delete_comment(comment['post_id'], comment['comment_id'])
+def delete_user(anonymous_id: str) -> Optional[dict]:
+    """
+    Deletes a user document and schedules the deletion of all of their content (posts,
+    comments, chats, chat requests and relationships) as a background job.
+    Returns the job, or None if the user doesn't exist.
+    The user's username reservation is released with the user document.
+    """
+    db = firestore.client()
+    doc_ref = get_users_collection().document(anonymous_id)
+    usernames_collection = get_usernames_collection()
 
-    # Delete the user document
-    users_collection = get_users_collection()
-    doc_ref = users_collection.document(anonymous_id)
-    doc = doc_ref.get()
-    if doc.exists:
-        doc_ref.delete()
-        return True
-    return False
+    @firestore.transactional
+    def delete_in_transaction(transaction):
+        snapshot = doc_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        user = snapshot.to_dict()
+        username = user.get('username')
+        if username:
+            reservation_ref = usernames_collection.document(username_key(username))
+            reservation = reservation_ref.get(transaction=transaction)
+            if reservation.exists and reservation.get('anonymous_id') == anonymous_id:
+                transaction.delete(reservation_ref)
+        transaction.delete(doc_ref)
+        return user
+
+    deleted_user = delete_in_transaction(db.transaction())
+    if deleted_user is None:
+        return None
+    invalidate_user_search_cache(deleted_user.get('username'))
+    invalidate_cached_user(anonymous_id)
+    token_denylist.set_min_claims_version(anonymous_id, float('inf'))
+    return deletion_service.schedule_account_deletion(anonymous_id)
@@ -0,0 +1,176 @@
+import asyncio
+import json
+
+import pytest
+
+from app.core import pubsub
+from app.core.chat_manager import ConnectionManager
+from app.core.config import settings
+
+QUEUE_SIZE = 5
+MESSAGES = 20
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.frames = []
+        self.closed_with = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.frames.append(json.loads(text))
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed_with = code
+
+    def contents(self):
+        return [frame["payload"]["content"] for frame in self.frames if frame["type"] == "new_message"]
+
+
+class SlowWebSocket(RecordingWebSocket):
+    """
+    A client that stops reading: send_text blocks until released.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.sending = asyncio.Event()
+        self.released = asyncio.Event()
+
+    async def send_text(self, text: str):
+        self.sending.set()
+        await self.released.wait()
+        await super().send_text(text)
+
+
+class BrokenWebSocket(RecordingWebSocket):
+    async def send_text(self, text: str):
+        raise RuntimeError("connection reset")
+
+
+async def _settle(condition, timeout: float = 1.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not reached in time")
+        await asyncio.sleep(0.01)
+
+
+async def _room_with_slow_member(policy: str):
+    manager = ConnectionManager(pubsub.InMemoryBroker(), slow_consumer_policy=policy)
+    manager.queue_size = QUEUE_SIZE
+    fast, other, slow = RecordingWebSocket(), RecordingWebSocket(), SlowWebSocket()
+    await manager.connect(fast, "room", "fast")
+    await manager.connect(other, "room", "other")
+    await manager.connect(slow, "room", "slow")
+    return manager, fast, other, slow
+
+
+async def _broadcast_while_slow_blocks(manager, fast, other, slow):
+    """
+    Sends MESSAGES messages while `slow` is stuck on the first one. The other members
+    must get every message promptly, and the slow member's queue must stay bounded.
+    """
+    await manager.broadcast_to_room_dict("room", {"content": 0}, "fast", message_id="m0")
+    await _settle(slow.sending.is_set)
+    max_depth = 0
+    for i in range(1, MESSAGES):
+        await manager.broadcast_to_room_dict("room", {"content": i}, "fast", message_id=f"m{i}")
+        await asyncio.sleep(0.005)
+        max_depth = max(max_depth, manager.stats()["max_queue_depth"])
+    await _settle(lambda: len(fast.contents()) == MESSAGES and len(other.contents()) == MESSAGES, timeout=0.5)
+    assert fast.contents() == other.contents() == list(range(MESSAGES))
+    assert max_depth <= QUEUE_SIZE
+
+
+@pytest.fixture(autouse=True)
+def send_timeout(monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_SEND_TIMEOUT_SECONDS", 2.0)
+
+
+def test_drop_policy_keeps_the_newest_frames():
+    async def scenario():
+        manager, fast, other, slow = await _room_with_slow_member("drop")
+        await _broadcast_while_slow_blocks(manager, fast, other, slow)
+        slow.released.set()
+        await _settle(lambda: manager.stats()["queued_frames"] == 0)
+        # The frame in flight, then the newest QUEUE_SIZE.
+        assert slow.contents() == [0] + list(range(MESSAGES - QUEUE_SIZE, MESSAGES))
+        assert manager.frames_dropped == MESSAGES - 1 - QUEUE_SIZE
+        await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_coalesce_policy_sends_a_resync_frame():
+    async def scenario():
+        manager, fast, other, slow = await _room_with_slow_member("coalesce")
+        await _broadcast_while_slow_blocks(manager, fast, other, slow)
+        slow.released.set()
+        await _settle(lambda: manager.stats()["queued_frames"] == 0)
+
+        resyncs = [frame for frame in slow.frames if frame["type"] == "resync"]
+        assert len(resyncs) == 1
+        assert resyncs[0]["payload"] == {"room_id": "room", "missed_messages": manager.frames_coalesced}
+        # Everything the slow member got or was told it missed adds up.
+        assert len(slow.contents()) + manager.frames_coalesced == MESSAGES
+        assert slow.contents()[-1] == MESSAGES - 1
+        await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_disconnect_policy_closes_the_slow_socket():
+    async def scenario():
+        manager, fast, other, slow = await _room_with_slow_member("disconnect")
+        await _broadcast_while_slow_blocks(manager, fast, other, slow)
+        await _settle(lambda: slow.closed_with is not None)
+        assert slow.closed_with == 1013
+        assert manager.slow_disconnects == 1
+        assert [connection.user_id for connection in manager.active_connections["room"]] == ["fast", "other"]
+        await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_failed_send_removes_the_socket():
+    async def scenario():
+        manager = ConnectionManager(pubsub.InMemoryBroker())
+        healthy, broken = RecordingWebSocket(), BrokenWebSocket()
+        await manager.connect(healthy, "room", "healthy")
+        await manager.connect(broken, "room", "broken")
+        await manager.broadcast_to_room_dict("room", {"content": "hello"}, "healthy", message_id="m1")
+        await _settle(lambda: broken.closed_with is not None)
+
+        assert broken.closed_with == 1011
+        assert manager.dead_sockets == 1
+        assert [connection.user_id for connection in manager.active_connections["room"]] == ["healthy"]
+        # Later messages still reach the others, and nothing is queued for the dead socket.
+        await manager.broadcast_to_room_dict("room", {"content": "again"}, "healthy", message_id="m2")
+        await _settle(lambda: healthy.contents() == ["hello", "again"])
+        assert manager.stats()["connections"] == 1
+        await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_timed_out_send_removes_the_socket(monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_SEND_TIMEOUT_SECONDS", 0.1)
+
+    async def scenario():
+        manager = ConnectionManager(pubsub.InMemoryBroker())
+        healthy, stuck = RecordingWebSocket(), SlowWebSocket()
+        await manager.connect(healthy, "room", "healthy")
+        await manager.connect(stuck, "room", "stuck")
+        await manager.broadcast_to_room_dict("room", {"content": "hello"}, "healthy", message_id="m1")
+        await _settle(lambda: stuck.closed_with is not None)
+
+        assert stuck.closed_with == 1011
+        assert manager.dead_sockets == 1
+        assert healthy.contents() == ["hello"]
+        assert [connection.user_id for connection in manager.active_connections["room"]] == ["healthy"]
+        await manager.stop()
+
+    asyncio.run(scenario())
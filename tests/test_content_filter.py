@@ -0,0 +1,48 @@
+import pytest
+
+from app.core.content_filter import ContentFilter, mask
+
+CATEGORIES = {
+    "crisis": {"action": "flag", "phrases": ["want to die", "kill myself"]},
+    "profanity": {"action": "mask", "phrases": ["ass", "sucks"]},
+    "spam": {"action": "reject", "phrases": ["buy followers", "followers now"]},
+}
+
+
+def _phrases(matches):
+    return [phrase for _, phrase, _, _ in matches]
+
+
+def test_phrases_match_whole_words_only():
+    content_filter = ContentFilter(CATEGORIES)
+    assert content_filter.scan("My class was a bit of a mess, I passed anyway.") == []
+    assert content_filter.scan("I skill myself up every day") == []
+    assert _phrases(content_filter.scan("Don't be an ass.")) == ["ass"]
+
+
+def test_leetspeak_case_accents_and_elongation_match():
+    content_filter = ContentFilter(CATEGORIES)
+    for text in ("I want to k1ll myself", "I WANT TO KILL MYSELF", "i want to kiiiill myseeelf",
+                 "this $uck$", "this 5ucks", "I wánt tó díe"):
+        assert content_filter.scan(text), text
+    # The non-ASCII path normalizes the same way.
+    assert _phrases(content_filter.scan("This $ucks — truly")) == ["sucks"]
+
+
+def test_offsets_cover_the_original_text_and_mask_it():
+    content_filter = ContentFilter(CATEGORIES)
+    text = "Honestly I want   to  die."
+    [(category, phrase, start, end)] = content_filter.scan(text)
+    assert (category, phrase) == ("crisis", "want to die")
+    assert text[start:end] == "want   to  die"
+    assert mask("That $ucks, you @ss", content_filter.scan("That $ucks, you @ss")) == "That *****, you ***"
+
+
+def test_overlapping_phrases_are_all_reported():
+    content_filter = ContentFilter(CATEGORIES)
+    assert _phrases(content_filter.scan("buy followers now")) == ["buy followers", "followers now"]
+
+
+def test_unknown_action_is_rejected():
+    with pytest.raises(ValueError):
+        ContentFilter({"x": {"action": "ban", "phrases": ["x"]}})
@@ -0,0 +1,76 @@
+import random
+
+from app.core import duplicate_detector
+from app.core.duplicate_detector import DuplicateIndex, normalize_text, signature, similarity
+
+WORDS = (
+    "anxious tired lonely work family sleep night morning friends therapy walk help talk "
+    "better worse today week month school exams money future hope support calm breathe"
+).split()
+
+
+def _shingles(text: str) -> set:
+    size = duplicate_detector.SHINGLE_SIZE
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _jaccard(a: str, b: str) -> float:
+    a, b = _shingles(a), _shingles(b)
+    return len(a & b) / len(a | b)
+
+
+def _edited(rng: random.Random, words: list, edits: int) -> list:
+    words = list(words)
+    for _ in range(edits):
+        words[rng.randrange(len(words))] = rng.choice(WORDS)
+    return words
+
+
+def test_cosmetic_variations_are_exact_copies():
+    original = normalize_text("I can't sleep, and work is   overwhelming me!")
+    variant = normalize_text("i CAN'T sleep and wórk is overwhelming me")
+    assert original == variant
+    assert similarity(signature(original), signature(variant)) == 1.0
+    assert signature("abc") is None
+
+
+def test_near_duplicates_are_found_at_the_threshold():
+    rng = random.Random(7)
+    threshold = 0.6
+    found = total = false_positives = 0
+    for trial in range(100):
+        words = [rng.choice(WORDS) for _ in range(40)]
+        original = " ".join(words)
+        index = DuplicateIndex(max_entries=100, max_age=3600)
+        index.add("original", signature(original), now=0)
+        for edits in (1, 2, 4, 8, 30):
+            variant = " ".join(_edited(rng, words, edits))
+            hit = bool(index.query(signature(variant), threshold, now=1))
+            if _jaccard(original, variant) >= threshold + 0.1:
+                total += 1
+                found += hit
+            elif _jaccard(original, variant) < threshold - 0.2:
+                false_positives += hit
+    assert total > 100
+    # LSH with 32 bands of 4 rows: >99% recall this far above the threshold.
+    assert found / total >= 0.97
+    assert false_positives == 0
+
+
+def test_long_texts_hash_in_chunks(monkeypatch):
+    text = normalize_text(" ".join(WORDS * 50))
+    expected = signature(text)
+    monkeypatch.setattr(duplicate_detector, "MAX_HASH_MATRIX_SIZE", 1000)
+    assert (signature(text) == expected).all()
+
+
+def test_entries_expire_and_are_evicted():
+    sig = signature(normalize_text("the same words over and over again"))
+    index = DuplicateIndex(max_entries=2, max_age=60)
+    index.add("a", sig, "author-a", now=0)
+    index.add("b", sig, "author-b", now=10)
+    index.add("c", sig, "author-c", now=20)
+    assert {key for key, _, _, _ in index.query(sig, 0.9, now=30)} == {"b", "c"}
+    assert {key for key, _, _, _ in index.query(sig, 0.9, now=75)} == {"c"}
+    index.remove_prefix("c")
+    assert index.query(sig, 0.9, now=75) == []
@@ -0,0 +1,143 @@
+import asyncio
+import json
+
+import pytest
+
+from app.core import pubsub
+from app.core.chat_manager import ConnectionManager
+
+
+class StandInServer:
+    """
+    Minimal Redis-protocol server: PUBLISH, SUBSCRIBE and UNSUBSCRIBE, like a real one.
+    """
+
+    def __init__(self):
+        self.subscribers = {} # channel -> set of writers
+        self.server = None
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def subscriber_count(self, channel: str) -> int:
+        return len(self.subscribers.get(channel.encode(), ()))
+
+    @staticmethod
+    def _bulk(value: bytes) -> bytes:
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                command = await pubsub._read_reply(reader)
+                name, args = command[0].upper(), command[1:]
+                if name == b"SUBSCRIBE":
+                    for channel in args:
+                        self.subscribers.setdefault(channel, set()).add(writer)
+                        writer.write(b"*3\r\n" + self._bulk(b"subscribe") + self._bulk(channel) + b":1\r\n")
+                elif name == b"UNSUBSCRIBE":
+                    for channel in args:
+                        self.subscribers.get(channel, set()).discard(writer)
+                        writer.write(b"*3\r\n" + self._bulk(b"unsubscribe") + self._bulk(channel) + b":0\r\n")
+                elif name == b"PUBLISH":
+                    channel, data = args
+                    receivers = self.subscribers.get(channel, set())
+                    for receiver in receivers:
+                        receiver.write(b"*3\r\n" + self._bulk(b"message") + self._bulk(channel) + self._bulk(data))
+                    writer.write(b":%d\r\n" % len(receivers))
+                else:
+                    writer.write(b"-ERR unknown command\r\n")
+                await writer.drain()
+        except (pubsub.BrokerError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for receivers in self.subscribers.values():
+                receivers.discard(writer)
+            writer.close()
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.received = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.received.append(json.loads(text)["payload"]["content"])
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        pass
+
+
+async def _settle(condition, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not reached in time")
+        await asyncio.sleep(0.01)
+
+
+def test_broker_is_abstract():
+    with pytest.raises(TypeError):
+        pubsub.Broker()
+
+
+def test_redis_broker_delivers_across_managers():
+    async def scenario():
+        server = StandInServer()
+        port = await server.start()
+        first = ConnectionManager(pubsub.RedisBroker(f"redis://127.0.0.1:{port}"))
+        second = ConnectionManager(pubsub.RedisBroker(f"redis://127.0.0.1:{port}"))
+        sender, reader, blocked = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        channel = ConnectionManager.channel_for("room")
+        try:
+            await first.connect(sender, "room", "sender")
+            await second.connect(reader, "room", "reader")
+            await second.connect(blocked, "room", "blocked")
+            await _settle(lambda: server.subscriber_count(channel) == 2)
+
+            await first.broadcast_to_room_dict(
+                "room", {"content": "hello"}, "sender", excluded_recipient_ids={"blocked"}, message_id="m1"
+            )
+            # A retried publish of the same message is delivered once.
+            await first.broadcast_to_room_dict("room", {"content": "hello"}, "sender", message_id="m1")
+            await second.broadcast_to_room_dict("room", {"content": "hi back"}, "reader", message_id="m2")
+            await _settle(lambda: len(sender.received) == 2 and len(reader.received) == 2)
+            await asyncio.sleep(0.05)
+
+            assert sender.received == ["hello", "hi back"]
+            assert reader.received == ["hello", "hi back"]
+            assert blocked.received == ["hi back"]
+
+            await second.disconnect(reader, "room", "reader")
+            await second.disconnect(blocked, "room", "blocked")
+            await _settle(lambda: server.subscriber_count(channel) == 1)
+            assert second.broker.stats()["channels"] == 0
+        finally:
+            await first.stop()
+            await second.stop()
+            await server.stop()
+
+    asyncio.run(scenario())
+
+
+def test_in_memory_broker_shared_by_managers():
+    async def scenario():
+        broker = pubsub.InMemoryBroker()
+        first, second = ConnectionManager(broker), ConnectionManager(broker)
+        sender, reader = FakeWebSocket(), FakeWebSocket()
+        await first.connect(sender, "room", "sender")
+        await second.connect(reader, "room", "reader")
+        await first.broadcast_to_room_dict("room", {"content": "hello"}, "sender", message_id="m1")
+        await _settle(lambda: sender.received and reader.received)
+        assert sender.received == reader.received == ["hello"]
+        await first.stop()
+        await second.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.core import ranking
+from app.core.config import settings
+
+
+def test_wilson_lower_bound_known_values():
+    assert ranking.top_score(0, 0) == 0.0
+    assert ranking.top_score(1, 0) == pytest.approx(0.2065, abs=1e-4)
+    assert ranking.top_score(10, 0) == pytest.approx(0.7225, abs=1e-4)
+    assert ranking.top_score(0, 10) == 0.0
+    # Negative or missing counters (e.g. a stale shard sum) don't break the bound.
+    assert ranking.top_score(None, -3) == 0.0
+
+
+def test_wilson_bound_prefers_confidence():
+    assert ranking.top_score(40, 2) > ranking.top_score(2, 0)
+    assert ranking.top_score(100, 10) > ranking.top_score(10, 1)
+    for upvotes, downvotes in ((1, 0), (5, 5), (40, 2), (900, 100)):
+        score = ranking.top_score(upvotes, downvotes)
+        assert 0 <= score <= upvotes / (upvotes + downvotes)
+
+
+def test_hot_score_trades_votes_for_age():
+    now = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    younger = now + timedelta(seconds=settings.HOT_SCORE_TIME_DECAY_SECONDS)
+    # A post one decay period younger needs 10x fewer net votes.
+    assert ranking.hot_score(10, 0, younger) == pytest.approx(ranking.hot_score(100, 0, now))
+    assert ranking.hot_score(5, 0, now) > ranking.hot_score(0, 0, now) > ranking.hot_score(0, 5, now)
+    # Naive datetimes are taken as UTC.
+    assert ranking.hot_score(3, 1, now.replace(tzinfo=None)) == ranking.hot_score(3, 1, now)
+    assert set(ranking.post_scores(1, 0, now)) == {ranking.HOT_SCORE_FIELD, ranking.TOP_SCORE_FIELD}
@@ -0,0 +1,74 @@
+import numpy as np
+
+from app.core import related_index as related_index_module
+from app.core.related_index import RelatedIndex, hash_features
+from app.core.search_index import tokenize
+
+POSTS = {
+    "exams": "anxious about exams and studying late every night",
+    "exams-2": "studying for exams makes me anxious at night",
+    "breakup": "my partner left and the breakup hurts so much",
+    "work": "my boss shouts at work and I dread mondays",
+}
+
+
+def _index(max_rows: int = 100) -> RelatedIndex:
+    index = RelatedIndex(max_rows=max_rows)
+    for key, text in POSTS.items():
+        index.add(key, tokenize(text))
+    return index
+
+
+def _related(index: RelatedIndex, text: str, exclude=()):
+    return [key for key, _ in index.query(hash_features(tokenize(text)), k=3, exclude=exclude)]
+
+
+def test_most_similar_first_before_and_after_compaction():
+    index = _index()
+    vector = index.vector_for("exams")
+    before = index.query(vector, k=3, exclude=["exams"])
+    assert before[0][0] == "exams-2"
+    index.compact()
+    assert index.stats()["delta_rows"] == 0
+    after = index.query(vector, k=3, exclude=["exams"])
+    assert [key for key, _ in after] == [key for key, _ in before]
+    assert after[0][1] > 0.3
+
+
+def test_compaction_replays_edits_made_while_it_runs(monkeypatch):
+    index = _index()
+    index.compact()
+    real_cumsum = np.cumsum
+
+    def cumsum_with_concurrent_edits(*args, **kwargs):
+        # Runs between the snapshot and the swap, outside the index lock.
+        monkeypatch.setattr(related_index_module.np, "cumsum", real_cumsum)
+        index.add("breakup", tokenize("my dog died and I miss him every day"))
+        index.remove("work")
+        index.add("new", tokenize("my boss shouts at work every monday"))
+        return real_cumsum(*args, **kwargs)
+
+    index.add("exams-3", tokenize("exams again"))
+    monkeypatch.setattr(related_index_module.np, "cumsum", cumsum_with_concurrent_edits)
+    index.compact()
+
+    assert len(index) == 5
+    assert "work" not in index
+    assert _related(index, "shouting boss at work") == ["new"]
+    assert "breakup" not in _related(index, "partner breakup hurts")
+    assert _related(index, "miss my dog")[0] == "breakup"
+    stats = index.stats()
+    # The stale base copy of the edited row is masked; the live edits wait in the delta.
+    assert stats["base_dead"] == 2
+    assert stats["delta_rows"] == 2
+
+    index.compact()
+    assert index.stats() == {"documents": 5, "base_rows": 5, "base_dead": 0, "delta_rows": 0}
+    assert _related(index, "shouting boss at work") == ["new"]
+
+
+def test_oldest_rows_are_evicted():
+    index = _index(max_rows=3)
+    assert "exams" not in index
+    assert len(index) == 3
+    assert "exams" not in _related(index, "anxious about exams")
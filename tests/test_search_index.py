@@ -0,0 +1,50 @@
+from app.core.search_index import SearchIndex
+
+
+def _keys(hits):
+    return [key for key, _, _ in hits]
+
+
+def _index():
+    index = SearchIndex()
+    index.add("post:1", "anxiety anxiety anxiety before exams", {"id": "1"})
+    index.add("post:2", "anxiety before exams and a long walk in the park with friends on sunday", {"id": "2"})
+    index.add("post:3", "exams exams exams", {"id": "3"})
+    index.add("comment:1:a", "insomnia and anxiety", {"id": "a"})
+    return index
+
+
+def test_bm25_ranks_term_frequency_rarity_and_length():
+    index = _index()
+    # More occurrences of the term in a document of similar length rank higher.
+    assert _keys(index.search("anxiety", prefix=False))[0] == "post:1"
+    # The rare term outweighs the common one.
+    assert _keys(index.search("insomnia exams", prefix=False))[0] == "comment:1:a"
+    # Same term frequency, shorter document first.
+    ranked = _keys(index.search("anxiety", prefix=False))
+    assert ranked.index("comment:1:a") < ranked.index("post:2")
+    hits = index.search("anxiety exams walk", prefix=False)
+    assert all(a[1] >= b[1] for a, b in zip(hits, hits[1:]))
+
+
+def test_prefix_and_key_prefix():
+    index = _index()
+    assert set(_keys(index.search("insom"))) == {"comment:1:a"}
+    assert index.search("insom", prefix=False) == []
+    assert set(_keys(index.search("anxiety", key_prefix="post:"))) == {"post:1", "post:2"}
+
+
+def test_ranking_survives_save_and_load(tmp_path):
+    index = _index()
+    expected = index.search("anxiety exams")
+    path = str(tmp_path / "index.bin")
+    index.save(path)
+    loaded = SearchIndex()
+    loaded.load(path)
+    assert loaded.search("anxiety exams") == expected
+
+    # Removals and re-adds on top of the saved base.
+    loaded.remove("post:1")
+    loaded.add("post:3", "nothing relevant", {"id": "3"})
+    assert _keys(loaded.search("exams", prefix=False)) == ["post:2"]
+    assert loaded.search("exams", prefix=False)[0][2] == {"id": "2"}